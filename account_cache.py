@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+from clock import now_ms
+
+BALANCE_TTL_MS = 60000  # старше этого баланс считается неизвестным и запрашивается синхронно
+BALANCE_REFRESH_MS = 20000  # как часто фоновый поток обновляет балансы
+FILTERS_REFRESH_MS = 3600000  # как часто обновляются фильтры инструментов
+
+
+class BalanceCache:
+    '''
+    Кэш балансов монет аккаунта
+    Обновляется из сообщений вебсокета wallet и фоновым потоком раз в refresh_ms
+    После наших исполнений кэш инвалидируется и фоновый поток сразу его обновляет
+    Принимает функцию fetch, которая возвращает список монет (get_coin_balance(coin=False))
+    '''
+    def __init__(self, fetch, ttl_ms=BALANCE_TTL_MS, refresh_ms=BALANCE_REFRESH_MS):
+        self.fetch = fetch
+        self.ttl_ms = ttl_ms
+        self.refresh_ms = refresh_ms
+        self.balances = {}
+        self.updated = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.refresher, daemon=True)
+            self.thread.start()
+
+    def refresher(self):
+        while True:
+            self.refresh()
+            self.wake.wait(self.refresh_ms / 1000)
+            self.wake.clear()
+
+    def refresh(self):
+        '''
+        Функция запрашивает все балансы одним вызовом
+        Любая ошибка только пишется в лог: фоновый поток и торговля не должны из-за нее падать
+        '''
+        try:
+            coins = self.fetch(False)
+            if coins is not False:
+                self.update(coins)
+                return True
+        # pybit бросает свои исключения на ошибки биржи и на сеть, когда кончились его повторы
+        except Exception as e:
+            logging.info(f'Error refreshing balances: {e}')
+            return False
+        logging.info('Error refreshing balances')
+        return False
+
+    def update(self, coins):
+        with self.lock:
+            for coin in coins:
+                self.balances[coin['coin']] = float(coin['walletBalance'] or 0)
+            self.updated = now_ms()
+
+    def invalidate(self):
+        '''
+        Функция просит фоновый поток обновить балансы, например после нашего исполнения
+        '''
+        self.wake.set()
+
+    def get(self, coin):
+        '''
+        Функция возвращает баланс монеты из кэша
+        По сети идет, только если кэш старше ttl_ms
+        '''
+        if now_ms() - self.updated > self.ttl_ms:
+            logging.info('Balances are stale, refreshing')
+            if not self.refresh():
+                return False
+        with self.lock:
+            return self.balances.get(coin, 0.0)
+
+    def on_wallet_message(self, message):
+        '''
+        Обработчик сообщений вебсокета wallet
+        '''
+        for account in message['data']:
+            self.update(account['coin'])
+
+    def on_execution_message(self, message):
+        '''
+        Обработчик сообщений вебсокета execution: после исполнения балансы изменились
+        '''
+        self.invalidate()
+
+
+class FilterCache:
+    '''
+    Кэш фильтров ордера по парам
+    Фоновый поток перезапрашивает фильтры всех известных пар раз в refresh_ms
+    Принимает функцию fetch, которая возвращает фильтры пары (get_order_filters)
+    '''
+    def __init__(self, fetch, refresh_ms=FILTERS_REFRESH_MS):
+        self.fetch = fetch
+        self.refresh_ms = refresh_ms
+        self.filters = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.refresher, daemon=True)
+            self.thread.start()
+
+    def refresher(self):
+        while True:
+            time.sleep(self.refresh_ms / 1000)
+            for pair in list(self.filters):
+                self.refresh(pair)
+
+    def refresh(self, pair):
+        '''
+        Функция запрашивает фильтры пары, ошибка только пишется в лог, как и у балансов
+        '''
+        try:
+            order_filters = self.fetch(pair)
+        except Exception as e:
+            logging.info(f'Error refreshing order filters for {pair}: {e}')
+            return False
+        if not order_filters:
+            logging.info(f'Error refreshing order filters for {pair}')
+            return False
+        with self.lock:
+            old = self.filters.get(pair)
+            self.filters[pair] = order_filters
+        if old and old != order_filters:
+            logging.info(f'Order filters changed for {pair}: {order_filters}')
+        return order_filters
+
+    def get(self, pair):
+        '''
+        Функция возвращает фильтры пары из кэша, при первом обращении запрашивает их
+        '''
+        with self.lock:
+            order_filters = self.filters.get(pair)
+        return order_filters or self.refresh(pair)
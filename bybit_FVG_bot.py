@@ -1,39 +1,114 @@
-from pybit.unified_trading import HTTP
 import time
+import uuid
 import threading
 import logging
-import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from requests.exceptions import ConnectionError
 from api_keys import API_KEY, API_SECRET
+from fvg_config import load_config
+from kline_feed import KlineFeed, StreamKlineFeed, candles_to_klines
+from kline_store import open_store, interval_ms
+from kline_resampler import KlineResampler, SOURCE_TIME_FRAME, SOURCE_MS
+from account_cache import BalanceCache, FilterCache
+from order_tracker import OrderTracker
+from order_gateway import OrderGateway
+from request_scheduler import RequestScheduler, RATE_LIMIT_CODE
+from fvg_zones import ZoneStore
+from ticks import tick_scale
+from clock import now_ms
+from event_journal import (EventJournal, SNAPSHOT_EVERY, CANDLE, FVG_FOUND, FVG_EXPANDED, FVG_COVERED,
+                           ZONE_ADDED, ORDER_SENT, FILL)
+from metrics import timed, histogram, gauge, instrument_client, start_metrics_server, stats, METRICS_PORT
+
+CONFIG = load_config()  # настройки из файла FVG_CONFIG заменяют константы ниже
 
 logging.basicConfig(
     level=logging.INFO,
-    filename='pybit.log',
+    filename=CONFIG.get('LOG_FILE', 'pybit.log'),  # None - в stderr, например под супервизором
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-spot_client = HTTP(
-    testnet=True,
-    api_key=API_KEY,
-    api_secret=API_SECRET,
-)
+TESTNET = CONFIG.get('TESTNET', True)
+API_KEY = CONFIG.get('API_KEY', API_KEY)
+API_SECRET = CONFIG.get('API_SECRET', API_SECRET)
+
+
+def make_client():
+    '''
+    Функция создает клиента биржи
+    Вызывается при первом запросе к бирже, поэтому импорт pybit и сессия не замедляют запуск
+    '''
+    from pybit.unified_trading import HTTP
+    client = HTTP(
+        testnet=TESTNET,
+        api_key=API_KEY,
+        api_secret=API_SECRET,
+        return_response_headers=True,  # по заголовкам планировщик следит за лимитами биржи
+    )
+    # превышение лимита (10006) обрабатывает планировщик: pybit иначе спит внутри вызова и держит поток
+    client.retry_codes = client.retry_codes - {RATE_LIMIT_CODE}
+    # замеряем каждый вызов биржи
+    return instrument_client(client, ['get_kline', 'get_wallet_balance', 'get_instruments_info', 'get_open_orders',
+                                      'place_order', 'place_batch_order', 'cancel_order', 'cancel_batch_order'])
+
+
+# все потоки ходят на биржу через один планировщик с лимитами и объединением одинаковых чтений
+spot_client = RequestScheduler(factory=make_client)
+SCHEDULER = spot_client
+ORDER_GATEWAY = OrderGateway(spot_client)
 
 KLINE_KEYS = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'turnover']
-PAIR = "BTCUSDT"
-TIME_FRAME = "15"
-TIME_FRAME_MS = 900000
-FVG_DICT = {'low': [], 'high': []}
-COVER_NEIGHBORS_BULL = 3
-COVER_NEIGHBORS_BEAR = 3
-EXPAND_NEIGHBORS_BULL = 3
-EXPAND_NEIGHBORS_BEAR = 3
-START_TRADE = 0.2
-STOP_LOSS_OFFSET = 0.1
-RISK_REWARD_RATIO = 2
-RISK = 0.03
-LEVER = 1
-MAX_TRADE_DURATION = 9000000
-MAX_ORDER_DURATION = 9000000
+PAIR = CONFIG.get('PAIR', "BTCUSDT")
+TIME_FRAME = CONFIG.get('TIME_FRAME', "15")
+TIME_FRAME_MS = interval_ms(TIME_FRAME)
+# несколько тайм фреймов из одного минутного потока, например ["5", "15", "60", "240"], None - только TIME_FRAME
+TIME_FRAMES = CONFIG.get('TIME_FRAMES', None)
+FVG_DICT = {'low': [], 'high': []}  # словарь FVG по умолчанию, у каждой ожидающей FVG в FVGStateMachine свой словарь
+ZONE_STORE = ZoneStore()  # FVG, прошедшие проверку, до исполнения или пробоя
+COVER_NEIGHBORS_BULL = CONFIG.get('COVER_NEIGHBORS_BULL', 3)
+COVER_NEIGHBORS_BEAR = CONFIG.get('COVER_NEIGHBORS_BEAR', 3)
+EXPAND_NEIGHBORS_BULL = CONFIG.get('EXPAND_NEIGHBORS_BULL', 3)
+EXPAND_NEIGHBORS_BEAR = CONFIG.get('EXPAND_NEIGHBORS_BEAR', 3)
+START_TRADE = CONFIG.get('START_TRADE', 0.2)
+STOP_LOSS_OFFSET = CONFIG.get('STOP_LOSS_OFFSET', 0.1)
+RISK_REWARD_RATIO = CONFIG.get('RISK_REWARD_RATIO', 2)
+RISK = CONFIG.get('RISK', 0.03)
+LEVER = CONFIG.get('LEVER', 1)
+MAX_TRADE_DURATION = CONFIG.get('MAX_TRADE_DURATION', 9000000)
+MAX_ORDER_DURATION = CONFIG.get('MAX_ORDER_DURATION', 9000000)
+KLINE_SOURCE = CONFIG.get('KLINE_SOURCE', "stream")  # "stream" - вебсокет с добором по REST, "poll" - только опрос по REST
+KLINE_STORE_DIR = CONFIG.get('KLINE_STORE_DIR', "klines")  # папка локального хранилища свечей, None - не хранить свечи
+KLINE_PAGE_LIMIT = 1000  # максимум свечей в одном ответе биржи
+METRICS_PORT = CONFIG.get('METRICS_PORT', METRICS_PORT)  # порт /metrics, None - не поднимать
+JOURNAL_DIR = CONFIG.get('JOURNAL_DIR', "journal")  # папка журнала событий для быстрого перезапуска, None - без журнала
+JOURNAL = EventJournal(JOURNAL_DIR) if JOURNAL_DIR else None
+# ордера, выставленные ботом: orderLinkId -> параметры и исполненное количество
+# трекер и order_canceller закрывают только эти ордера и их TP/SL, после перезапуска они восстанавливаются из журнала
+OWN_ORDERS = {}
+TPSL_QTY_TOLERANCE = 0.002  # TP/SL может быть меньше исполненного на комиссию, удержанную в купленной монете
+
+
+def strategy_settings(settings=None):
+    '''
+    Функция возвращает настройки стратегии из констант модуля
+    Значения из settings переопределяют константы
+    '''
+    defaults = {
+        'cover_neighbors_bull': COVER_NEIGHBORS_BULL,
+        'cover_neighbors_bear': COVER_NEIGHBORS_BEAR,
+        'expand_neighbors_bull': EXPAND_NEIGHBORS_BULL,
+        'expand_neighbors_bear': EXPAND_NEIGHBORS_BEAR,
+        'start_trade': START_TRADE,
+        'stop_loss_offset': STOP_LOSS_OFFSET,
+        'risk_reward_ratio': RISK_REWARD_RATIO,
+        'risk': RISK,
+        'lever': LEVER,
+        'max_order_duration': MAX_ORDER_DURATION,
+        'max_trade_duration': MAX_TRADE_DURATION,
+    }
+    defaults.update(settings or {})
+    return defaults
 
 
 def get_coin_balance(coin):
@@ -61,17 +136,18 @@ def get_coin_balance(coin):
         return False 
 
 
-def get_klines(pair, time_frame, limit):
+def fetch_klines(pair, time_frame, limit, start=None, end=None):
     '''
-    Функция возвращает свечи в виде словаря
-    Принимает торговую пару, тайм фрейм, количество свечей
+    Функция запрашивает свечи у биржи и возвращает их в виде словаря
+    Принимает торговую пару, тайм фрейм, количество свечей и, опционально, границы по времени
     '''
     try:
-        response = spot_client.get_kline(category="spot", symbol=pair, interval=time_frame, limit=limit)
+        response = spot_client.get_kline(category="spot", symbol=pair, interval=time_frame, limit=limit, start=start, end=end)
         if response['retMsg'] == "OK":
-            klines_list = response["result"]["list"]
-            klines_list = list(map(lambda sublist: [float(x) if isinstance(x, str) else x for x in sublist[::-1]], zip(*klines_list)))
-            klines_dict = dict(zip(KLINE_KEYS, klines_list))
+            # ответ идет от новых свечей к старым, разворачиваем и сразу переводим колонки в числа
+            columns = zip(*response["result"]["list"][::-1])
+            klines_dict = {key: list(map(int if key == 'open_time' else float, column))
+                           for key, column in zip(KLINE_KEYS, columns)}
             return klines_dict
         else:
             logging.info(f'Error getting klines: {response["retMsg"]}')   
@@ -81,6 +157,49 @@ def get_klines(pair, time_frame, limit):
         return False
 
 
+def get_klines(pair, time_frame, limit):
+    '''
+    Функция возвращает свечи в виде словаря
+    Принимает торговую пару, тайм фрейм, количество свечей
+    Закрытые свечи берутся из локального хранилища, у биржи запрашиваются только недостающие
+    '''
+    time_frame_ms = interval_ms(time_frame)
+    if not KLINE_STORE_DIR or time_frame_ms is None:
+        return fetch_klines(pair, time_frame, limit)
+    store = open_store(KLINE_STORE_DIR, pair, time_frame)
+    while True:
+        last = store.last_open_time()
+        now = now_ms()
+        # сколько свечей прошло с последней сохраненной, включая текущую незакрытую
+        missing = limit if last is None else int((now - last) // time_frame_ms)
+        if missing <= KLINE_PAGE_LIMIT:
+            break
+        # разрыв больше одной страницы, догружаем страницы от старых свечей к новым
+        page = fetch_klines(pair, time_frame, limit=KLINE_PAGE_LIMIT, start=last + time_frame_ms,
+                            end=last + KLINE_PAGE_LIMIT * time_frame_ms)
+        if not page or not store.append(page):
+            missing = KLINE_PAGE_LIMIT  # у биржи нет этих свечей, берем последние
+            break
+    # в хранилище с новыми свечами меньше limit: берем у биржи все limit, старые вставляем перед сохраненными
+    short = len(store) + missing < limit
+    if short:
+        missing = limit
+    klines = fetch_klines(pair, time_frame, limit=max(1, missing))
+    if not klines:
+        return False
+    # в хранилище попадают только закрытые свечи
+    closed = sum(1 for open_time in klines['open_time'] if open_time + time_frame_ms <= now)
+    closed_klines = {key: values[:closed] for key, values in klines.items()}
+    if short:
+        store.merge(closed_klines)
+    else:
+        store.append(closed_klines)
+    forming = {key: values[closed:] for key, values in klines.items()}
+    stored = store.tail(limit - len(forming['open_time']))
+    return {key: stored[key] + forming[key] for key in KLINE_KEYS}
+
+
+@timed('stage_seconds', stage='detection')
 def check_if_bear_fvg(klines):
     '''
     Функция принимает на вход 4 свечи и 
@@ -92,6 +211,7 @@ def check_if_bear_fvg(klines):
     return False
 
 
+@timed('stage_seconds', stage='detection')
 def check_if_bull_fvg(klines):
     '''
     Функция принимает на вход 4 свечи и 
@@ -103,107 +223,257 @@ def check_if_bull_fvg(klines):
     return False
 
 
-def append_fvg(klines, bear_fvg_flag, bull_fvg_flag):
+def append_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict=FVG_DICT):
     '''
     Функция добавляет найденную FVG в словарь 
     '''
     if bull_fvg_flag:
-        FVG_DICT['low'].append(klines['high'][0])
-        FVG_DICT['high'].append(klines['low'][2])
+        fvg_dict['low'].append(klines['high'][0])
+        fvg_dict['high'].append(klines['low'][2])
     elif bear_fvg_flag:
-        FVG_DICT['low'].append(klines['high'][2])
-        FVG_DICT['high'].append(klines['low'][0])
+        fvg_dict['low'].append(klines['high'][2])
+        fvg_dict['high'].append(klines['low'][0])
 
 
-def cover_fvg(klines, bear_fvg_flag, bull_fvg_flag):
+@timed('stage_seconds', stage='cover')
+def cover_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict=FVG_DICT):
     '''
     Функция проверяет, не перекрывается ли FVG противоположной свечой
     '''
     if bull_fvg_flag:
-        if klines['low'][0] < FVG_DICT['low'][-1]:  # если нижняя граница FVG больше минимума свечи
+        if klines['low'][0] < fvg_dict['low'][-1]:  # если нижняя граница FVG больше минимума свечи
             logging.info('Covered FVG')
             return True
     elif bear_fvg_flag:
-        if klines['high'][0] > FVG_DICT['high'][-1]:  # если максимум свечи выше верхней границы FVG
+        if klines['high'][0] > fvg_dict['high'][-1]:  # если максимум свечи выше верхней границы FVG
             logging.info('Covered FVG')
             return True
     return False
 
 
-def delete_fvg():
+def delete_fvg(fvg_dict=FVG_DICT):
     '''
     Функция для удаления FVG из словаря
     '''
-    FVG_DICT['low'].pop()
-    FVG_DICT['high'].pop()
+    fvg_dict['low'].pop()
+    fvg_dict['high'].pop()
 
 
-def expand_fvg(klines, bear_fvg_flag, bull_fvg_flag):
+@timed('stage_seconds', stage='expand')
+def expand_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict=FVG_DICT):
     '''
     Функция для расширения FVG
     '''
     if bull_fvg_flag:
-        if FVG_DICT['high'][-1] < klines['low'][0]:  # если верхняя грань FVG меньше минимума следующей свечи
-            FVG_DICT['high'].pop()
-            FVG_DICT['high'].append(klines['low'][0])
+        if fvg_dict['high'][-1] < klines['low'][0]:  # если верхняя грань FVG меньше минимума следующей свечи
+            fvg_dict['high'].pop()
+            fvg_dict['high'].append(klines['low'][0])
             logging.info('Expanded FVG')
     elif bear_fvg_flag:
-        if FVG_DICT['low'][-1] > klines['high'][0]:  # если нижняя граница FVG выше максимума следуюшей свечи
-            FVG_DICT['low'].pop()
-            FVG_DICT['low'].append(klines['high'][0])  
+        if fvg_dict['low'][-1] > klines['high'][0]:  # если нижняя граница FVG выше максимума следуюшей свечи
+            fvg_dict['low'].pop()
+            fvg_dict['low'].append(klines['high'][0])  
             logging.info('Expanded FVG')
 
 
+def add_zone(open_time, bear_fvg_flag, bull_fvg_flag, fvg_dict=FVG_DICT, zones=ZONE_STORE, settings=None):
+    '''
+    Функция переносит FVG, которую не перекрыли, в хранилище зон
+    Возвращает id зоны
+    '''
+    start_trade = strategy_settings(settings)['start_trade']
+    low, high = fvg_dict['low'][-1], fvg_dict['high'][-1]
+    # цена входа та же, что в calc_order_params
+    entry = high - start_trade*(high - low) if bull_fvg_flag else low + start_trade*(high - low)
+    return zones.add(int(open_time), 1 if bull_fvg_flag else -1, low, high, entry)
+
+
+def update_zones(candle, zones=ZONE_STORE):
+    '''
+    Функция проверяет, какие зоны задела закрытая свеча
+    '''
+    result = zones.update(candle)
+    if result['mitigated'] or result['invalidated']:
+        logging.info(f'Zones mitigated: {result["mitigated"]}, invalidated: {result["invalidated"]}, live: {len(zones)}')
+    return result
+
+
+def journal_write(write, *args):
+    '''
+    Функция вызывает запись в журнал: JOURNAL.append или JOURNAL.snapshot
+    Событие, которое не удалось записать, теряется и попадает в лог, а поток торговли продолжает работу
+    '''
+    try:
+        write(*args)
+        return True
+    except Exception as e:
+        logging.error(f'Error writing to journal: {e}')
+        return False
+
+
+class FVGStateMachine:
+    '''
+    Пошаговая проверка FVG по закрытым свечам
+    Каждая свеча обрабатывается один раз: она продвигает все ожидающие FVG через расширение и перекрытие,
+    а затем 3 последние свечи проверяются на новую FVG
+    Ожидающих FVG не больше max(cover, expand) + 1, поэтому свеча обрабатывается за O(1),
+    и FVG, появившиеся во время проверки предыдущих, не пропускаются
+    '''
+    __slots__ = ('settings', 'zones', 'window', 'pending', 'last_open_time', 'journal')
+
+    def __init__(self, settings=None, zones=ZONE_STORE, journal=None):
+        self.settings = strategy_settings(settings)
+        self.zones = zones
+        self.window = deque(maxlen=3) # 3 последние закрытые свечи
+        self.pending = [] # [bear_fvg_flag, bull_fvg_flag, fvg_time, cover_counter, expand_counter, fvg_dict]
+        self.last_open_time = None
+        self.journal = journal # журнал событий, None - не писать
+
+    def state(self):
+        '''
+        Функция возвращает состояние для снимка журнала
+        '''
+        return {'window': list(self.window), 'pending': self.pending,
+                'last_open_time': self.last_open_time, 'zones': self.zones}
+
+    def restore(self, state):
+        '''
+        Функция восстанавливает состояние из снимка журнала, настройки остаются текущими
+        '''
+        self.window = deque(state['window'], maxlen=3)
+        self.pending = state['pending']
+        self.last_open_time = state['last_open_time']
+        self.zones = state['zones']
+
+    def on_candle(self, candle):
+        '''
+        Функция обрабатывает закрытую свечу
+        Возвращает список FVG (bear_fvg_flag, bull_fvg_flag, fvg_dict), по которым пора выставлять ордер
+        '''
+        if self.last_open_time is not None and candle['open_time'] <= self.last_open_time:
+            return []
+        self.last_open_time = candle['open_time']
+        if self.journal:
+            journal_write(self.journal.append, CANDLE, tuple(candle[key] for key in KLINE_KEYS))
+        update_zones(candle, self.zones) # проверяем старые FVG зоны
+        klines = candles_to_klines([candle])
+        pending = []
+        ready = []
+        # свеча - очередной сосед для всех FVG, которые еще проходят проверку
+        for fvg in self.pending:
+            if not self.step(fvg, klines):
+                continue
+            if fvg[3] > 0 or fvg[4] > 0:
+                pending.append(fvg)
+            else:
+                ready.append(fvg)
+        self.window.append(candle)
+        if len(self.window) == 3:
+            fvg = self.detect(candles_to_klines(self.window))
+            if fvg and (fvg[3] > 0 or fvg[4] > 0):
+                pending.append(fvg)
+            elif fvg:
+                ready.append(fvg)
+        self.pending = pending
+        signals = []
+        for bear_fvg_flag, bull_fvg_flag, fvg_time, _, _, fvg_dict in ready:
+            logging.info('FVG doesnt cover')
+            # FVG остается в хранилище зон
+            zone_id = add_zone(fvg_time, bear_fvg_flag, bull_fvg_flag, fvg_dict, self.zones, self.settings)
+            if self.journal:
+                zone = self.zones.get(zone_id)
+                journal_write(self.journal.append, ZONE_ADDED,
+                              (zone_id, fvg_time, zone['direction'], zone['low'], zone['high'], zone['entry']))
+            signals.append((bear_fvg_flag, bull_fvg_flag, fvg_dict))
+        return signals
+
+    def detect(self, klines):
+        '''
+        Функция ищет FVG на 3 свечах и возвращает ее состояние для проверки или None
+        '''
+        bear_fvg_flag = check_if_bear_fvg(klines) # проверка на медвежий FVG
+        bull_fvg_flag = check_if_bull_fvg(klines) # проверка на бычий FVG
+        if not (bear_fvg_flag or bull_fvg_flag):
+            return None
+        fvg_dict = {'low': [], 'high': []}
+        append_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict)
+        logging.info('FVG added to dict')
+        if self.journal:
+            journal_write(self.journal.append, FVG_FOUND, (klines['open_time'][-1], 1 if bull_fvg_flag else -1,
+                                                           fvg_dict['low'][-1], fvg_dict['high'][-1]))
+        side = 'bull' if bull_fvg_flag else 'bear'
+        return [bear_fvg_flag, bull_fvg_flag, klines['open_time'][-1],
+                self.settings[f'cover_neighbors_{side}'], self.settings[f'expand_neighbors_{side}'], fvg_dict]
+
+    def step(self, fvg, klines):
+        '''
+        Функция проверяет FVG на расширение и перекрытие очередной свечой
+        Возвращает False, если FVG перекрыли
+        '''
+        bear_fvg_flag, bull_fvg_flag, fvg_time, cover_counter, expand_counter, fvg_dict = fvg
+        if expand_counter > 0:
+            bounds = fvg_dict['low'][-1], fvg_dict['high'][-1]
+            expand_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict)
+            if self.journal and bounds != (fvg_dict['low'][-1], fvg_dict['high'][-1]):
+                journal_write(self.journal.append, FVG_EXPANDED, (fvg_time, fvg_dict['low'][-1], fvg_dict['high'][-1]))
+        if cover_counter > 0 and cover_fvg(klines, bear_fvg_flag, bull_fvg_flag, fvg_dict):
+            logging.info('Deleted FVG')
+            if self.journal:
+                journal_write(self.journal.append, FVG_COVERED, (fvg_time,))
+            return False
+        fvg[3] -= 1
+        fvg[4] -= 1
+        return True
+
+
+@timed('stage_seconds', stage='submission')
 def send_order(order_params):
     '''
     Функция для отправки ордера на биржу
     Принимает на вход словарь с параметрами
+    Ордер уходит через ORDER_GATEWAY вместе с другими ордерами этого момента
     '''
-    try:
-        response = spot_client.place_order(**order_params)
-        if response['retMsg'] == "OK":
-            return True
-        else:
-            logging.info(f'Error placing order: {response["retMsg"]}')   
-            return False 
-    except ConnectionError as e:
-        logging.info(f'Error placing order: {e}')
-        return False
+    result = ORDER_GATEWAY.place(order_params).result()
+    if not result['ok']:
+        logging.info(f'Error placing order: {result["msg"]}')   
+    return result['ok']
 
 
-def calc_order_params(bear_fvg_flag, bull_fvg_flag):
+@timed('stage_seconds', stage='sizing')
+def calc_order_params(bear_fvg_flag, bull_fvg_flag, fvg_dict=FVG_DICT, pair=PAIR, settings=None):
     '''
     Функция для расчета параметров ордера
     Возвращает словарь, который передается в функцию отправки ордера
     '''
+    settings = strategy_settings(settings)
     if bull_fvg_flag:
-        open_price = FVG_DICT['high'][-1] - START_TRADE*(FVG_DICT['high'][-1] - FVG_DICT['low'][-1])  # считаем цену открытия сделки
+        open_price = fvg_dict['high'][-1] - settings['start_trade']*(fvg_dict['high'][-1] - fvg_dict['low'][-1])  # считаем цену открытия сделки
         # для бычьего FVG: верхняя граница - % от FVG, который мы должны пересечь 
-        sl = FVG_DICT['low'][-1]*(1 - STOP_LOSS_OFFSET)  # считаем стоп-лосс
+        sl = fvg_dict['low'][-1]*(1 - settings['stop_loss_offset'])  # считаем стоп-лосс
         # для бычьего FVG: нижняя граница - % 
-        tp = open_price + (open_price - sl) * RISK_REWARD_RATIO #считаем тейк-профит
+        tp = open_price + (open_price - sl) * settings['risk_reward_ratio'] #считаем тейк-профит
         # для бычьего FVG: цена открытия + (расстояние от цены открытия до стоп-лосса)*соотношение риска к прибыли
-        balance = get_coin_balance("USDT") # получаем баланс USDT
+        balance = BALANCE_CACHE.get("USDT") # берем баланс USDT из кэша
         if not balance:
             logging.info('Error getting balance, skip FVG')
             return False
-        size = balance*RISK/(open_price-sl)*open_price*LEVER / open_price # считаем количество ордера
+        size = balance*settings['risk']/(open_price-sl)*open_price*settings['lever'] / open_price # считаем количество ордера
     elif bear_fvg_flag:
-        open_price = FVG_DICT['low'][-1] + START_TRADE*(FVG_DICT['high'][-1] - FVG_DICT['low'][-1]) #считаем цену открытия сделки
+        open_price = fvg_dict['low'][-1] + settings['start_trade']*(fvg_dict['high'][-1] - fvg_dict['low'][-1]) #считаем цену открытия сделки
         # для медвежьего FVG: нижняя граница + % от FVG, который мы должны пересечь
-        sl = FVG_DICT['high'][-1]*(1 + STOP_LOSS_OFFSET)  # считаем стоп-лосс
+        sl = fvg_dict['high'][-1]*(1 + settings['stop_loss_offset'])  # считаем стоп-лосс
         # для медвежьего FVG: верхняя граница + % 
-        tp = open_price - (sl - open_price) * RISK_REWARD_RATIO #считаем тейк-профит
+        tp = open_price - (sl - open_price) * settings['risk_reward_ratio'] #считаем тейк-профит
         # для медвежьего FVG: цена открытия - (расстояние от цены открытия до стоп-лосса)*соотношение риска к прибыли
-        balance = get_coin_balance(PAIR[:-4]) # получаем баланс коина
+        balance = BALANCE_CACHE.get(pair[:-4]) # берем баланс коина из кэша
         logging.info(f'Coin balance: {balance}')
         if not balance:
             logging.info('Error getting balance, skip FVG')
             return False
-        size = balance*RISK/(sl-open_price)*sl*LEVER # считаем количество ордера
+        size = balance*settings['risk']/(sl-open_price)*sl*settings['lever'] # считаем количество ордера
     order_params = {
             "category": "spot",
-            "symbol": PAIR,
+            "symbol": pair,
             "side": "Buy" if bull_fvg_flag else "Sell",
             "orderType": "LIMIT",
             "timeInForce": "GTC",
@@ -219,12 +489,12 @@ def calc_order_params(bear_fvg_flag, bull_fvg_flag):
     return order_params
 
 
-def get_order_filters():
+def get_order_filters(pair=PAIR):
     '''
     Функция получает фильтры для ордера
     '''
     try:
-        response = spot_client.get_instruments_info(category="spot", symbol=PAIR, status='Trading')
+        response = spot_client.get_instruments_info(category="spot", symbol=pair, status='Trading')
         if response['retMsg'] == "OK":
             order_filters = {'base_prec': float(response['result']['list'][0]['lotSizeFilter']['basePrecision']),
                              'quote_prec': float(response['result']['list'][0]['lotSizeFilter']['quotePrecision']),
@@ -243,239 +513,519 @@ def get_order_filters():
         return False
     
 
+@timed('stage_seconds', stage='filters')
 def check_order_params(order_params, order_filters, bear_fvg_flag, bull_fvg_flag):
     '''
     Функция проверяет параметры ордера и приводит их к правильному виду
+    Цены переводятся в целые тики, количество - в целые шаги лота, проверки идут в целых числах,
+    в строки для биржи значения переводятся один раз в конце
     '''
-    if bear_fvg_flag:
-        # приводим количество ордера к необходимой точности
-        order_params['qty'] = str(round(int(order_params['qty'] / order_filters['base_prec']) * order_filters['base_prec'], 2))
-    elif bull_fvg_flag:
-        # приводим количество ордера к необходимой точности
-        order_params['qty'] = str(round(int(order_params['qty'] / order_filters['quote_prec']) * order_filters['quote_prec'], 2))    
-    # приводим цену ордера к необходимой точности    
-    order_params['price'] = str(round(int(order_params['price'] / order_filters['price_prec']) * order_filters['price_prec'], 2)) 
-    # приводим тейк-профит ордера к необходимой точности
-    order_params['takeProfit'] = str(round(int(order_params['takeProfit'] / order_filters['price_prec']) * order_filters['price_prec'], 2))
-    # приводим стоп-лосс ордера к необходимой точности
-    order_params['stopLoss'] = str(round(int(order_params['stopLoss'] / order_filters['price_prec']) * order_filters['price_prec'], 2))
+    price_scale = tick_scale(order_filters['price_prec'])
+    # для медвежьего FVG количество в базовой монете, для бычьего - в котируемой
+    qty_scale = tick_scale(order_filters['base_prec'] if bear_fvg_flag else order_filters['quote_prec'])
+    qty = qty_scale.floor(order_params['qty']) # приводим количество ордера к необходимой точности
+    price = price_scale.floor(order_params['price']) # приводим цену ордера к необходимой точности
+    take_profit = price_scale.floor(order_params['takeProfit'])
+    stop_loss = price_scale.floor(order_params['stopLoss'])
+    order_params['qty'] = qty_scale.format(qty)
+    order_params['price'] = price_scale.format(price)
+    order_params['takeProfit'] = price_scale.format(take_profit)
+    order_params['stopLoss'] = price_scale.format(stop_loss)
     logging.info(f'Order params after validation. Size: {order_params["qty"]}, Price: {order_params["price"]}, tp: {order_params["takeProfit"]}, sl: {order_params["stopLoss"]}')
     # проверка на границы по количеству ордера
-    if float(order_params['qty']) > order_filters['max_quan'] or float(order_params['qty']) < order_filters['min_quan']:
+    if qty < qty_scale.ceil(order_filters['min_quan']) or qty > qty_scale.floor(order_filters['max_quan']):
         return False
-    # проверка на границы по стоимости ордера
-    if float(order_params['qty']) * float(order_params['price']) > order_filters['max_amount'] or float(order_params['qty']) * float(order_params['price']) < order_filters['min_amount']:
+    # проверка на границы по стоимости ордера: стоимость - целое число единиц 10**-(знаки количества + знаки цены)
+    amount = qty_scale.scaled(qty) * price_scale.scaled(price)
+    amount_scale = tick_scale(10 ** -(qty_scale.places + price_scale.places))
+    if amount > amount_scale.floor(order_filters['max_amount']) or amount < amount_scale.ceil(order_filters['min_amount']):
         return False
     return order_params
 
 
-def get_orders():
+def get_orders(pair=PAIR):
     '''
     Функция возвращает открытые ордера
+    Биржа отдает ордера страницами, проходим по всем страницам
     '''
+    orders = []
+    cursor = None
     try:
-        response = spot_client.get_open_orders(category="spot", symbol=PAIR)
-        if response['retMsg'] == "OK":
-            orders = response['result']['list']
-            logging.info("Got open orderds")
-            return orders
-        else:
-            logging.info(f'Error getting orders: {response["retMsg"]}')   
-            return False 
+        while True:
+            response = spot_client.get_open_orders(category="spot", symbol=pair, limit=50, cursor=cursor)
+            if response['retMsg'] != "OK":
+                logging.info(f'Error getting orders: {response["retMsg"]}')   
+                return False 
+            orders += response['result']['list']
+            cursor = response['result'].get('nextPageCursor')
+            if not cursor:
+                break
+        logging.info("Got open orderds")
+        return orders
     except ConnectionError as e:
         logging.info(f'Error getting orders: {e}')
         return False
     
 
-def delete_order(orderId):
+def delete_order(orderId, pair=PAIR):
     '''
     Функция отмены ордеров
     '''
+    result = ORDER_GATEWAY.cancel(pair, orderId).result()
+    if result['ok']:
+        logging.info("Order cancelled")
+    else:
+        logging.info(f'Error cancelling order: {result["msg"]}')   
+    return result['ok']
+    
+
+def is_own_order(order):
+    '''
+    Функция проверяет, что ордер биржи выставил бот
+    Лимитные ордера узнаем по orderLinkId, а TP/SL ордер биржа заводит сама без него на исполненную часть
+    ордера, поэтому он наш, если его количество совпадает с исполнением, которое бот записал по своему ордеру
+    в другую сторону на той же паре. TP/SL без такого исполнения не трогаем: если сообщение об исполнении
+    придет позже, ордер попадет в индекс на ближайшей сверке трекера
+    '''
+    if order.get('orderLinkId') in OWN_ORDERS:
+        return True
+    if order.get('stopOrderType') != 'BidirectionalTpslOrder':
+        return False
+    qty, created = float(order['qty']), int(order['createdTime'])
+    return any(own['symbol'] == order['symbol'] and own['side'] != order['side'] and own['time'] <= created
+               and own['filled'] * (1 - TPSL_QTY_TOLERANCE) <= qty <= own['filled'] * (1 + 1e-9)
+               for own in list(OWN_ORDERS.values()))
+
+
+BALANCE_CACHE = BalanceCache(get_coin_balance)
+FILTER_CACHE = FilterCache(get_order_filters)
+ORDER_TRACKER = OrderTracker(get_orders, PAIR, MAX_ORDER_DURATION, MAX_TRADE_DURATION, owns=is_own_order)
+
+
+def set_exchange(client):
+    '''
+    Функция подменяет клиента биржи, например на локальный симулятор exchange_sim.SimExchange
+    Подмененный клиент вызывается напрямую, без лимитов планировщика SCHEDULER
+    '''
+    global spot_client
+    spot_client = client
+    ORDER_GATEWAY.client = client
+
+
+def start_account_cache():
+    '''
+    Функция запускает фоновое обновление кэшей балансов и фильтров
+    и подписку на изменения кошелька, исполнения и ордеров
+    '''
+    BALANCE_CACHE.start()
+    FILTER_CACHE.start()
     try:
-        response = spot_client.cancel_order(category="spot", symbol=PAIR, orderId=orderId)
-        if response['retMsg'] == "OK":
-            logging.info("Order cancelled")
-            return True
-        else:
-            logging.info(f'Error cancelling order: {response["retMsg"]}')   
-            return False 
-    except ConnectionError as e:
-        logging.info(f'Error cancelling order: {e}')
+        from pybit.unified_trading import WebSocket
+        ws = WebSocket(testnet=TESTNET, channel_type="private", api_key=API_KEY, api_secret=API_SECRET)
+        ws.wallet_stream(callback=BALANCE_CACHE.on_wallet_message)
+        ws.execution_stream(callback=on_execution_message)
+        ws.order_stream(callback=ORDER_TRACKER.on_order_message)
+        return ws
+    except Exception as e:
+        logging.info(f'Error subscribing to account stream: {e}, balances refresh by timer only')
+        return None
+
+
+def observe_delay(name, open_time, time_frame_ms=TIME_FRAME_MS):
+    '''
+    Функция пишет в гистограмму, сколько прошло от закрытия свечи до текущего момента
+    '''
+    histogram(name).observe(max(0.0, (now_ms() - open_time - time_frame_ms) / 1000))
+
+
+# пока индекс ни разу не обновлялся, возраст неизвестен
+gauge('order_index_age_seconds',
+      lambda: (now_ms() - ORDER_TRACKER.updated) / 1000 if ORDER_TRACKER.updated else float('nan'))
+gauge('scheduler_coalesced_total', lambda: SCHEDULER.counts['coalesced'])
+gauge('scheduler_delayed_total', lambda: SCHEDULER.counts['delayed'])
+gauge('scheduler_rate_limited_total', lambda: SCHEDULER.counts['rate_limited'])
+
+
+def place_fvg_order(bear_fvg_flag, bull_fvg_flag, fvg_dict, pair=PAIR, settings=None):
+    '''
+    Функция считает, проверяет и отправляет ордер по FVG, которую не перекрыли
+    '''
+    logging.info('Calc params of order')
+    order_params = calc_order_params(bear_fvg_flag, bull_fvg_flag, fvg_dict, pair, settings) # считаем параметры ордера
+    if not order_params:
         return False
-    
+    order_params['orderLinkId'] = uuid.uuid4().hex # по нему узнаем свой ордер, в том числе после перезапуска
+    logging.info('Checking params for filters')
+    # проверяем параметры и форматируем их
+    if not check_order_params(order_params, FILTER_CACHE.get(pair), bear_fvg_flag, bull_fvg_flag):
+        logging.info(f'{pair}: Params dont pass filters')
+        return False
+    # запоминаем ордер до отправки: сообщение вебсокета о нем может прийти раньше ответа биржи
+    record_order(order_params)
+    if not send_order(order_params):
+        OWN_ORDERS.pop(order_params['orderLinkId'], None)
+        logging.info(f'{pair}: Error placing order')
+        return False
+    logging.info(f'{pair}: Order placed')
+    BALANCE_CACHE.invalidate()
+    journal_order(order_params['orderLinkId'])
+    return True
+
+
+def own_order(symbol, side, price, qty, created):
+    '''
+    Функция возвращает запись об ордере бота для OWN_ORDERS
+    '''
+    return {'symbol': symbol, 'side': side, 'price': price, 'qty': qty, 'time': created, 'filled': 0.0}
+
+
+def record_order(order_params):
+    '''
+    Функция запоминает ордер бота в OWN_ORDERS
+    '''
+    price, qty = float(order_params['price']), float(order_params['qty'])
+    OWN_ORDERS[order_params['orderLinkId']] = own_order(order_params['symbol'], order_params['side'], price, qty,
+                                                        now_ms())
+
+
+def journal_order(link_id):
+    '''
+    Функция пишет в журнал ордер бота, который приняла биржа
+    '''
+    order = OWN_ORDERS.get(link_id)
+    if JOURNAL and order:
+        journal_write(JOURNAL.append, ORDER_SENT, (order['time'], order['price'], order['qty']),
+                      (order['symbol'], order['side'], link_id))
+
+
+def on_execution_message(message):
+    '''
+    Обработчик сообщений вебсокета execution: обновляет балансы и запоминает исполнения ордеров бота
+    '''
+    BALANCE_CACHE.on_execution_message(message)
+    for item in message['data']:
+        order = OWN_ORDERS.get(item.get('orderLinkId'))
+        if order is None:
+            continue
+        qty, price = float(item['execQty']), float(item['execPrice'])
+        order['filled'] += qty
+        if JOURNAL:
+            journal_write(JOURNAL.append, FILL, (int(item['execTime']), qty, price),
+                          (item['symbol'], item['orderLinkId']))
+
+
+def journal_state(machine):
+    '''
+    Функция собирает состояние для снимка журнала, старые ордера в снимок не попадают
+    '''
+    oldest = now_ms() - MAX_ORDER_DURATION - MAX_TRADE_DURATION
+    for link_id in [link_id for link_id, order in OWN_ORDERS.items() if order['time'] < oldest]:
+        del OWN_ORDERS[link_id]
+    return {'machine': machine.state(), 'orders': dict(OWN_ORDERS)}
+
+
+def restore_state(machine, journal=JOURNAL):
+    '''
+    Функция восстанавливает состояние стратегии и ордера бота из снимка и хвоста журнала
+    Свечи из хвоста заново проходят через машину состояний, сигналы по ним не торгуются
+    '''
+    started = time.perf_counter()
+    state, events = journal.load()
+    if state:
+        machine.restore(state['machine'])
+        OWN_ORDERS.update(state['orders'])
+    candles = 0
+    for event, fields, strings in events:
+        if event == CANDLE:
+            machine.on_candle(dict(zip(KLINE_KEYS, fields)))
+            candles += 1
+        elif event == ORDER_SENT:
+            OWN_ORDERS[strings[2]] = own_order(strings[0], strings[1], fields[1], fields[2], fields[0])
+        elif event == FILL and strings[1] in OWN_ORDERS:
+            OWN_ORDERS[strings[1]]['filled'] += fields[1]
+    logging.info(f'Restored state from journal: snapshot {"found" if state else "missing"}, {candles} candles replayed, '
+                 f'{len(machine.pending)} pending FVG, {len(machine.zones)} zones, {len(OWN_ORDERS)} own orders '
+                 f'in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+
+def reconcile_own_orders(pair=PAIR):
+    '''
+    Функция сверяет ордера бота, восстановленные из журнала, с открытыми ордерами биржи
+    Забывает ордера, которых на бирже уже нет и которые не исполнялись: без исполнения у ордера нет TP/SL,
+    и пересобирает индекс ORDER_TRACKER: до восстановления он не знал, какие из открытых ордеров наши
+    '''
+    try:
+        orders = get_orders(pair)
+    except Exception as e:
+        logging.info(f'Error getting open orders: {e}')
+        orders = False
+    if orders is False:
+        logging.info('Cant reconcile own orders')
+        return False
+    open_ids = {order.get('orderLinkId') for order in orders}
+    closed = [link_id for link_id, own in OWN_ORDERS.items() if link_id not in open_ids and not own['filled']]
+    for link_id in closed:
+        del OWN_ORDERS[link_id]
+    logging.info(f'{len(closed)} own orders were closed while the bot was down, {len(OWN_ORDERS)} left')
+    return ORDER_TRACKER.reconcile(orders)
+
+
+def make_kline_feed(klines, pair=PAIR, time_frame=TIME_FRAME):
+    '''
+    Функция создает источник закрытых свечей, начиная со свечей klines
+    При ошибке подключения к потоку остается опрос по REST
+    '''
+    time_frame_ms = interval_ms(time_frame)
+    if KLINE_SOURCE == "stream":
+        feed = StreamKlineFeed(pair, time_frame, time_frame_ms, fallback=get_klines, testnet=TESTNET)
+        feed.seed(klines)
+        try:
+            feed.start()
+            return feed
+        except Exception as e:
+            logging.info(f'Error subscribing to kline stream: {e}, falling back to polling')
+    feed = KlineFeed(pair, time_frame, time_frame_ms, fallback=get_klines)
+    feed.seed(klines)
+    return feed
+
 
-def trade():
+def make_resampled_feeds(pair=PAIR, time_frames=TIME_FRAMES):
+    '''
+    Функция создает источники закрытых свечей нескольких тайм фреймов из одного минутного потока
+    Каждый источник начинается со своих последних свечей, дальше свечи собираются из минутных
+    Возвращает словарь тайм фрейм -> источник
+    '''
+    resampler = KlineResampler(pair)
+    feeds = {}
+    for time_frame in time_frames:
+        klines = get_klines(pair, time_frame, limit=4)
+        if not klines:
+            logging.info(f'Error getting {time_frame} candles')
+            return False
+        feed = KlineFeed(pair, time_frame, interval_ms(time_frame), fallback=get_klines)
+        feed.seed(klines)
+        resampler.subscribe(time_frame, feed.push)
+        feeds[time_frame] = feed
+    # минутки с начала текущей свечи самого длинного тайм фрейма, чтобы первая собранная свеча была полной
+    longest = max(interval_ms(time_frame) for time_frame in time_frames)
+    minutes = get_klines(pair, SOURCE_TIME_FRAME, limit=min(KLINE_PAGE_LIMIT, longest // SOURCE_MS + 1))
+    if not minutes:
+        logging.info('Error getting minute candles')
+        return False
+    source = make_kline_feed(minutes, pair, SOURCE_TIME_FRAME)
+    threading.Thread(target=resampler.run, args=(source,), daemon=True).start()
+    return feeds
+
+
+def trade(feed=None):
     '''
     Основная функция торговли
+    Принимает источник закрытых свечей, по умолчанию создает его сам
     '''
+    # у каждого переданного источника (тайм фрейма) свои зоны
+    machine = FVGStateMachine(zones=ZONE_STORE if feed is None else ZoneStore())
+    live_from = None # свечи до этого времени бот пропустил, пока не работал, по ним не торгуем
+    if feed is None:
+        limit = 4 # получаем 4 последних свечи
+        if JOURNAL:
+            restore_state(machine)
+            reconcile_own_orders()
+            machine.journal = JOURNAL
+            JOURNAL.start()
+            if machine.last_open_time is not None:
+                # добираем свечи, пропущенные с последней свечи в журнале
+                missed = (now_ms() - machine.last_open_time) // TIME_FRAME_MS
+                limit = int(min(KLINE_PAGE_LIMIT, max(limit, missed + 1)))
+        klines = get_klines(PAIR, TIME_FRAME, limit=limit)
+        if not klines:
+            logging.info('Stopping bot due to getting candles error')
+            return
+        if machine.last_open_time is not None and len(klines['open_time']) > 1:
+            live_from = klines['open_time'][-2]
+    # фильтры запрашиваются в start_bot одновременно со свечами, к этому моменту они обычно уже в кэше
     logging.info('Getting order filters...')
-    order_filters = get_order_filters() # получаем фильтры для ордера
+    order_filters = FILTER_CACHE.get(PAIR) # получаем фильтры для ордера
     if not order_filters:
         logging.info('Stopping bot due to getting order filters errors')
         return
     logging.info('Got the orders filters!')
+    if feed is None:
+        feed = make_kline_feed(klines)
+    else:
+        feed.start()
+    time_frame_ms = feed.time_frame_ms or TIME_FRAME_MS
+    candles = 0
     while True:
         logging.info('Bot runing')
-        klines = get_klines(PAIR, TIME_FRAME, limit=4) # получаем 4 последних свечи
-        if not klines:
+        candle = feed.next_candle() # ждем закрытия свечи
+        if not candle:
             logging.info('Stopping bot due to getting candles error')
             break
-        logging.info(f'Got 4 candles: {klines}')
-        bear_fvg_flag = check_if_bear_fvg(klines) # проверка на медвежий FVG
-        bull_fvg_flag = check_if_bull_fvg(klines) # проверка на бычий FVG
-        # если обнаружили FVG
-        if bear_fvg_flag or bull_fvg_flag:
-            append_fvg(klines, bear_fvg_flag, bull_fvg_flag) # добавляем FVG в словарь
-            logging.info('FVG added to dict')
-            cover_neighbors_counter = COVER_NEIGHBORS_BULL if bull_fvg_flag else COVER_NEIGHBORS_BEAR
-            expand_neighbors_counter = EXPAND_NEIGHBORS_BULL if bull_fvg_flag else EXPAND_NEIGHBORS_BEAR
-            # запускаем цикл проверки на перекрытие FVG и расширения FVG
-            while cover_neighbors_counter > 0 or expand_neighbors_counter > 0:
-                logging.info('Enter cycle of expanding and covering')
-                # ждем закрытия текущей свечи
-                sleeping_time = max(0, math.ceil((klines['open_time'][-1] + TIME_FRAME_MS - int(time.time() * 1000)) / 1000) + 2)
-                logging.info(f'Sleep for {sleeping_time}')
-                time.sleep(sleeping_time)
-                logging.info('Waked up')
-                # получаем 2 свечи
-                klines = get_klines(PAIR, TIME_FRAME, limit=2)
-                if not klines:
-                    logging.info('Stopping bot due to candles error')
-                    break
-                logging.info('Got 2 candles')
-                if expand_neighbors_counter > 0:
-                    logging.info('Expanding FVG')
-                    # проверка на расширение FVG
-                    expand_fvg(klines, bear_fvg_flag, bull_fvg_flag)
-                if cover_neighbors_counter > 0:
-                    logging.info('Covering FVG')
-                    # проверка на перекрытие FVG
-                    cover_flag = cover_fvg(klines, bear_fvg_flag, bull_fvg_flag)
-                    # если FVG перекрывается
-                    if cover_flag:
-                        delete_fvg() # удаляем FVG из словаря и опускаем флаги
-                        logging.info('Deleted FVG')
-                        bear_fvg_flag = False
-                        bull_fvg_flag = False
-                        logging.info('Leave cycle of expanding and covering')
-                        break
-                cover_neighbors_counter -= 1
-                expand_neighbors_counter -= 1
-            # если не перекрыли FVG
-            if not cover_flag:
-                logging.info('FVG doesnt cover')
-                logging.info('Calc params of order')
-                order_params = calc_order_params(bear_fvg_flag, bull_fvg_flag) # считаем параметры ордера
-                logging.info('Params calculated')
-                if order_params:
-                    logging.info('Checking params for filters')
-                    # проверяем параметры и форматируем их
-                    legit_order_params = check_order_params(order_params, order_filters, bear_fvg_flag, bull_fvg_flag)
-                    if not legit_order_params:
-                        logging.info('Params dont pass filters')
-                    # если параметры прошли фильтры, отправляем ордер    
-                    else:   
-                        logging.info('Params passed filters') 
-                        if not send_order(order_params):
-                            logging.info('Error placing order')
-                        else:    
-                            logging.info('Order placed')
-            # опускаем флаги и спим до закрытия текущей свечи и еще двух следующих
-            bear_fvg_flag = False
-            bull_fvg_flag = False
-            sleeping_time = max(0, math.ceil((klines['open_time'][-1] + TIME_FRAME_MS - int(time.time() * 1000)) / 1000) + 2 + 2*TIME_FRAME_MS // 1000)   
-            logging.info(f'Sleep for 2 candles: {sleeping_time}') 
-            time.sleep(sleeping_time)
-            logging.info('Waked up')
-        # если не обнаружили FVG    
-        else:
-            # ждем закрытия текущей свечи
-            sleeping_time = max(0, math.ceil((klines['open_time'][-1] + TIME_FRAME_MS - int(time.time() * 1000)) / 1000) + 2)
-            logging.info(f'Sleep for {sleeping_time}')
-            time.sleep(sleeping_time)    
-            logging.info('Waked up')
+        observe_delay('candle_delay_seconds', candle['open_time'], time_frame_ms)
+        # свеча продвигает все ожидающие FVG, по каждой FVG, которую не перекрыли, выставляем ордер
+        for bear_fvg_flag, bull_fvg_flag, fvg_dict in machine.on_candle(candle):
+            if live_from is not None and candle['open_time'] < live_from:
+                logging.info('Skip FVG found on candles missed while the bot was down')
+                continue
+            observe_delay('signal_delay_seconds', candle['open_time'], time_frame_ms)
+            place_fvg_order(bear_fvg_flag, bull_fvg_flag, fvg_dict)
+        candles += 1
+        if machine.journal and candles % SNAPSHOT_EVERY == 0:
+            journal_write(machine.journal.snapshot, journal_state(machine))
 
 
-def order_canceller():
+def close_params(order):
+    '''
+    Функция возвращает параметры рыночного ордера, закрывающего позицию истекшего ордера
+    Для лимитного ордера, который не исполнялся, позиции нет, возвращает None
+    '''
+    # TP/SL ордер: закрываем открытый до этого лимитный, от которого он родился
+    if order['stopOrderType'] == 'BidirectionalTpslOrder':
+        side, qty = order['side'], order['qty']
+    # частично исполненный лимитный: противоположный ордер на исполненное количество
+    elif order['orderStatus'] == 'PartiallyFilled':
+        side, qty = "Buy" if order['side'] == 'Sell' else "Sell", order['cumExecQty']
+    else:
+        return None
+    return {
+        "category": "spot",
+        "symbol": order['symbol'],
+        "side": side,
+        "orderType": "MARKET",
+        "timeInForce": "GTC",
+        "marketUnit": "baseCoin",
+        "qty": qty
+    }
+
+
+def order_canceller(pair=PAIR):
     '''
     Функция мониторинга ордеров
+    Спит до истечения ближайшего ордера в ORDER_TRACKER, ордера с общим сроком обрабатывает вместе:
+    все отмены уходят одной пачкой, затем одной пачкой закрываются позиции
+    Если pair=None, то следит за ордерами всех спотовых пар
     '''
+    ORDER_TRACKER.pair = pair # трекер следит за теми же парами, что и мы
     while True:    
-        logging.info('Trying to get orders')
-        orders = get_orders() # получаем ордера
-        if not orders:
-            logging.info('Cant get orders or there is no orders')
+        logging.info('Waiting for expired orders')
+        close_expired(ORDER_TRACKER.wait_expired()) # ждем истекшие ордера
+
+
+def close_expired(orders):
+    '''
+    Функция отменяет истекшие ордера и закрывает позиции за ними
+    '''
+    logging.info(f'{len(orders)} orders are too old, cancelling them')
+    # отправляем все отмены сразу, не дожидаясь ответа по каждой
+    cancels = [(order, ORDER_GATEWAY.cancel(order['symbol'], order['orderId'])) for order in orders]
+    closes = []
+    for order, cancel in cancels:
+        result = cancel.result()
+        if not result['ok']:
+            logging.info(f'Error cancelling order: {result["msg"]}')
+            continue
+        logging.info("Order cancelled")
+        # если ордер удачно отменен и за ним есть позиция, закрываем ее
+        order_params = close_params(order)
+        if order_params:
+            closes.append(ORDER_GATEWAY.place(order_params))
+    for close in closes:
+        result = close.result()
+        if not result['ok']:
+            logging.info(f'Error closing position: {result["msg"]}')
         else:
-            # проходим по ордерам
-            for order in orders:
-                # если это TP/SL ордер
-                if order['stopOrderType'] == 'BidirectionalTpslOrder':
-                    # если он висит больше разрешенного времени
-                    if int(time.time() * 1000) - int(order['createdTime']) > MAX_TRADE_DURATION:
-                        logging.info('Opened TP/SL order is too old, cancelling it')
-                        # если ордер удачно отменен
-                        if delete_order(order['orderId']):
-                            order_params = {
-                            "category": "spot",
-                            "symbol": order['symbol'],
-                            "side": order['side'],
-                            "orderType": "MARKET",
-                            "timeInForce": "GTC",
-                            "marketUnit": "baseCoin",
-                            "qty": order['qty']    
-                            } 
-                            # выставляем ордер, чтобы закрыть открытый до этого лимитный, от которого родился этот TP/SL 
-                            if not send_order(order_params):
-                                logging.info('Error closing position')
-                            else:
-                                logging.info('Position closed')  
-                # если это лимитный ордер и он не исполнен даже частично                  
-                elif order['orderType'] == 'Limit' and order['orderStatus'] == 'New':
-                    # если он висит больше разрешенного времени
-                    if int(time.time() * 1000) - int(order['createdTime']) > MAX_ORDER_DURATION:
-                        logging.info('Not opened order is too old, cancelling it')
-                        delete_order(order['orderId']) # отменяем его
-                # если это лимитный ордер, исполненный частично        
-                elif order['orderType'] == 'Limit' and order['orderStatus'] == 'PartiallyFilled':
-                    # если он висит больше разрешенного времени
-                    if int(time.time() * 1000) - int(order['updatedTime']) > MAX_TRADE_DURATION:
-                        logging.info('Partially opened order is too old, cancelling it')
-                        # отменяем его, если отмена успешна
-                        if delete_order(order['orderId']):   
-                            order_params = {
-                            "category": "spot",
-                            "symbol": order['symbol'],
-                            "side": "Buy" if order['side'] == 'Sell' else "Sell",
-                            "orderType": "MARKET",
-                            "timeInForce": "GTC",
-                            "marketUnit": "baseCoin",
-                            "qty": order['cumExecQty']    
-                            } 
-                        # отправляем противоположный ордер на исполненное количество, чтобы закрыть позицию    
-                        if not send_order(order_params):
-                            logging.info('Error closing position')
-                        else:
-                            logging.info('Position closed') 
-        # спим 100 секунд                     
-        time.sleep(100)                
-
-
-while True:
-    inp = input('>>> ')
-    if inp == 'start':
-        print('Starting the bot ...')
-        logging.info('Starting the bot ...') 
-        main = threading.Thread(target=trade)
-        order_dispatcher = threading.Thread(target=order_canceller)
-        main.start()
-        order_dispatcher.start()
-        print('Bot succesfully started!')
-        logging.info('Bot succesfully started!') 
-    elif inp == 'balance':
-        print("SPOT BALANCE")
-        print(get_coin_balance(coin=False))
-    elif inp == 'help':
-        print('Print "start" after setting parameters to start the bot\n'
-              'Print "balance" to get the balances\n')
-    else:
-        print('Unknown command')    
+            logging.info('Position closed')
+    if closes:
+        BALANCE_CACHE.invalidate()
+
+
+BOT_THREADS = []  # потоки торговли и мониторинга ордеров, пустой список - бот не запущен
+START_LOCK = threading.Lock()
+WARM_UP_WORKERS = 4
+
+
+def warm_up(pair=PAIR):
+    '''
+    Функция параллельно получает все, что нужно до первой свечи: фильтры пары, балансы, открытые ордера,
+    и подписывается на потоки аккаунта
+    Одинаковые запросы потоков торговли в это время объединяются с запросами прогрева в планировщике
+    '''
+    with ThreadPoolExecutor(WARM_UP_WORKERS) as pool:
+        pool.submit(FILTER_CACHE.get, pair)
+        pool.submit(BALANCE_CACHE.refresh)
+        pool.submit(ORDER_TRACKER.reconcile)
+        account_stream = pool.submit(start_account_cache)
+    return account_stream.result()
+
+
+def start_bot():
+    '''
+    Функция запускает торговлю и мониторинг ордеров
+    Повторный запуск ничего не делает, чтобы не было двух потоков торговли на одну пару
+    Возвращает False, если бот уже запущен или не удалось получить свечи тайм фреймов
+    '''
+    with START_LOCK:
+        if BOT_THREADS:
+            logging.info('Bot is already running')
+            return False
+        logging.info('Starting the bot ...')
+        # свечи запрашиваются потоками торговли, пока идет прогрев
+        threads = [threading.Thread(target=warm_up, daemon=True)]
+        if TIME_FRAMES:
+            # все тайм фреймы собираются из одного минутного потока
+            try:
+                feeds = make_resampled_feeds()
+            except Exception as e:
+                logging.info(f'Error getting candles: {e}')
+                feeds = False
+            if not feeds:
+                # без потоков торговли бот не запускаем, иначе status покажет его работающим
+                logging.info('Error starting the bot: no candle feeds')
+                return False
+            threads += [threading.Thread(target=trade, args=(feed,), daemon=True) for feed in feeds.values()]
+        else:
+            threads.append(threading.Thread(target=trade, daemon=True))
+        threads.append(threading.Thread(target=order_canceller, daemon=True))
+        for thread in threads:
+            thread.start()
+        BOT_THREADS.extend(threads[1:])
+        logging.info('Bot succesfully started!')
+        return True
+
+
+def run_command(command):
+    '''
+    Функция выполняет команду управления ботом и возвращает ответ текстом
+    Команды одни и те же для консоли и управляющего сокета fvg_daemon
+    '''
+    if command == 'start':
+        if BOT_THREADS:
+            return 'Bot is already running'
+        return 'Bot succesfully started!' if start_bot() else 'Error starting the bot, see the log'
+    elif command == 'balance':
+        return f'SPOT BALANCE\n{get_coin_balance(coin=False)}'
+    elif command == 'stats':
+        return stats()
+    elif command == 'status':
+        alive = sum(thread.is_alive() for thread in BOT_THREADS)
+        return f'running, {alive} of {len(BOT_THREADS)} threads alive' if BOT_THREADS else 'stopped'
+    elif command == 'help':
+        return ('Print "start" after setting parameters to start the bot\n'
+                'Print "balance" to get the balances\n'
+                'Print "stats" to get the latency stats\n'
+                'Print "status" to check the bot threads\n')
+    return 'Unknown command'
+
+
+if __name__ == '__main__':
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    while True:
+        try:
+            inp = input('>>> ')
+        except EOFError:
+            break
+        print(run_command(inp))
+    # консоль закрыли, бот продолжает работать
+    for thread in BOT_THREADS:
+        thread.join()
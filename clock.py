@@ -0,0 +1,87 @@
+import time
+import threading
+
+
+class SystemClock:
+    '''
+    Обычные часы: текущее время системы
+    '''
+    def time(self):
+        return time.time()
+
+    def wait(self, cond, deadline_ms):
+        '''
+        Функция ждет на взятом вызывающим cond уведомления или момента deadline_ms
+        '''
+        cond.wait(max(0, deadline_ms - self.time() * 1000) / 1000)
+
+    def sleep(self, ms):
+        time.sleep(ms / 1000)
+
+
+class VirtualClock:
+    '''
+    Виртуальные часы для симуляции: время стоит, пока его не передвинут
+    Ожидание до срока не уходит в реальное время: оно заканчивается уведомлением на cond
+    или когда часы передвинут до срока, а sleep сам двигает часы вперед
+    '''
+    def __init__(self, now_ms=0):
+        self.now_ms = now_ms
+        self.waiters = [] # cond, на которых сейчас ждут срока
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now_ms / 1000
+
+    def set(self, now_ms):
+        self.now_ms = max(self.now_ms, int(now_ms)) # время не идет назад
+        with self.lock:
+            waiters = list(self.waiters)
+        # ждущие сами проверяют, наступил ли их срок
+        for cond in waiters:
+            with cond:
+                cond.notify_all()
+
+    def wait(self, cond, deadline_ms):
+        '''
+        Функция ждет на взятом вызывающим cond уведомления или сдвига часов
+        cond записывается в ждущие до проверки срока, поэтому сдвиг часов после проверки ожидание не пропустит
+        '''
+        with self.lock:
+            self.waiters.append(cond)
+        try:
+            if self.now_ms < deadline_ms:
+                cond.wait()
+        finally:
+            with self.lock:
+                self.waiters.remove(cond)
+
+    def sleep(self, ms):
+        self.set(self.now_ms + ms)
+
+
+CLOCK = SystemClock()
+
+
+def set_clock(clock):
+    '''
+    Функция подменяет часы, по которым бот считает сроки ордеров, свежесть кэшей и пропущенные свечи
+    '''
+    global CLOCK
+    CLOCK = clock
+
+
+def now_ms():
+    return int(CLOCK.time() * 1000)
+
+
+def wait_until(cond, deadline_ms):
+    '''
+    Функция ждет на взятом cond уведомления или момента deadline_ms по текущим часам
+    Может вернуться раньше срока, вызывающий проверяет свое условие в цикле
+    '''
+    CLOCK.wait(cond, deadline_ms)
+
+
+def sleep_ms(ms):
+    CLOCK.sleep(ms)
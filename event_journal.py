@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import zlib
+import pickle
+import struct
+import logging
+import threading
+
+JOURNAL_COMMIT_MS = 50  # окно группового коммита: записи за это время пишутся одним fsync
+SNAPSHOT_EVERY = 1000  # через сколько свечей делаем снимок состояния
+SNAPSHOT_FILE = 'snapshot.bin'
+# типы событий журнала
+CANDLE = 1
+FVG_FOUND = 2
+FVG_EXPANDED = 3
+FVG_COVERED = 4
+ZONE_ADDED = 5
+ORDER_SENT = 6
+FILL = 7
+EVENT_NAMES = {CANDLE: 'candle', FVG_FOUND: 'fvg_found', FVG_EXPANDED: 'fvg_expanded', FVG_COVERED: 'fvg_covered',
+               ZONE_ADDED: 'zone_added', ORDER_SENT: 'order_sent', FILL: 'fill'}
+# числовые поля событий, строки идут после них через разделитель
+EVENT_FORMATS = {
+    CANDLE: struct.Struct('<q6d'),  # open_time, open, high, low, close, volume, turnover
+    FVG_FOUND: struct.Struct('<qbdd'),  # fvg_time, направление, low, high
+    FVG_EXPANDED: struct.Struct('<qdd'),  # fvg_time, low, high
+    FVG_COVERED: struct.Struct('<q'),  # fvg_time
+    ZONE_ADDED: struct.Struct('<qqbddd'),  # id зоны, время создания, направление, low, high, цена входа
+    ORDER_SENT: struct.Struct('<qdd'),  # время, цена, количество; строки: symbol, side, orderLinkId
+    FILL: struct.Struct('<qdd'),  # время, количество, цена; строки: symbol, orderLinkId
+}
+HEADER = struct.Struct('<BII')  # тип, длина, crc32 тела записи
+SEPARATOR = b'\x1f'
+SNAPSHOT_HEADER = struct.Struct('<q')  # номер сегмента, с которого продолжается журнал
+
+
+def encode(event, fields, strings=()):
+    '''
+    Функция упаковывает событие в запись журнала
+    '''
+    body = EVENT_FORMATS[event].pack(*fields)
+    if strings:
+        body += SEPARATOR.join(str(s).encode() for s in strings)
+    return HEADER.pack(event, len(body), zlib.crc32(body)) + body
+
+
+def decode(event, body):
+    '''
+    Функция распаковывает тело записи в (числовые поля, строки)
+    '''
+    fmt = EVENT_FORMATS[event]
+    fields = fmt.unpack_from(body)
+    rest = body[fmt.size:]
+    strings = tuple(s.decode() for s in rest.split(SEPARATOR)) if rest else ()
+    return fields, strings
+
+
+def read_segment(path):
+    '''
+    Функция читает сегмент журнала
+    Возвращает список событий (тип, поля, строки) и длину целой части файла:
+    запись, оборванная при падении или с неверной контрольной суммой, и все после нее отбрасываются
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    events = []
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        event, length, crc = HEADER.unpack_from(data, offset)
+        body = data[offset + HEADER.size:offset + HEADER.size + length]
+        if event not in EVENT_FORMATS or len(body) < length or zlib.crc32(body) != crc:
+            break
+        events.append((event,) + decode(event, body))
+        offset += HEADER.size + length
+    return events, offset
+
+
+class EventJournal:
+    '''
+    Журнал событий бота только на дозапись: свечи, FVG, зоны, ордера и исполнения
+    append упаковывает событие и кладет запись в очередь, запись идет в фоновом потоке:
+    все, что накопилось за commit_ms, пишется одним write и одним fsync
+    Журнал разбит на сегменты, снимок состояния открывает новый сегмент, старые удаляются
+    После падения состояние восстанавливается из снимка и событий после него
+    '''
+    def __init__(self, path, commit_ms=JOURNAL_COMMIT_MS):
+        self.path = path
+        self.commit_ms = commit_ms
+        self.queue = []
+        self.appended = 0
+        self.committed = 0
+        self.segment = None
+        self.file = None
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f'events-{segment:08d}.bin')
+
+    def segments(self):
+        return sorted(int(name[7:15]) for name in os.listdir(self.path)
+                      if name.startswith('events-') and name.endswith('.bin'))
+
+    def load(self, repair=True):
+        '''
+        Функция читает снимок и все события после него
+        При repair обрезает оборванный хвост сегментов и открывает последний на дозапись
+        Возвращает (состояние из снимка или None, список событий)
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        state = None
+        first = 0
+        snapshot_path = os.path.join(self.path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as f:
+                data = f.read()
+            first, = SNAPSHOT_HEADER.unpack_from(data)
+            state = pickle.loads(data[SNAPSHOT_HEADER.size:])
+        events = []
+        segments = [segment for segment in self.segments() if segment >= first] or [first]
+        for segment in segments:
+            path = self.segment_path(segment)
+            if not os.path.exists(path):
+                continue
+            found, size = read_segment(path)
+            events += found
+            if repair and size != os.path.getsize(path):
+                logging.info(f'Journal segment {segment} has a torn tail, truncating to {size} bytes')
+                os.truncate(path, size)
+        if repair:
+            self.open_segment(segments[-1])
+        return state, events
+
+    def open_segment(self, segment):
+        if self.file:
+            self.file.close()
+        self.segment = segment
+        # без буфера: после неудачной записи файл обрезается, и в буфере не должно оставаться ее кусков
+        self.file = open(self.segment_path(segment), 'ab', buffering=0)
+
+    def start(self):
+        with self.cond:
+            if self.file is None:
+                self.load()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.writer, daemon=True)
+                self.thread.start()
+
+    def append(self, event, fields, strings=()):
+        '''
+        Функция упаковывает событие, ставит его в очередь на запись и сразу возвращается
+        Событие с неверными полями бросает исключение здесь, а не теряется в фоновом потоке
+        До start события не пишутся
+        '''
+        if self.thread is None:
+            return
+        record = encode(event, fields, strings)
+        with self.cond:
+            self.queue.append((record, None))
+            self.appended += 1
+            self.cond.notify()
+
+    def snapshot(self, state):
+        '''
+        Функция ставит в очередь снимок состояния
+        Снимок ляжет в журнал ровно после событий, добавленных до него
+        '''
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.cond:
+            self.queue.append((None, data))
+            self.appended += 1
+            self.cond.notify()
+
+    def flush(self, timeout=None):
+        '''
+        Функция ждет, пока все добавленные события не окажутся на диске
+        '''
+        with self.cond:
+            target = self.appended
+            return self.cond.wait_for(lambda: self.committed >= target, timeout)
+
+    def writer(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+            # даем набраться остальным событиям, чтобы сделать один fsync на всех
+            time.sleep(self.commit_ms / 1000)
+            with self.cond:
+                batch, self.queue = self.queue, []
+            try:
+                self.commit(batch)
+            except Exception as e:
+                logging.info(f'Error writing journal: {e}')
+            with self.cond:
+                self.committed += len(batch)
+                self.cond.notify_all()
+
+    def commit(self, batch):
+        '''
+        Функция пишет пачку событий одним write и fsync, снимки делит по сегментам
+        '''
+        chunk = []
+        for record, snapshot in batch:
+            if record is not None:
+                chunk.append(record)
+                continue
+            self.write(chunk)
+            chunk = []
+            try:
+                self.write_snapshot(snapshot)
+            except Exception as e:
+                logging.info(f'Error writing journal snapshot: {e}')
+        self.write(chunk)
+
+    def write(self, chunk):
+        '''
+        Функция дописывает записи в сегмент одним fsync
+        Если запись не удалась, обрезает сегмент до прежней длины и пишет записи по одной,
+        чтобы из-за одной ошибки не потерять всю пачку
+        '''
+        if not chunk:
+            return
+        size = os.fstat(self.file.fileno()).st_size
+        try:
+            self.write_data(b''.join(chunk))
+            return
+        except OSError as e:
+            logging.info(f'Error writing {len(chunk)} journal records: {e}, writing them one by one')
+            os.ftruncate(self.file.fileno(), size)
+        for record in chunk:
+            size = os.fstat(self.file.fileno()).st_size
+            try:
+                self.write_data(record)
+            except OSError as e:
+                logging.info(f'Error writing journal record {EVENT_NAMES.get(record[0])}: {e}')
+                os.ftruncate(self.file.fileno(), size)
+
+    def write_data(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.file.write(view):]
+        os.fsync(self.file.fileno())
+
+    def write_snapshot(self, data):
+        '''
+        Функция открывает новый сегмент и атомарно записывает снимок, который на него ссылается
+        Старые сегменты удаляются только после того, как снимок на диске
+        '''
+        old = self.segment
+        self.open_segment(old + 1)
+        path = os.path.join(self.path, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(self.segment) + data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        for segment in self.segments():
+            if segment <= old:
+                os.remove(self.segment_path(segment))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python event_journal.py <journal_dir>')
+        sys.exit(1)
+    journal = EventJournal(sys.argv[1])
+    state, events = journal.load(repair=False)
+    print(f'snapshot: {"yes" if state else "no"}, events after it: {len(events)}')
+    for event, fields, strings in events:
+        print(EVENT_NAMES[event], *fields, *strings)
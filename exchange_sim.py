@@ -0,0 +1,372 @@
+import sys
+import time
+import bisect
+import logging
+import threading
+import bybit_FVG_bot as bot
+from clock import VirtualClock, SystemClock, set_clock, now_ms
+from kline_feed import KlineFeed
+from kline_store import interval_ms
+
+SIM_BALANCES = {'USDT': 10000.0, 'BTC': 0.5}
+SIM_FILTERS = {
+    'basePrecision': '0.000001', 'quotePrecision': '0.00000001', 'minOrderQty': '0.000048',
+    'maxOrderQty': '71.73', 'minOrderAmt': '1', 'maxOrderAmt': '2000000', 'tickSize': '0.01',
+}
+SIM_FILL_RATIO = 0.1  # какую долю объема свечи может забрать наш лимитный ордер, остальное ждет следующих свечей
+
+
+class SimExchange:
+    '''
+    Локальный симулятор спота биржи с тем же интерфейсом, что и HTTP клиент pybit,
+    но только с методами, которые вызывает бот
+    Свечи берутся из записанной истории, время - из виртуальных часов, сеть не нужна
+    Лимитные ордера исполняются, когда свеча доходит до цены, не больше fill_ratio объема свечи за свечу,
+    после исполнения у ордера появляется TP/SL ордер, который срабатывает по стоп-лоссу или тейк-профиту
+    Изменения ордеров и исполнения рассылаются подписчикам в формате вебсокетов order и execution
+    '''
+    def __init__(self, klines, pair=bot.PAIR, time_frame=bot.TIME_FRAME, clock=None, balances=None,
+                 filters=None, fill_ratio=SIM_FILL_RATIO):
+        self.klines = klines
+        self.open_times = [int(open_time) for open_time in klines['open_time']]
+        self.pair = pair
+        self.base = pair[:-4]
+        self.time_frame = time_frame
+        self.time_frame_ms = interval_ms(time_frame)
+        self.clock = clock or VirtualClock(self.open_times[0])
+        self.balances = dict(SIM_BALANCES if balances is None else balances)
+        self.locked = {}
+        self.filters = dict(SIM_FILTERS, **(filters or {}))
+        self.fill_ratio = fill_ratio
+        self.orders = {} # открытые ордера: orderId -> ордер
+        self.next_id = 1
+        self.cursor = 0 # сколько свечей уже закрылось
+        self.listeners = {'order': [], 'execution': []}
+        self.counts = dict.fromkeys(('placed', 'rejected', 'cancelled', 'fills', 'partial_fills',
+                                     'take_profit', 'stop_loss', 'deactivated'), 0)
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def response(result, code=0, msg='OK'):
+        return {'retCode': code, 'retMsg': msg, 'result': result, 'retExtInfo': {}, 'time': now_ms()}
+
+    def candle(self, i):
+        return {key: values[i] for key, values in self.klines.items()}
+
+    def get_kline(self, category, symbol, interval, limit=200, start=None, end=None):
+        '''
+        Свечи пары до текущего момента, последняя еще формируется: у нее есть только цена открытия
+        '''
+        if symbol != self.pair or str(interval) != str(self.time_frame):
+            return self.response({}, 10001, f'No sim candles for {symbol} {interval}')
+        stop = min(self.cursor + 1, len(self.open_times))
+        if end is not None:
+            stop = min(stop, bisect.bisect_right(self.open_times, end))
+        first = max(0, stop - limit)
+        if start is not None:
+            first = max(first, bisect.bisect_left(self.open_times, start))
+        rows = []
+        for i in range(stop - 1, first - 1, -1):
+            candle = self.candle(i)
+            if i == self.cursor:
+                price = candle['open']
+                candle = dict(candle, high=price, low=price, close=price, volume=0.0, turnover=0.0)
+            rows.append([str(int(candle['open_time']))] + [str(candle[key]) for key in bot.KLINE_KEYS[1:]])
+        return self.response({'symbol': symbol, 'category': category, 'list': rows})
+
+    def get_wallet_balance(self, accountType, coin=None):
+        with self.lock:
+            coins = [{'coin': name, 'walletBalance': str(value), 'locked': str(self.locked.get(name, 0.0))}
+                     for name, value in self.balances.items() if coin in (None, name)]
+        return self.response({'list': [{'accountType': accountType, 'coin': coins}]})
+
+    def get_instruments_info(self, category, symbol, status=None):
+        f = self.filters
+        return self.response({'category': category, 'list': [{
+            'symbol': symbol, 'status': 'Trading', 'baseCoin': self.base, 'quoteCoin': 'USDT',
+            'lotSizeFilter': {key: f[key] for key in ('basePrecision', 'quotePrecision', 'minOrderQty',
+                                                      'maxOrderQty', 'minOrderAmt', 'maxOrderAmt')},
+            'priceFilter': {'tickSize': f['tickSize']},
+        }]})
+
+    def available(self, coin):
+        return self.balances.get(coin, 0.0) - self.locked.get(coin, 0.0)
+
+    def lock_funds(self, coin, amount):
+        self.locked[coin] = self.locked.get(coin, 0.0) + amount
+
+    def place_order(self, category, symbol, side, orderType, qty, price=None, takeProfit=None, stopLoss=None,
+                    orderLinkId='', **kwargs):
+        with self.lock:
+            qty = float(qty)
+            limit = orderType.upper() == 'LIMIT'
+            fill_price = float(price) if limit else self.last_price()
+            # что блокируем под ордер: котируемую монету под покупку, базовую под продажу
+            coin, amount = ('USDT', qty * fill_price) if side == 'Buy' else (self.base, qty)
+            if symbol != self.pair or qty <= 0 or amount > self.available(coin) + 1e-12:
+                self.counts['rejected'] += 1
+                return self.response({}, 170131, 'Insufficient balance.')
+            order = {
+                'orderId': str(self.next_id), 'orderLinkId': orderLinkId, 'symbol': symbol, 'side': side,
+                'orderType': 'Limit' if limit else 'Market', 'price': fill_price, 'qty': qty, 'cumExecQty': 0.0,
+                'orderStatus': 'New', 'stopOrderType': '', 'takeProfit': float(takeProfit or 0),
+                'stopLoss': float(stopLoss or 0), 'createdTime': now_ms(), 'updatedTime': now_ms(), 'parent': None,
+            }
+            self.next_id += 1
+            self.counts['placed'] += 1
+            self.orders[order['orderId']] = order
+            self.lock_funds(coin, amount)
+            self.emit_order(order)
+            if not limit:
+                self.fill(order, qty, fill_price)
+            return self.response({'orderId': order['orderId'], 'orderLinkId': orderLinkId})
+
+    def cancel_order(self, category, symbol, orderId=None, orderLinkId=None):
+        with self.lock:
+            order = self.orders.get(orderId)
+            if order is None:
+                return self.response({}, 170213, 'Order does not exist.')
+            self.release(order)
+            self.close(order, 'Cancelled')
+            self.counts['cancelled'] += 1
+            # позицию за частично исполненным ордером закрывает бот, TP/SL на нее больше не нужен
+            child = order.get('child')
+            if child is not None and child['orderId'] in self.orders:
+                self.close(child, 'Cancelled')
+            return self.response({'orderId': orderId, 'orderLinkId': order['orderLinkId']})
+
+    def batch(self, method, category, request):
+        results, codes = [], []
+        for params in request:
+            response = method(category=category, **params)
+            results.append(response['result'])
+            codes.append({'code': response['retCode'], 'msg': response['retMsg']})
+        return dict(self.response({'list': results}), retExtInfo={'list': codes})
+
+    def place_batch_order(self, category, request):
+        return self.batch(self.place_order, category, request)
+
+    def cancel_batch_order(self, category, request):
+        return self.batch(self.cancel_order, category, request)
+
+    def get_open_orders(self, category, symbol=None, limit=50, cursor=None, **kwargs):
+        with self.lock:
+            orders = [order for order in self.orders.values() if symbol in (None, order['symbol'])]
+        first = int(cursor or 0)
+        page = orders[first:first + limit]
+        next_cursor = str(first + limit) if first + limit < len(orders) else ''
+        return self.response({'list': [self.render(order) for order in page], 'nextPageCursor': next_cursor})
+
+    def last_price(self):
+        return float(self.klines['close'][max(0, self.cursor - 1)])
+
+    def release(self, order):
+        '''
+        Функция снимает блокировку с неисполненного остатка ордера
+        '''
+        if order['stopOrderType']:
+            return
+        left = order['qty'] - order['cumExecQty']
+        if order['side'] == 'Buy':
+            self.locked['USDT'] -= left * order['price']
+        else:
+            self.locked[self.base] -= left
+
+    def fill(self, order, qty, price):
+        '''
+        Функция исполняет qty ордера по цене price и двигает балансы
+        '''
+        cost = qty * price
+        if order['side'] == 'Buy':
+            self.balances['USDT'] = self.balances.get('USDT', 0.0) - cost
+            self.balances[self.base] = self.balances.get(self.base, 0.0) + qty
+            if not order['stopOrderType']:
+                self.locked['USDT'] -= qty * order['price']
+        else:
+            self.balances[self.base] = self.balances.get(self.base, 0.0) - qty
+            self.balances['USDT'] = self.balances.get('USDT', 0.0) + cost
+            if not order['stopOrderType']:
+                self.locked[self.base] -= qty
+        order['cumExecQty'] += qty
+        order['updatedTime'] = now_ms()
+        full = order['cumExecQty'] >= order['qty'] - 1e-12
+        self.counts['fills' if full else 'partial_fills'] += 1
+        for callback in self.listeners['execution']:
+            callback({'topic': 'execution', 'data': [{
+                'category': 'spot', 'symbol': order['symbol'], 'orderId': order['orderId'],
+                'orderLinkId': order['orderLinkId'], 'side': order['side'], 'execQty': str(qty),
+                'execPrice': str(price), 'execTime': str(now_ms()),
+            }]})
+        if full:
+            self.close(order, 'Filled')
+        else:
+            order['orderStatus'] = 'PartiallyFilled'
+            self.emit_order(order)
+
+    def close(self, order, status):
+        order['orderStatus'] = status
+        order['updatedTime'] = now_ms()
+        self.orders.pop(order['orderId'], None)
+        self.emit_order(order)
+
+    def attach_tpsl(self, order, qty):
+        '''
+        Функция заводит или увеличивает TP/SL ордер на исполненную часть лимитного ордера
+        '''
+        child = order.get('child')
+        if child is not None and child['orderId'] in self.orders:
+            child['qty'] += qty
+            child['updatedTime'] = now_ms()
+            self.emit_order(child)
+            return
+        child = {
+            'orderId': str(self.next_id), 'orderLinkId': '', 'symbol': order['symbol'],
+            'side': 'Sell' if order['side'] == 'Buy' else 'Buy', 'orderType': 'Market', 'price': 0.0,
+            'qty': qty, 'cumExecQty': 0.0, 'orderStatus': 'Untriggered', 'stopOrderType': 'BidirectionalTpslOrder',
+            'takeProfit': order['takeProfit'], 'stopLoss': order['stopLoss'], 'createdTime': now_ms(),
+            'updatedTime': now_ms(), 'parent': order['orderId'],
+        }
+        self.next_id += 1
+        order['child'] = child
+        self.orders[child['orderId']] = child
+        self.emit_order(child)
+
+    def advance(self):
+        '''
+        Функция закрывает следующую свечу: двигает часы на ее закрытие и исполняет на ней ордера
+        Возвращает закрытую свечу или None, если история кончилась
+        '''
+        if self.cursor >= len(self.open_times):
+            return None
+        candle = self.candle(self.cursor)
+        self.cursor += 1
+        self.clock.set(int(candle['open_time']) + self.time_frame_ms)
+        with self.lock:
+            self.match(candle)
+        return candle
+
+    def match(self, candle):
+        high, low = float(candle['high']), float(candle['low'])
+        budget = float(candle['volume']) * self.fill_ratio if self.fill_ratio else None
+        # сначала лимитные ордера, потом TP/SL, в том числе появившиеся на этой же свече
+        for order in sorted(self.orders.values(), key=lambda o: int(o['orderId'])):
+            if order['stopOrderType'] or order['orderType'] != 'Limit':
+                continue
+            if (low <= order['price']) if order['side'] == 'Buy' else (high >= order['price']):
+                qty = order['qty'] - order['cumExecQty']
+                if budget is not None:
+                    qty = min(qty, budget)
+                    budget -= qty
+                if qty <= 0:
+                    continue
+                self.fill(order, qty, order['price'])
+                if order['takeProfit'] or order['stopLoss']:
+                    self.attach_tpsl(order, qty)
+        for order in sorted(self.orders.values(), key=lambda o: int(o['orderId'])):
+            if not order['stopOrderType']:
+                continue
+            long = order['side'] == 'Sell'
+            # если на одной свече задеты и SL, и TP, считаем что сработал SL, как в бэктесте
+            if order['stopLoss'] and ((low <= order['stopLoss']) if long else (high >= order['stopLoss'])):
+                price, kind = order['stopLoss'], 'stop_loss'
+            elif order['takeProfit'] and ((high >= order['takeProfit']) if long else (low <= order['takeProfit'])):
+                price, kind = order['takeProfit'], 'take_profit'
+            else:
+                continue
+            coin, amount = (self.base, order['qty']) if long else ('USDT', order['qty'] * price)
+            # позицию уже закрыли рыночным ордером, закрывать нечего
+            if amount > self.available(coin) + 1e-12:
+                self.counts['deactivated'] += 1
+                self.close(order, 'Deactivated')
+                continue
+            self.counts[kind] += 1
+            self.fill(order, order['qty'], price)
+
+    def render(self, order):
+        '''
+        Функция переводит ордер в формат ответа биржи: числа строками
+        '''
+        view = {key: value for key, value in order.items() if key not in ('parent', 'child')}
+        for key in ('price', 'qty', 'cumExecQty', 'takeProfit', 'stopLoss'):
+            view[key] = str(order[key])
+        view['createdTime'] = str(order['createdTime'])
+        view['updatedTime'] = str(order['updatedTime'])
+        view['category'] = 'spot'
+        return view
+
+    def emit_order(self, order):
+        message = {'topic': 'order', 'data': [self.render(order)]}
+        for callback in self.listeners['order']:
+            callback(message)
+
+    def equity(self):
+        return self.balances.get('USDT', 0.0) + self.balances.get(self.base, 0.0) * self.last_price()
+
+
+class SimKlineFeed(KlineFeed):
+    '''
+    Источник свечей симуляции для trade()
+    Каждая следующая свеча закрывается на симуляторе: часы идут на ее закрытие, ордера исполняются,
+    затем истекшие ордера закрываются так же, как это делает order_canceller
+    Все идет в одном потоке по порядку, поэтому прогон детерминирован
+    '''
+    def __init__(self, exchange, tracker=None, close_expired=None):
+        super().__init__(exchange.pair, exchange.time_frame, exchange.time_frame_ms)
+        self.exchange = exchange
+        self.tracker = tracker
+        self.close_expired = close_expired
+
+    def next_candle(self):
+        candle = self.exchange.advance()
+        if candle is None:
+            return None
+        if self.tracker is not None:
+            with self.tracker.cond:
+                expired = self.tracker.pop_expired(now_ms())
+            if expired:
+                self.close_expired(expired)
+        return candle
+
+
+def run_simulation(klines, pair=bot.PAIR, time_frame=bot.TIME_FRAME, balances=None, filters=None,
+                   fill_ratio=SIM_FILL_RATIO):
+    '''
+    Функция прогоняет бота (trade и логику order_canceller) по записанным свечам на симуляторе
+    Возвращает сводку: счетчики ордеров, балансы, время симуляции и реальное время прогона
+    '''
+    clock = VirtualClock(int(klines['open_time'][0]))
+    exchange = SimExchange(klines, pair, time_frame, clock, balances, filters, fill_ratio)
+    client, window_ms = bot.spot_client, bot.ORDER_GATEWAY.window_ms
+    set_clock(clock)
+    bot.set_exchange(exchange)
+    bot.ORDER_GATEWAY.window_ms = 0 # в симуляции ордера некому копить, ждать окно незачем
+    try:
+        bot.FILTER_CACHE.refresh(pair)
+        bot.BALANCE_CACHE.refresh()
+        bot.ORDER_TRACKER.pair = pair
+        bot.ORDER_TRACKER.reconcile()
+        exchange.listeners['order'].append(bot.ORDER_TRACKER.on_order_message)
+        exchange.listeners['execution'].append(bot.on_execution_message)
+        # после исполнений кэш балансов обновляем сразу, фонового потока в симуляции нет
+        exchange.listeners['execution'].append(lambda message: bot.BALANCE_CACHE.refresh())
+        started = time.perf_counter()
+        bot.trade(SimKlineFeed(exchange, bot.ORDER_TRACKER, bot.close_expired))
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.set_exchange(client)
+        bot.ORDER_GATEWAY.window_ms = window_ms
+        set_clock(SystemClock())
+    simulated = len(exchange.open_times) * exchange.time_frame_ms / 1000
+    return dict(exchange.counts, candles=len(exchange.open_times), open_orders=len(exchange.orders),
+                balances=dict(exchange.balances), equity=exchange.equity(), wall_seconds=elapsed,
+                speedup=simulated / elapsed if elapsed else float('inf'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python exchange_sim.py <klines.csv|klines.npz|store_dir>')
+        sys.exit(1)
+    from fvg_backtest import load_klines
+    logging.getLogger().setLevel(logging.WARNING)
+    for key, value in run_simulation(load_klines(sys.argv[1])).items():
+        print(f'{key:>14}: {value}')
@@ -0,0 +1,246 @@
+import os
+import sys
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from bybit_FVG_bot import KLINE_KEYS, TIME_FRAME_MS, RISK, strategy_settings
+from kline_store import KlineStore
+
+DEFAULT_PARAMS = dict(strategy_settings(), time_frame_ms=TIME_FRAME_MS, skip_after_fvg=False)
+# статусы сделок в журнале
+COVERED = 0
+EXPIRED = 1
+TAKE_PROFIT = 2
+STOP_LOSS = 3
+TIMEOUT = 4
+OPEN = 5
+STATUS_NAMES = ['covered', 'expired', 'take_profit', 'stop_loss', 'timeout', 'open']
+
+
+def load_klines(path):
+    '''
+    Функция загружает свечи из CSV или NPZ файла или из папки хранилища свечей
+    Возвращает словарь numpy-массивов с ключами KLINE_KEYS, отсортированный по open_time
+    Свечи из хранилища не копируются в память, а читаются через memmap
+    '''
+    if os.path.isdir(path):
+        # только чтение: живой бот может в это время дописывать хранилище
+        return KlineStore(path, readonly=True).read()
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            klines = {key: data[key] for key in KLINE_KEYS}
+    else:
+        with open(path) as f:
+            header = f.readline().strip().split(',')
+        # если в первой строке заголовок, берем порядок колонок из него
+        if header[0].replace('.', '', 1).isdigit():
+            columns, skiprows = KLINE_KEYS, 0
+        else:
+            columns, skiprows = header, 1
+        data = np.loadtxt(path, delimiter=',', skiprows=skiprows, ndmin=2)
+        klines = {key: data[:, columns.index(key)] for key in KLINE_KEYS}
+    klines['open_time'] = klines['open_time'].astype(np.int64)
+    for key in KLINE_KEYS[1:]:
+        klines[key] = klines[key].astype(np.float64)
+    # биржа отдает свечи от новых к старым, приводим к хронологическому порядку
+    if len(klines['open_time']) > 1 and np.any(np.diff(klines['open_time']) < 0):
+        order = np.argsort(klines['open_time'], kind='stable')
+        klines = {key: value[order] for key, value in klines.items()}
+    return klines
+
+
+def save_klines(path, klines):
+    '''
+    Функция сохраняет свечи в NPZ файл
+    '''
+    np.savez(path, **{key: np.asarray(klines[key]) for key in KLINE_KEYS})
+
+
+def _windows(values, start, width, fill, padded=None):
+    '''
+    Функция возвращает матрицу окон values[start:start+width] для каждого start
+    Выход за конец массива заполняется значением fill
+    padded - те же значения с хвостом из fill (см. fvg_sweep.share_klines): если хвоста хватает,
+    колонка не копируется
+    '''
+    if padded is None or len(padded) < len(values) + width:
+        padded = np.concatenate([values, np.full(width, fill)])
+    return sliding_window_view(padded[:len(values) + width], width)[start]
+
+
+def find_fvg(klines):
+    '''
+    Функция ищет все FVG на закрытых свечах
+    Возвращает индексы третьих свечей FVG, направление (1 - бычья, -1 - медвежья) и границы
+    '''
+    high, low = klines['high'], klines['low']
+    bull = np.zeros(len(high), dtype=bool)
+    bear = np.zeros(len(high), dtype=bool)
+    bull[2:] = high[:-2] < low[2:]  # как в check_if_bull_fvg
+    bear[2:] = low[:-2] > high[2:]  # как в check_if_bear_fvg
+    idx = np.flatnonzero(bull | bear)
+    direction = np.where(bull[idx], 1, -1).astype(np.int8)
+    fvg_low = np.where(direction == 1, high[idx - 2], high[idx])
+    fvg_high = np.where(direction == 1, low[idx], low[idx - 2])
+    return idx, direction, fvg_low, fvg_high
+
+
+def _apply_cooldown(idx, span):
+    '''
+    Функция отбрасывает FVG, которые старый бот пропускал, пока ждал свечи после предыдущей FVG
+    После FVG бот ждал span свечей цикла перекрытия и еще 3 свечи до следующей проверки
+    Нужна только для сравнения со старым поведением (skip_after_fvg=True)
+    '''
+    keep = np.zeros(len(idx), dtype=bool)
+    ready = 0
+    # цикл идет только по найденным FVG, а не по всем свечам
+    for n in range(len(idx)):
+        if idx[n] >= ready:
+            keep[n] = True
+            ready = idx[n] + span[n] + 3
+    return keep
+
+
+def run_backtest(klines, params=None):
+    '''
+    Функция прогоняет стратегию FVG по историческим свечам
+    В klines может лежать 'padded': high и low с хвостом из NaN, тогда окна свечей строятся без копий колонок
+    Возвращает журнал сделок (словарь массивов) и сводную статистику
+    '''
+    p = dict(DEFAULT_PARAMS, **(params or {}))
+    high, low, close = klines['high'], klines['low'], klines['close']
+    padded = klines.get('padded', {})
+    open_time = klines['open_time']
+    n_candles = len(high)
+    idx, direction, fvg_low, fvg_high = find_fvg(klines)
+    bull = direction == 1
+    cover_n = np.where(bull, p['cover_neighbors_bull'], p['cover_neighbors_bear'])
+    expand_n = np.where(bull, p['expand_neighbors_bull'], p['expand_neighbors_bear'])
+    span = np.maximum(cover_n, expand_n)
+    # FVG без полного окна соседей в конце истории не оцениваем
+    complete = idx + span < n_candles
+    idx, direction, fvg_low, fvg_high = idx[complete], direction[complete], fvg_low[complete], fvg_high[complete]
+    bull, cover_n, expand_n, span = bull[complete], cover_n[complete], expand_n[complete], span[complete]
+
+    # окно соседних свечей после FVG для перекрытия и расширения
+    width = int(span.max()) if len(span) else 0
+    covered = np.zeros(len(idx), dtype=bool)
+    covered_at = span.copy()
+    if width:
+        nb_low = _windows(low, idx + 1, width, np.nan, padded.get('low'))
+        nb_high = _windows(high, idx + 1, width, np.nan, padded.get('high'))
+        steps = np.arange(width)
+        # бычья FVG перекрывается минимумом ниже нижней границы, медвежья - максимумом выше верхней
+        cover_hit = np.where(bull[:, None], nb_low < fvg_low[:, None], nb_high > fvg_high[:, None])
+        cover_hit &= steps < cover_n[:, None]
+        covered = cover_hit.any(axis=1)
+        covered_at = np.where(covered, cover_hit.argmax(axis=1) + 1, span)
+        # расширение: бычья FVG тянется вверх до минимумов соседей, медвежья - вниз до максимумов
+        # соседи за пределами expand_n не должны влиять на max/min, поэтому там -inf/+inf, а не NaN
+        in_expand = steps < expand_n[:, None]
+        fvg_high = np.where(bull, np.maximum(fvg_high, np.where(in_expand, nb_low, -np.inf).max(axis=1)), fvg_high)
+        fvg_low = np.where(bull, fvg_low, np.minimum(fvg_low, np.where(in_expand, nb_high, np.inf).min(axis=1)))
+
+    if p['skip_after_fvg']:
+        keep = _apply_cooldown(idx, covered_at)
+        idx, direction, fvg_low, fvg_high = idx[keep], direction[keep], fvg_low[keep], fvg_high[keep]
+        bull, span, covered = bull[keep], span[keep], covered[keep]
+
+    # параметры ордера как в calc_order_params
+    size = fvg_high - fvg_low
+    price = np.where(bull, fvg_high - p['start_trade'] * size, fvg_low + p['start_trade'] * size)
+    sl = np.where(bull, fvg_low * (1 - p['stop_loss_offset']), fvg_high * (1 + p['stop_loss_offset']))
+    tp = np.where(bull, price + (price - sl) * p['risk_reward_ratio'], price - (sl - price) * p['risk_reward_ratio'])
+
+    n = len(idx)
+    status = np.where(covered, COVERED, EXPIRED).astype(np.int8)
+    entry_idx = np.full(n, -1, dtype=np.int64)
+    exit_idx = np.full(n, -1, dtype=np.int64)
+    exit_price = np.full(n, np.nan)
+    order_width = max(1, -(-p['max_order_duration'] // p['time_frame_ms']))
+    trade_width = max(1, -(-p['max_trade_duration'] // p['time_frame_ms']))
+
+    # лимитный ордер выставляется после закрытия последнего соседа и живет order_width свечей
+    placed = np.flatnonzero(~covered)
+    start = idx[placed] + span[placed] + 1
+    w_low = _windows(low, start, order_width, np.nan, padded.get('low'))
+    w_high = _windows(high, start, order_width, np.nan, padded.get('high'))
+    fill_hit = np.where(bull[placed, None], w_low <= price[placed, None], w_high >= price[placed, None])
+    filled = fill_hit.any(axis=1)
+    placed = placed[filled]
+    entry_idx[placed] = start[filled] + fill_hit[filled].argmax(axis=1)
+
+    # после исполнения ищем первую свечу, задевшую TP или SL, в пределах trade_width свечей
+    entry = entry_idx[placed]
+    w_low = _windows(low, entry, trade_width, np.nan, padded.get('low'))
+    w_high = _windows(high, entry, trade_width, np.nan, padded.get('high'))
+    pb = bull[placed, None]
+    sl_hit = np.where(pb, w_low <= sl[placed, None], w_high >= sl[placed, None])
+    tp_hit = np.where(pb, w_high >= tp[placed, None], w_low <= tp[placed, None])
+    any_sl, any_tp = sl_hit.any(axis=1), tp_hit.any(axis=1)
+    first_sl = np.where(any_sl, sl_hit.argmax(axis=1), trade_width)
+    first_tp = np.where(any_tp, tp_hit.argmax(axis=1), trade_width)
+    # если TP и SL задеты на одной свече, считаем что сработал SL
+    by_sl = any_sl & (first_sl <= first_tp)
+    by_tp = any_tp & ~by_sl
+    timeout = ~(by_sl | by_tp)
+    last = entry + trade_width - 1
+    in_history = last < n_candles
+    status[placed] = np.select([by_sl, by_tp, timeout & in_history], [STOP_LOSS, TAKE_PROFIT, TIMEOUT], OPEN)
+    exit_idx[placed] = np.select([by_sl, by_tp], [entry + first_sl, entry + first_tp], np.minimum(last, n_candles - 1))
+    exit_price[placed] = np.select([by_sl, by_tp], [sl[placed], tp[placed]], close[exit_idx[placed]])
+
+    risk_per_unit = np.where(bull, price - sl, sl - price)
+    r_multiple = np.where(bull, exit_price - price, price - exit_price) / risk_per_unit
+    r_multiple[status == OPEN] = np.nan
+    ledger = {
+        'open_time': open_time[idx],
+        'direction': direction,
+        'fvg_low': fvg_low,
+        'fvg_high': fvg_high,
+        'price': price,
+        'take_profit': tp,
+        'stop_loss': sl,
+        'status': status,
+        'entry_time': np.where(entry_idx >= 0, open_time[entry_idx], -1),
+        'exit_time': np.where(exit_idx >= 0, open_time[exit_idx] + p['time_frame_ms'], -1),
+        'exit_price': exit_price,
+        'r_multiple': r_multiple,
+    }
+    return ledger, summarize(ledger, p['risk'])
+
+
+def summarize(ledger, risk=RISK):
+    '''
+    Функция считает сводную статистику по журналу сделок
+    '''
+    status = ledger['status']
+    closed = np.isin(status, (TAKE_PROFIT, STOP_LOSS, TIMEOUT))
+    r = ledger['r_multiple'][closed]
+    # капитал растет на risk * R после каждой закрытой сделки
+    equity = np.cumprod(1 + risk * r)
+    peak = np.maximum.accumulate(equity) if len(equity) else equity
+    gains, losses = r[r > 0].sum(), -r[r < 0].sum()
+    stats = {name: int((status == code).sum()) for code, name in enumerate(STATUS_NAMES)}
+    stats.update({
+        'fvg': len(status),
+        'orders': int((status != COVERED).sum()),
+        'trades': int(closed.sum()),
+        'win_rate': float((r > 0).mean()) if len(r) else 0.0,
+        'avg_r': float(r.mean()) if len(r) else 0.0,
+        'total_r': float(r.sum()),
+        'profit_factor': float(gains / losses) if losses else float('inf') if gains else 0.0,
+        'return': float(equity[-1] - 1) if len(equity) else 0.0,
+        'max_drawdown': float((1 - equity / peak).max()) if len(equity) else 0.0,
+    })
+    return stats
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python fvg_backtest.py <klines.csv|klines.npz|store_dir> [time_frame_minutes]')
+        sys.exit(1)
+    klines = load_klines(sys.argv[1])
+    params = {'time_frame_ms': int(sys.argv[2]) * 60000} if len(sys.argv) > 2 else {}
+    ledger, stats = run_backtest(klines, params)
+    for key, value in stats.items():
+        print(f'{key}: {value}')
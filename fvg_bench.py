@@ -0,0 +1,321 @@
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import tempfile
+import statistics
+import numpy as np
+import bybit_FVG_bot as bot
+from clock import VirtualClock, SystemClock, set_clock
+from event_journal import EventJournal, CANDLE
+from exchange_sim import SimExchange
+from fvg_zones import ZoneStore
+from kline_resampler import KlineResampler
+from order_tracker import OrderTracker
+
+BENCH_BASELINE = 'bench_baseline.json'
+BENCH_REPEAT = 5  # сколько раз повторяем замер, в результат идет медиана
+BENCH_TOLERANCE = 0.25  # замедление больше этой доли от базовой линии считается регрессией
+KLINES_RESPONSE_SIZE = 1000
+OPEN_ORDERS_SIZE = 10000
+ZONES_SIZE = 10000
+E2E_CANDLES = 5000
+
+
+def synthetic_klines(n, seed=1, start=1700000000000, time_frame_ms=bot.TIME_FRAME_MS):
+    '''
+    Функция возвращает n синтетических свечей (случайное блуждание) в формате load_klines
+    '''
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.003, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n)))
+    volume = rng.random(n) * 20
+    return {'open_time': start - start % time_frame_ms + np.arange(n, dtype=np.int64) * time_frame_ms,
+            'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume, 'turnover': volume * close}
+
+
+def synthetic_orders(n, pair=bot.PAIR, seed=1):
+    '''
+    Функция возвращает n открытых ордеров в формате ответа get_open_orders
+    '''
+    rng = random.Random(seed)
+    orders = []
+    for i in range(n):
+        kind = rng.random()
+        orders.append({
+            'orderId': str(10 ** 9 + i), 'orderLinkId': f'{i:032x}', 'symbol': pair,
+            'side': rng.choice(('Buy', 'Sell')), 'orderType': 'Market' if kind < 0.2 else 'Limit',
+            'orderStatus': 'Untriggered' if kind < 0.2 else ('PartiallyFilled' if kind < 0.3 else 'New'),
+            'stopOrderType': 'BidirectionalTpslOrder' if kind < 0.2 else '',
+            'price': f'{rng.uniform(25000, 35000):.2f}', 'qty': f'{rng.uniform(0.001, 1):.6f}',
+            'cumExecQty': '0.01' if 0.2 <= kind < 0.3 else '0',
+            'createdTime': str(1700000000000 + i * 1000), 'updatedTime': str(1700000000000 + i * 1000),
+            'category': 'spot',
+        })
+    return orders
+
+
+class CannedClient:
+    '''
+    Клиент биржи с заранее собранными ответами, чтобы в замер попадал только код бота
+    '''
+    def __init__(self, klines, orders, page=50):
+        self.instruments = SimExchange(klines).get_instruments_info('spot', bot.PAIR)
+        rows = [[str(int(klines['open_time'][i]))] + [str(float(klines[key][i])) for key in bot.KLINE_KEYS[1:]]
+                for i in range(len(klines['open_time']) - 1, -1, -1)]
+        self.kline_response = self.response({'list': rows})
+        self.pages = {}
+        for first in range(0, len(orders), page):
+            cursor = str(first + page) if first + page < len(orders) else ''
+            self.pages[str(first) if first else None] = self.response({'list': orders[first:first + page],
+                                                                       'nextPageCursor': cursor})
+        self.pages.setdefault(None, self.response({'list': [], 'nextPageCursor': ''}))
+        self.wallet = self.response({'list': [{'coin': [{'coin': 'USDT', 'walletBalance': '10000'},
+                                                        {'coin': 'BTC', 'walletBalance': '0.5'}]}]})
+
+    @staticmethod
+    def response(result):
+        return {'retCode': 0, 'retMsg': 'OK', 'result': result, 'retExtInfo': {}}
+
+    def get_kline(self, **kwargs):
+        return self.kline_response
+
+    def get_open_orders(self, category, symbol=None, limit=50, cursor=None):
+        return self.pages[cursor]
+
+    def get_wallet_balance(self, **kwargs):
+        return self.wallet
+
+    def get_instruments_info(self, **kwargs):
+        return self.instruments
+
+
+def measure(func, number, repeat=BENCH_REPEAT):
+    '''
+    Функция возвращает медиану и минимум времени одного вызова func в микросекундах
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number * 1e6)
+    return {'us': statistics.median(times), 'min_us': min(times)}
+
+
+def measure_pass(run, items, repeat=BENCH_REPEAT):
+    '''
+    Функция замеряет проход run() по items элементам и возвращает время на один элемент
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) / items * 1e6)
+    return {'us': statistics.median(times), 'min_us': min(times)}
+
+
+def bench_parsing(klines):
+    return measure(lambda: bot.fetch_klines(bot.PAIR, bot.TIME_FRAME, KLINES_RESPONSE_SIZE), 20)
+
+
+def bench_fvg_checks(klines):
+    window = {key: [float(v) for v in values[:3]] for key, values in klines.items()}
+    return measure(lambda: (bot.check_if_bear_fvg(window), bot.check_if_bull_fvg(window)), 20000)
+
+
+def bench_state_machine(klines):
+    candles = [{key: float(values[i]) for key, values in klines.items()} for i in range(len(klines['open_time']))]
+
+    def run():
+        machine = bot.FVGStateMachine(zones=ZoneStore())
+        for candle in candles:
+            machine.on_candle(candle)
+    return measure_pass(run, len(candles))
+
+
+def bench_calc_order_params(klines):
+    bot.BALANCE_CACHE.refresh()
+    fvg_dict = {'low': [30000.0], 'high': [30150.0]}
+    return measure(lambda: bot.calc_order_params(False, True, fvg_dict), 20000)
+
+
+def bench_check_order_params(klines):
+    bot.BALANCE_CACHE.refresh()
+    params = bot.calc_order_params(False, True, {'low': [30000.0], 'high': [30150.0]})
+    order_filters = bot.get_order_filters()
+    return measure(lambda: bot.check_order_params(dict(params), order_filters, False, True), 5000)
+
+
+def bench_get_orders(klines):
+    return measure(bot.get_orders, 5)
+
+
+def bench_canceller_scan(klines):
+    '''
+    Сверка индекса ордеров с 10k ордерами и извлечение всех истекших
+    '''
+    tracker = OrderTracker(bot.get_orders, bot.PAIR, bot.MAX_ORDER_DURATION, bot.MAX_TRADE_DURATION)
+
+    def run():
+        tracker.reconcile()
+        with tracker.cond:
+            tracker.pop_expired(2 ** 62)
+    return measure(run, 1)
+
+
+def bench_zone_update(klines):
+    rng = np.random.default_rng(2)
+    zones = ZoneStore(max_zones=ZONES_SIZE, max_age_ms=None)
+    low = rng.uniform(20000, 40000, ZONES_SIZE)
+    for i in range(ZONES_SIZE):
+        zones.add(i, 1 if i % 2 else -1, low[i], low[i] * 1.002, low[i] * 1.001)
+    zones.rebuild()
+    # свечи далеко от зон, чтобы мерить поиск, а не закрытие зон
+    candle = {'open_time': ZONES_SIZE, 'high': 45100.0, 'low': 45000.0}
+    return measure(lambda: zones.update(candle), 20000)
+
+
+def bench_resample(klines):
+    minutes = synthetic_klines(24 * 60, time_frame_ms=60000)
+    candles = [{key: float(values[i]) for key, values in minutes.items()} for i in range(len(minutes['open_time']))]
+
+    def run():
+        resampler = KlineResampler(bot.PAIR, ['5', '15', '60', '240'])
+        for candle in candles:
+            resampler.push(candle)
+    return measure_pass(run, len(candles))
+
+
+def bench_journal_append(klines):
+    with tempfile.TemporaryDirectory() as path:
+        journal = EventJournal(path)
+        journal.start()
+        fields = (1700000000000, 1.0, 2.0, 0.5, 1.5, 10.0, 15.0)
+        result = measure(lambda: journal.append(CANDLE, fields), 20000)
+        journal.flush()
+    return result
+
+
+def bench_e2e(klines):
+    '''
+    От закрытия свечи до ответа биржи на ордер: машина состояний, расчет, фильтры, шлюз, симулятор
+    '''
+    clock = VirtualClock(int(klines['open_time'][0]))
+    exchange = SimExchange(klines, clock=clock, balances={'USDT': 1e12, 'BTC': 1e8})
+    client, window_ms = bot.spot_client, bot.ORDER_GATEWAY.window_ms
+    set_clock(clock)
+    bot.set_exchange(exchange)
+    bot.ORDER_GATEWAY.window_ms = 0
+    try:
+        bot.FILTER_CACHE.refresh(bot.PAIR)
+        bot.BALANCE_CACHE.refresh()
+        machine = bot.FVGStateMachine(zones=ZoneStore())
+        latencies = []
+        while True:
+            candle = exchange.advance()
+            if candle is None:
+                break
+            start = time.perf_counter()
+            signals = machine.on_candle(candle)
+            for bear_fvg_flag, bull_fvg_flag, fvg_dict in signals:
+                bot.place_fvg_order(bear_fvg_flag, bull_fvg_flag, fvg_dict)
+            if signals:
+                latencies.append((time.perf_counter() - start) * 1e6)
+    finally:
+        bot.set_exchange(client)
+        bot.ORDER_GATEWAY.window_ms = window_ms
+        set_clock(SystemClock())
+    latencies.sort()
+    return {'us': statistics.median(latencies), 'min_us': latencies[0],
+            'p99_us': latencies[int(0.99 * (len(latencies) - 1))], 'signals': len(latencies)}
+
+
+BENCHMARKS = {
+    'parse_klines_1000': bench_parsing,
+    'fvg_checks': bench_fvg_checks,
+    'state_machine_per_candle': bench_state_machine,
+    'calc_order_params': bench_calc_order_params,
+    'check_order_params': bench_check_order_params,
+    'get_orders_10k': bench_get_orders,
+    'canceller_scan_10k': bench_canceller_scan,
+    'zone_update_10k': bench_zone_update,
+    'resample_per_minute': bench_resample,
+    'journal_append': bench_journal_append,
+    'e2e_close_to_submit': bench_e2e,
+}
+
+
+def run_benchmarks(names=None):
+    '''
+    Функция прогоняет бенчмарки на синтетических ответах биржи без сети
+    Возвращает словарь с окружением и результатами в микросекундах
+    '''
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING) # запись логов в файл мерить не хотим
+    client = bot.spot_client
+    klines = synthetic_klines(E2E_CANDLES)
+    bot.set_exchange(CannedClient(synthetic_klines(KLINES_RESPONSE_SIZE), synthetic_orders(OPEN_ORDERS_SIZE)))
+    results = {}
+    try:
+        for name, bench in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            results[name] = bench(klines)
+    finally:
+        bot.set_exchange(client)
+        logging.getLogger().setLevel(level)
+    return {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                 'system': platform.system(), 'time': int(time.time())},
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=BENCH_TOLERANCE):
+    '''
+    Функция возвращает список бенчмарков, которые стали медленнее базовой линии больше чем на tolerance
+    Сравниваем лучшие замеры: на них меньше всего влияет шум соседних процессов
+    '''
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base and result['min_us'] > base['min_us'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f'{"benchmark":<28} {"us":>12} {"min us":>12} {"base min":>12} {"ratio":>8}')
+    for name, result in report['results'].items():
+        base = (baseline or {}).get('results', {}).get(name)
+        extra = f'{base["min_us"]:>12.2f} {result["min_us"] / base["min_us"]:>8.2f}' if base else ''
+        print(f'{name:<28} {result["us"]:>12.2f} {result["min_us"]:>12.2f} {extra}')
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    path = sys.argv[2] if len(sys.argv) > 2 else BENCH_BASELINE
+    if command not in ('run', 'save', 'compare'):
+        print('Usage: python fvg_bench.py [run|save|compare] [baseline.json]')
+        sys.exit(1)
+    report = run_benchmarks()
+    if command == 'save':
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+        print(f'Baseline saved to {path}')
+    elif command == 'compare':
+        with open(path) as f:
+            baseline = json.load(f)
+        print_report(report, baseline)
+        regressions = compare(report, baseline)
+        if regressions:
+            print(f'Regressions over {BENCH_TOLERANCE:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+    else:
+        print_report(report)
@@ -0,0 +1,20 @@
+import os
+import json
+
+CONFIG_ENV = 'FVG_CONFIG'  # переменная окружения с путем к файлу настроек
+
+
+def load_config(path=None):
+    '''
+    Функция читает настройки бота из JSON файла
+    Ключи - имена констант bybit_FVG_bot (PAIR, TIME_FRAME, RISK, ...), их значения заменяют константы
+    Без файла возвращает пустой словарь, и бот работает на константах модуля
+    '''
+    path = path or os.environ.get(CONFIG_ENV)
+    if not path:
+        return {}
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f'Config {path} must be a JSON object')
+    return config
@@ -0,0 +1,121 @@
+import os
+import sys
+import fcntl
+import socket
+import signal
+import logging
+import threading
+import socketserver
+from fvg_config import CONFIG_ENV
+
+PID_FILE = 'fvg_bot.pid'  # файл блокировки: второй экземпляр бота с теми же настройками не запустится
+CONTROL_SOCKET = None  # путь unix сокета для команд консоли, None - без управления
+STOP_TIMEOUT = 5  # сколько секунд при остановке ждем запись журнала
+
+
+def lock_instance(path):
+    '''
+    Функция берет эксклюзивную блокировку файла и пишет в него pid
+    Возвращает открытый файл, который держит блокировку, или None, если бот уже запущен
+    '''
+    f = open(path, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    f.truncate(0)
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    '''
+    Команды консоли через сокет: одна строка - одна команда, ответ заканчивается пустой строкой
+    '''
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode().strip()
+            if not command:
+                continue
+            reply = self.server.bot.run_command(command)
+            self.wfile.write(reply.rstrip('\n').encode() + b'\n\n')
+
+
+def start_control_socket(bot, path):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+    server.daemon_threads = True
+    server.bot = bot
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Control socket listening on {path}')
+    return server
+
+
+def send_command(path, command):
+    '''
+    Функция отправляет команду запущенному боту и возвращает ответ
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(command.encode() + b'\n')
+        reply = b''
+        while not reply.endswith(b'\n\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    return reply.decode().rstrip('\n')
+
+
+def run_daemon(config_path=None):
+    '''
+    Функция запускает бота без консоли, например под systemd или supervisord
+    Настройки берутся из JSON файла (см. fvg_config), кроме констант бота в нем могут быть:
+    LOG_FILE (null - лог в stderr), PID_FILE, CONTROL_SOCKET
+    Работает до SIGTERM или SIGINT, при остановке дожидается записи журнала событий
+    Возвращает код выхода: 1, если бот уже запущен или не запустился
+    '''
+    if config_path:
+        os.environ[CONFIG_ENV] = os.path.abspath(config_path)
+    # константы бота читаются из настроек при импорте, поэтому импортируем его только здесь
+    import bybit_FVG_bot as bot
+    lock = lock_instance(bot.CONFIG.get('PID_FILE', PID_FILE))
+    if lock is None:
+        logging.info('Bot is already running, exiting')
+        print('Bot is already running', file=sys.stderr)
+        return 1
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *args: stop.set())
+    if bot.METRICS_PORT:
+        bot.start_metrics_server(bot.METRICS_PORT)
+    control_path = bot.CONFIG.get('CONTROL_SOCKET', CONTROL_SOCKET)
+    server = start_control_socket(bot, control_path) if control_path else None
+    code = 0
+    if not bot.start_bot():
+        print('Error starting the bot, see the log', file=sys.stderr)
+        code = 1
+        stop.set()
+    stop.wait()
+    logging.info('Stopping the bot ...')
+    if server:
+        server.shutdown()
+        server.server_close()
+        os.remove(control_path)
+    if bot.JOURNAL and not bot.JOURNAL.flush(STOP_TIMEOUT):
+        logging.info('Journal was not flushed before stop')
+    lock.close()
+    return code
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'ctl':
+        if len(sys.argv) < 4:
+            print('Usage: python fvg_daemon.py ctl <socket> <command>')
+            sys.exit(1)
+        print(send_command(sys.argv[2], ' '.join(sys.argv[3:])))
+    else:
+        sys.exit(run_daemon(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,188 @@
+import sys
+import asyncio
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from pybit.unified_trading import WebSocket
+import bybit_FVG_bot as bot
+from fvg_zones import ZoneStore
+from kline_feed import STREAM_GRACE_MS, parse_stream_kline
+from kline_resampler import KlineResampler, SOURCE_TIME_FRAME, bucket_start
+from kline_store import interval_ms
+from clock import now_ms
+
+ENGINE_WORKERS = 32  # размер общего пула потоков и соединений для REST вызовов
+STREAM_SYMBOLS_PER_SUBSCRIBE = 10  # спотовый вебсокет принимает не больше 10 топиков за подписку
+ENGINE_RESAMPLE = True  # все тайм фреймы пары собираются из одного минутного потока
+
+
+class SymbolStrategy(bot.FVGStateMachine):
+    '''
+    Стратегия FVG для одной пары и одного тайм фрейма
+    Хранит свое состояние FVG, свои зоны и свои настройки
+    '''
+    __slots__ = ('pair', 'time_frame', 'time_frame_ms', 'order_filters')
+
+    def __init__(self, pair, time_frame=bot.TIME_FRAME, settings=None):
+        super().__init__(settings, ZoneStore(capacity=4))
+        self.pair = pair
+        self.time_frame = time_frame
+        self.time_frame_ms = interval_ms(time_frame)
+        if not self.time_frame_ms:
+            raise ValueError(f'Cant run strategy on {time_frame} time frame: candle length is not fixed')
+        self.order_filters = None
+
+
+class FVGEngine:
+    '''
+    Движок, который ведет много стратегий в одном цикле asyncio
+    Все стратегии используют один HTTP клиент с общим пулом соединений
+    Закрытые свечи приходят из одного вебсокета, пропущенные добираются по REST
+    При resample на каждую пару приходит только минутный поток, из которого собираются все тайм фреймы
+    '''
+    def __init__(self, strategies, max_workers=ENGINE_WORKERS, testnet=True, resample=ENGINE_RESAMPLE):
+        self.strategies = {(s.pair, s.time_frame): s for s in strategies}
+        self.resample = resample
+        self.resamplers = {} # пара -> сборка тайм фреймов из минутных свечей
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.testnet = testnet
+        self.loop = None
+        self.ws = None
+        self.tasks = set() # отправки ордеров в работе: цикл asyncio держит на задачи только слабые ссылки
+        # один пул keep-alive соединений на все потоки
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        bot.spot_client.client.mount('https://', adapter)
+
+    async def call(self, func, *args, **kwargs):
+        '''
+        Функция выполняет блокирующий вызов биржи в общем пуле потоков
+        '''
+        return await self.loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        logging.info(f'Starting engine for {len(self.strategies)} strategies')
+        await asyncio.gather(*(self.warm_up(s) for s in self.strategies.values()))
+        self.subscribe()
+        time_frames = {s.time_frame for s in self.strategies.values()}
+        await asyncio.gather(*(self.watch_time_frame(tf) for tf in time_frames))
+
+    async def warm_up(self, strategy):
+        '''
+        Функция получает фильтры ордера и первые свечи для стратегии
+        '''
+        strategy.order_filters = await self.call(bot.FILTER_CACHE.get, strategy.pair)
+        if not strategy.order_filters:
+            logging.info(f'{strategy.pair}: Error getting order filters, strategy disabled')
+            return
+        await self.fetch(strategy, limit=4)
+
+    async def fetch(self, strategy, limit):
+        '''
+        Функция добирает по REST закрытые свечи стратегии
+        '''
+        klines = await self.call(bot.get_klines, strategy.pair, strategy.time_frame, limit=limit)
+        if not klines:
+            logging.info(f'{strategy.pair}: Error getting candles')
+            return
+        # последняя свеча еще не закрыта
+        for i in range(len(klines['open_time']) - 1):
+            self.on_candle(strategy, {key: values[i] for key, values in klines.items()})
+
+    def subscribe(self):
+        '''
+        Функция подписывает все стратегии на поток свечей через один вебсокет
+        '''
+        by_time_frame = {}
+        for (pair, time_frame), strategy in self.strategies.items():
+            if not self.resample:
+                by_time_frame.setdefault(time_frame, []).append(pair)
+                continue
+            if pair not in self.resamplers:
+                self.resamplers[pair] = KlineResampler(pair)
+                by_time_frame.setdefault(SOURCE_TIME_FRAME, []).append(pair)
+            self.resamplers[pair].subscribe(time_frame, partial(self.loop.call_soon_threadsafe, self.on_candle, strategy))
+        try:
+            self.ws = WebSocket(testnet=self.testnet, channel_type='spot')
+            for time_frame, pairs in by_time_frame.items():
+                for i in range(0, len(pairs), STREAM_SYMBOLS_PER_SUBSCRIBE):
+                    self.ws.kline_stream(interval=time_frame, symbol=pairs[i:i + STREAM_SYMBOLS_PER_SUBSCRIBE],
+                                         callback=self.on_message)
+        except Exception as e:
+            logging.info(f'Error subscribing to kline stream: {e}, falling back to polling')
+
+    def on_message(self, message):
+        '''
+        Обработчик сообщений вебсокета, вызывается в потоке вебсокета
+        '''
+        _, time_frame, pair = message['topic'].split('.')
+        if self.resample:
+            resampler = self.resamplers.get(pair)
+            for item in message['data']:
+                if resampler and item['confirm']:
+                    resampler.push(parse_stream_kline(item))
+            return
+        strategy = self.strategies.get((pair, time_frame))
+        if strategy is None:
+            return
+        for item in message['data']:
+            if item['confirm']:
+                self.loop.call_soon_threadsafe(self.on_candle, strategy, parse_stream_kline(item))
+
+    def on_candle(self, strategy, candle):
+        if not strategy.order_filters:
+            return
+        bot.observe_delay('candle_delay_seconds', candle['open_time'], strategy.time_frame_ms)
+        for signal in strategy.on_candle(candle):
+            bot.observe_delay('signal_delay_seconds', candle['open_time'], strategy.time_frame_ms)
+            task = self.loop.create_task(self.call(bot.place_fvg_order, *signal, strategy.pair, strategy.settings))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def watch_time_frame(self, time_frame):
+        '''
+        Функция раз в свечу проверяет, что по всем парам тайм фрейма пришла закрытая свеча
+        Опоздавшие пары добираются по REST одновременно
+        '''
+        time_frame_ms = interval_ms(time_frame)
+        strategies = [s for s in self.strategies.values() if s.time_frame == time_frame]
+        while True:
+            now = now_ms()
+            close_time = bucket_start(now, time_frame_ms) + time_frame_ms
+            await asyncio.sleep((close_time + STREAM_GRACE_MS - now) / 1000)
+            expected = close_time - time_frame_ms
+            late = [s for s in strategies if s.order_filters and (s.last_open_time or 0) < expected]
+            if late:
+                logging.info(f'Polling {len(late)} strategies on {time_frame} time frame')
+                await asyncio.gather(*(self.fetch(s, self.missed(s, now) + 1) for s in late))
+
+    @staticmethod
+    def missed(strategy, now):
+        '''
+        Функция возвращает количество закрытых свечей, которых не хватает стратегии
+        '''
+        if strategy.last_open_time is None:
+            return 3
+        return min(999, int((now - strategy.last_open_time) // strategy.time_frame_ms))
+
+
+def run_engine(pairs, time_frame=bot.TIME_FRAME, settings=None):
+    '''
+    Функция запускает движок по списку пар и следит за ордерами всех пар
+    '''
+    strategies = [SymbolStrategy(pair, time_frame, settings) for pair in pairs]
+    engine = FVGEngine(strategies)
+    bot.start_account_cache()
+    if bot.METRICS_PORT:
+        bot.start_metrics_server(bot.METRICS_PORT)
+    threading.Thread(target=bot.order_canceller, args=(None,), daemon=True).start()
+    asyncio.run(engine.run())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python fvg_engine.py <PAIR> [PAIR ...]')
+        sys.exit(1)
+    run_engine(sys.argv[1:])
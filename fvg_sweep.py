@@ -0,0 +1,142 @@
+import sys
+import csv
+import heapq
+import random
+import itertools
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from bybit_FVG_bot import KLINE_KEYS, TIME_FRAME
+from fvg_backtest import load_klines, run_backtest
+from kline_store import interval_ms
+
+SWEEP_TIME_FRAME_MS = interval_ms(TIME_FRAME)  # длительности ордеров и сделок перебираются в свечах тайм фрейма
+
+SWEEP_SPACE = {
+    'cover_neighbors_bull': [1, 2, 3, 4, 5],
+    'cover_neighbors_bear': [1, 2, 3, 4, 5],
+    'expand_neighbors_bull': [0, 1, 2, 3, 4, 5],
+    'expand_neighbors_bear': [0, 1, 2, 3, 4, 5],
+    'start_trade': [0.0, 0.1, 0.2, 0.3, 0.5],
+    'stop_loss_offset': [0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1],
+    'risk_reward_ratio': [1, 1.5, 2, 3, 4],
+    'max_order_duration': [SWEEP_TIME_FRAME_MS * n for n in (2, 5, 10, 20)],
+    'max_trade_duration': [SWEEP_TIME_FRAME_MS * n for n in (5, 10, 20, 50)],
+}
+# хвост из NaN после high и low в разделяемой памяти: окна бэктеста строятся без копий колонок
+# хватает на самое длинное окно SWEEP_SPACE, более длинные окна бэктест дополняет сам копией
+SWEEP_PAD = max(max(SWEEP_SPACE['max_order_duration'] + SWEEP_SPACE['max_trade_duration']) // SWEEP_TIME_FRAME_MS,
+                max(SWEEP_SPACE['cover_neighbors_bull'] + SWEEP_SPACE['cover_neighbors_bear'] +
+                    SWEEP_SPACE['expand_neighbors_bull'] + SWEEP_SPACE['expand_neighbors_bear']))
+PADDED_KEYS = ('low', 'high')
+SWEEP_SORT_BY = 'total_r'
+_klines = None # свечи в разделяемой памяти, у каждого процесса свое отображение
+_shm = None
+
+
+def share_klines(klines, pad=SWEEP_PAD):
+    '''
+    Функция копирует свечи в один блок разделяемой памяти
+    За колонками low и high оставляется хвост из pad значений NaN, чтобы бэктест строил окна прямо по ним
+    Возвращает блок и описание колонок для подключения из других процессов
+    '''
+    n = len(klines['open_time'])
+    size = n + pad
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size * 8 * len(KLINE_KEYS)))
+    layout = []
+    for i, key in enumerate(KLINE_KEYS):
+        dtype = np.int64 if key == 'open_time' else np.float64
+        column = np.ndarray(size, dtype=dtype, buffer=shm.buf, offset=i * size * 8)
+        column[:n] = klines[key]
+        column[n:] = np.nan if key in PADDED_KEYS else 0
+        layout.append((key, np.dtype(dtype).str, i * size * 8))
+    return shm, (shm.name, n, pad, layout)
+
+
+def attach_klines(descriptor):
+    '''
+    Функция подключает свечи из разделяемой памяти без копирования
+    Вызывается при старте процесса пула
+    '''
+    global _klines, _shm
+    name, n, pad, layout = descriptor
+    _shm = shared_memory.SharedMemory(name=name)
+    _klines = {key: np.ndarray(n, dtype=dtype, buffer=_shm.buf, offset=offset) for key, dtype, offset in layout}
+    _klines['padded'] = {key: np.ndarray(n + pad, dtype=dtype, buffer=_shm.buf, offset=offset)
+                         for key, dtype, offset in layout if key in PADDED_KEYS}
+
+
+def evaluate(params):
+    '''
+    Функция прогоняет бэктест с одной комбинацией параметров
+    '''
+    _, stats = run_backtest(_klines, params)
+    return params, stats
+
+
+def param_grid(space=SWEEP_SPACE):
+    '''
+    Функция перебирает все комбинации параметров
+    '''
+    keys = list(space)
+    for values in itertools.product(*(space[key] for key in keys)):
+        yield dict(zip(keys, values))
+
+
+def param_sample(count, space=SWEEP_SPACE, seed=None):
+    '''
+    Функция возвращает count случайных комбинаций параметров
+    '''
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {key: rng.choice(values) for key, values in space.items()}
+
+
+def run_sweep(klines, combos, processes=None, sort_by=SWEEP_SORT_BY, top=20, out_path=None):
+    '''
+    Функция оценивает комбинации параметров в пуле процессов
+    Свечи лежат в разделяемой памяти, процессы их не копируют
+    Результаты по мере готовности пишутся в CSV out_path, возвращаются top лучших по sort_by
+    '''
+    shm, descriptor = share_klines(klines)
+    best = []
+    out = writer = None
+    try:
+        if out_path:
+            out = open(out_path, 'w', newline='')
+        with Pool(processes, initializer=attach_klines, initargs=(descriptor,)) as pool:
+            for n, (params, stats) in enumerate(pool.imap_unordered(evaluate, combos, chunksize=16)):
+                row = dict(params, **stats)
+                if out:
+                    if writer is None:
+                        writer = csv.DictWriter(out, fieldnames=list(row))
+                        writer.writeheader()
+                    writer.writerow(row)
+                # держим только top лучших, n разрешает равенство значений
+                item = (row[sort_by], n, row)
+                if len(best) < top:
+                    heapq.heappush(best, item)
+                else:
+                    heapq.heappushpop(best, item)
+    finally:
+        if out:
+            out.close()
+        shm.close()
+        shm.unlink()
+    return [row for _, _, row in sorted(best, key=lambda item: item[:2], reverse=True)]
+
+
+def print_table(rows, columns=('trades', 'win_rate', 'total_r', 'profit_factor', 'max_drawdown')):
+    keys = list(SWEEP_SPACE) + list(columns)
+    print(' '.join(f'{key[:12]:>12}' for key in keys))
+    for row in rows:
+        print(' '.join(f'{row[key]:>12.4g}' if isinstance(row[key], float) else f'{row[key]:>12}' for key in keys))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python fvg_sweep.py <klines.csv|klines.npz|store_dir> [samples] [results.csv]')
+        sys.exit(1)
+    klines = load_klines(sys.argv[1])
+    combos = param_sample(int(sys.argv[2])) if len(sys.argv) > 2 else param_grid()
+    out_path = sys.argv[3] if len(sys.argv) > 3 else None
+    print_table(run_sweep(klines, combos, out_path=out_path))
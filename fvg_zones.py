@@ -0,0 +1,217 @@
+import numpy as np
+
+LIVE = 0
+FILLED = 1
+INVALIDATED = 2
+EXPIRED = 3
+ZONES_MAX = 10000  # больше зон не держим, самые старые вытесняются
+ZONES_MAX_AGE_MS = 7 * 86400000  # зоны старше недели истекают
+REBUILD_EVERY = 64  # сколько новых зон копим в буфере, прежде чем перестроить индекс
+
+
+class ZoneStore:
+    '''
+    Хранилище FVG зон на numpy-массивах: время создания, направление, границы, цена входа, состояние
+    Для поиска зон, которые задевает свеча, зоны отсортированы по нижней границе,
+    а над ними построено дерево отрезков с максимумом верхней границы
+    Запрос стоит O(log n + k), новые зоны копятся в небольшом буфере до перестройки индекса
+    Закрытые и истекшие зоны вытесняются по политике max_zones / max_age_ms / evict_filled
+    '''
+    last_close = None # close прошлой свечи, на уровне класса - для хранилищ из старых снимков журнала
+
+    def __init__(self, capacity=16, max_zones=ZONES_MAX, max_age_ms=ZONES_MAX_AGE_MS, evict_filled=True):
+        self.max_zones = max_zones
+        self.max_age_ms = max_age_ms
+        self.evict_filled = evict_filled
+        self.size = 0
+        self.live = 0
+        self.head = 0 # до этой позиции живых зон нет
+        self.next_id = 0
+        self.alloc(capacity)
+        self.order = np.empty(0, dtype=np.int64) # позиции зон индекса, отсортированные по low
+        self.sorted_low = np.empty(0)
+        self.tree = np.full(2, -np.inf)
+        self.leaf = 1
+        self.where = {} # позиция зоны -> лист дерева
+        self.buffer = [] # позиции зон, еще не попавших в индекс
+        self.last_close = None
+
+    def alloc(self, capacity):
+        old = getattr(self, 'ids', None)
+        arrays = {
+            'ids': np.int64, 'created': np.int64, 'direction': np.int8,
+            'low': np.float64, 'high': np.float64, 'entry': np.float64, 'state': np.int8,
+        }
+        for name, dtype in arrays.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                array[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, array)
+
+    def __len__(self):
+        return self.live
+
+    def add(self, created, direction, low, high, entry):
+        '''
+        Функция добавляет зону и возвращает ее id
+        direction: 1 - бычья, -1 - медвежья
+        '''
+        if self.size == len(self.ids):
+            self.compact()
+            if self.size == len(self.ids):
+                self.alloc(2 * len(self.ids))
+        pos = self.size
+        self.ids[pos] = self.next_id
+        self.created[pos] = created
+        self.direction[pos] = direction
+        self.low[pos] = low
+        self.high[pos] = high
+        self.entry[pos] = entry
+        self.state[pos] = LIVE
+        self.size += 1
+        self.live += 1
+        self.next_id += 1
+        self.buffer.append(pos)
+        if len(self.buffer) >= REBUILD_EVERY:
+            self.rebuild()
+        if self.live > self.max_zones:
+            self.evict_oldest(self.live - self.max_zones)
+        return int(self.ids[pos])
+
+    def rebuild(self):
+        '''
+        Функция перестраивает индекс по всем живым зонам
+        '''
+        live = np.flatnonzero(self.state[:self.size] == LIVE)
+        self.order = live[np.argsort(self.low[live], kind='stable')]
+        self.sorted_low = self.low[self.order]
+        self.leaf = 1
+        while self.leaf < max(1, len(self.order)):
+            self.leaf *= 2
+        self.tree = np.full(2 * self.leaf, -np.inf)
+        self.tree[self.leaf:self.leaf + len(self.order)] = self.high[self.order]
+        # заполняем дерево по уровням снизу вверх
+        level = self.leaf
+        while level > 1:
+            level //= 2
+            self.tree[level:2 * level] = np.maximum(self.tree[2 * level:4 * level:2], self.tree[2 * level + 1:4 * level:2])
+        self.where = dict(zip(self.order.tolist(), range(self.leaf, self.leaf + len(self.order))))
+        self.buffer = []
+
+    def remove(self, pos, state):
+        '''
+        Функция закрывает зону и убирает ее из индекса за O(log n)
+        '''
+        if self.state[pos] != LIVE:
+            return
+        self.state[pos] = state
+        self.live -= 1
+        node = self.where.pop(int(pos), None)
+        if node is None:
+            self.buffer.remove(pos)
+            return
+        self.tree[node] = -np.inf
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def overlapping(self, low, high):
+        '''
+        Функция возвращает позиции живых зон, пересекающих диапазон [low, high]
+        '''
+        # зоны с нижней границей не выше high лежат в префиксе сортировки
+        end = int(np.searchsorted(self.sorted_low, high, side='right'))
+        found = []
+        stack = [(1, 0, self.leaf)]
+        while stack:
+            node, left, right = stack.pop()
+            # в поддереве нет зон, доходящих до low, или оно целиком за префиксом
+            if left >= end or self.tree[node] < low:
+                continue
+            if node >= self.leaf:
+                found.append(int(self.order[left]))
+                continue
+            middle = (left + right) // 2
+            stack.append((2 * node, left, middle))
+            stack.append((2 * node + 1, middle, right))
+        found += [pos for pos in self.buffer if self.low[pos] <= high and self.high[pos] >= low]
+        return found
+
+    def update(self, candle):
+        '''
+        Функция обрабатывает закрытую свечу
+        Возвращает словарь со списками id зон: touched - свеча зашла в зону,
+        mitigated - свеча дошла до цены входа, invalidated - свеча пробила дальнюю границу зоны
+        Свеча с гэпом проходит и цены между прошлым close и своим диапазоном, поэтому зоны внутри гэпа
+        находятся тем же запросом к дереву и закрываются так же, как зоны под самой свечой
+        '''
+        result = {'touched': [], 'mitigated': [], 'invalidated': []}
+        self.expire(candle['open_time'])
+        low, high = candle['low'], candle['high']
+        if self.last_close is not None:
+            low, high = min(low, self.last_close), max(high, self.last_close)
+        self.last_close = candle['close']
+        for pos in self.overlapping(low, high):
+            result['touched'].append(int(self.ids[pos]))
+            bull = self.direction[pos] == 1
+            # бычья зона пробита минимумом ниже нижней границы, медвежья - максимумом выше верхней
+            if (low < self.low[pos]) if bull else (high > self.high[pos]):
+                result['invalidated'].append(int(self.ids[pos]))
+                if self.evict_filled:
+                    self.remove(pos, INVALIDATED)
+            elif (low <= self.entry[pos]) if bull else (high >= self.entry[pos]):
+                result['mitigated'].append(int(self.ids[pos]))
+                if self.evict_filled:
+                    self.remove(pos, FILLED)
+        return result
+
+    def expire(self, now):
+        '''
+        Функция закрывает зоны старше max_age_ms, зоны добавляются по времени, поэтому идем с начала
+        '''
+        if self.max_age_ms is None:
+            return
+        while self.head < self.size and self.created[self.head] < now - self.max_age_ms:
+            self.remove(self.head, EXPIRED)
+            self.head += 1
+        if self.head > self.size // 2:
+            self.compact()
+
+    def evict_oldest(self, count):
+        while count and self.head < self.size:
+            if self.state[self.head] == LIVE:
+                self.remove(self.head, EXPIRED)
+                count -= 1
+            self.head += 1
+
+    def compact(self):
+        '''
+        Функция выбрасывает из массивов закрытые зоны, чтобы память не росла
+        '''
+        live = np.flatnonzero(self.state[:self.size] == LIVE)
+        if len(live) == self.size:
+            return
+        for name in ('ids', 'created', 'direction', 'low', 'high', 'entry', 'state'):
+            array = getattr(self, name)
+            array[:len(live)] = array[live]
+        self.size = len(live)
+        self.head = 0
+        self.rebuild()
+
+    def get(self, zone_id):
+        '''
+        Функция возвращает зону по id в виде словаря или None, если зона уже выброшена
+        '''
+        pos = int(np.searchsorted(self.ids[:self.size], zone_id))
+        if pos == self.size or self.ids[pos] != zone_id:
+            return None
+        return {
+            'id': zone_id,
+            'created': int(self.created[pos]),
+            'direction': int(self.direction[pos]),
+            'low': float(self.low[pos]),
+            'high': float(self.high[pos]),
+            'entry': float(self.entry[pos]),
+            'state': int(self.state[pos]),
+        }
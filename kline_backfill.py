@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import numpy as np
+import bybit_FVG_bot as bot
+from clock import now_ms
+from kline_store import open_store, interval_ms
+from kline_resampler import bucket_start
+
+BACKFILL_WORKERS = 16  # параллельных запросов, общий темп все равно задает лимит IP в планировщике
+BACKFILL_RETRIES = 5  # повторы окна при ошибке биржи или сети
+BACKOFF_BASE_MS = 500
+BACKFILL_FLUSH_ROWS = 20000  # сколько свечей хвоста копим перед дозаписью в конец хранилища
+# merge переписывает все хранилище под его блокировкой, поэтому окна раньше последней свечи
+# вставляются одним merge в конце задания, порог только ограничивает память (7 колонок по 8 байт на свечу)
+BACKFILL_MERGE_ROWS = 1000000
+CHECKPOINT_FILE = 'backfill.json'  # в папке хранилища: диапазоны, за которые у биржи нет свечей
+
+
+def split_windows(start, end, time_frame_ms, page=bot.KLINE_PAGE_LIMIT):
+    '''
+    Функция делит диапазон open_time [start, end] на окна не больше page свечей, по одному запросу на окно
+    '''
+    windows = []
+    while start <= end:
+        stop = min(end, start + (page - 1) * time_frame_ms)
+        windows.append((start, stop))
+        start = stop + time_frame_ms
+    return windows
+
+
+def subtract(ranges, holes, time_frame_ms):
+    '''
+    Функция вычитает из диапазонов open_time диапазоны holes, концы включительно
+    '''
+    result = []
+    for start, end in ranges:
+        for hole_start, hole_end in sorted(holes):
+            if hole_end < start or hole_start > end:
+                continue
+            if hole_start > start:
+                result.append((start, hole_start - time_frame_ms))
+            start = hole_end + time_frame_ms
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def find_holes(open_time, start, end, time_frame_ms):
+    '''
+    Функция возвращает диапазоны внутри окна [start, end], за которые биржа не прислала свечей
+    '''
+    edges = np.concatenate([[start - time_frame_ms], np.asarray(open_time, dtype=np.int64), [end + time_frame_ms]])
+    jumps = np.flatnonzero(np.diff(edges) > time_frame_ms)
+    return [(int(edges[i]) + time_frame_ms, int(edges[i + 1]) - time_frame_ms) for i in jumps]
+
+
+class Backfill:
+    '''
+    Догрузка истории свечей одной пары и тайм фрейма в локальное хранилище KlineStore
+    Недостающие диапазоны - до первой свечи, разрывы внутри хранилища и после последней свечи -
+    делятся на окна в одну страницу ответа биржи
+    Окна после последней сохраненной свечи дописываются в конец строго по порядку,
+    окна раньше нее копятся в памяти и вставляются одним merge в конце
+    Само хранилище и есть контрольная точка: после прерывания запуск с теми же аргументами
+    догружает только то, чего нет. Диапазоны, за которые биржа не отдает свечей (до листинга пары,
+    простои биржи), записываются в backfill.json и повторно не запрашиваются
+    '''
+    def __init__(self, root, pair, time_frame, start, end, recheck=False):
+        self.pair = pair
+        self.time_frame = time_frame
+        self.time_frame_ms = interval_ms(time_frame)
+        if self.time_frame_ms is None:
+            raise ValueError(f'Cant backfill {time_frame} time frame, candle length is not fixed')
+        self.store = open_store(root, pair, time_frame)
+        self.checkpoint = os.path.join(self.store.path, CHECKPOINT_FILE)
+        self.empty = [] if recheck else self.read_checkpoint()
+        # границы по сетке тайм фрейма, последняя свеча диапазона должна быть уже закрыта
+        start = bucket_start(start + self.time_frame_ms - 1, self.time_frame_ms)
+        end = bucket_start(min(end, now_ms() - self.time_frame_ms), self.time_frame_ms)
+        self.windows = []
+        for first, last in subtract(self.missing(start, end), self.empty, self.time_frame_ms):
+            self.windows += split_windows(first, last, self.time_frame_ms)
+        last = self.store.last_open_time()
+        # окна хвоста ждут своей очереди в ready, остальные копятся в pending до merge
+        self.tail = [window for window in self.windows if last is None or window[0] > last]
+        self.tail_set = set(self.tail)
+        self.ready = {}
+        self.next = 0
+        self.buffer = []
+        self.buffer_rows = 0
+        self.pending = []
+        self.pending_rows = 0
+        self.written = 0
+        self.failed = 0
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint) as f:
+                return [tuple(hole) for hole in json.load(f)['empty']]
+        except FileNotFoundError:
+            return []
+
+    def write_checkpoint(self):
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump({'empty': sorted(self.empty)}, f)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def missing(self, start, end):
+        '''
+        Функция возвращает диапазоны open_time внутри [start, end], которых нет в хранилище
+        '''
+        open_time = self.store.read_column('open_time')
+        if not len(open_time):
+            return [(start, end)] if start <= end else []
+        ranges = [(start, int(open_time[0]) - self.time_frame_ms)] + self.store.gaps(self.time_frame_ms)
+        ranges.append((int(open_time[-1]) + self.time_frame_ms, end))
+        ranges = [(max(first, start), min(last, end)) for first, last in ranges]
+        return [(first, last) for first, last in ranges if first <= last]
+
+    def fetch(self, window):
+        '''
+        Функция запрашивает свечи окна, при ошибке повторяет с экспоненциальной задержкой
+        Возвращает словарь свечей или None, если окно так и не получено
+        '''
+        start, end = window
+        for attempt in range(BACKFILL_RETRIES + 1):
+            try:
+                klines = bot.fetch_klines(self.pair, self.time_frame, bot.KLINE_PAGE_LIMIT, start=start, end=end)
+            # ошибки биржи pybit бросает исключением, окно просто повторяем
+            except Exception as e:
+                logging.info(f'{self.pair}: Error getting candles {start}-{end}: {e}')
+                klines = False
+            if klines is not False:
+                return klines
+            time.sleep(random.uniform(0, BACKOFF_BASE_MS * 2 ** attempt) / 1000)
+        return None
+
+    def on_window(self, window, klines):
+        '''
+        Функция принимает свечи полученного окна и пишет в хранилище все, что накопилось по порядку
+        '''
+        if klines is None:
+            # окно не получили, в хранилище останется разрыв, его догрузит следующий запуск
+            self.failed += 1
+        else:
+            holes = find_holes(klines.get('open_time', []), window[0], window[1], self.time_frame_ms)
+            if holes:
+                self.empty += holes
+                self.write_checkpoint()
+        if window in self.tail_set:
+            self.ready[window] = klines
+            self.flush_tail()
+        elif klines:
+            self.pending.append(klines)
+            self.pending_rows += len(klines['open_time'])
+            if self.pending_rows >= BACKFILL_MERGE_ROWS:
+                self.flush_pending()
+
+    def flush_tail(self, force=False):
+        '''
+        Функция переносит подряд идущие полученные окна хвоста в буфер и дописывает его в конец одной записью
+        '''
+        while self.next < len(self.tail) and self.tail[self.next] in self.ready:
+            klines = self.ready.pop(self.tail[self.next])
+            self.next += 1
+            if klines:
+                self.buffer.append(klines)
+                self.buffer_rows += len(klines['open_time'])
+        if self.buffer and (force or self.buffer_rows >= BACKFILL_FLUSH_ROWS):
+            self.written += self.store.append(concat(self.buffer))
+            self.buffer = []
+            self.buffer_rows = 0
+
+    def flush_pending(self):
+        if self.pending:
+            self.written += self.store.merge(concat(self.pending))
+            self.pending = []
+            self.pending_rows = 0
+
+    def finish(self):
+        '''
+        Функция записывает все полученное, в том числе при прерывании
+        Окна хвоста после неполученного окна дописываются в конец, разрыв догрузит следующий запуск
+        '''
+        self.next = len(self.tail)
+        for window in self.tail:
+            klines = self.ready.pop(window, None)
+            if klines:
+                self.buffer.append(klines)
+        self.flush_tail(force=True)
+        self.flush_pending()
+
+
+def concat(chunks):
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in bot.KLINE_KEYS}
+
+
+def run_backfill(pairs, time_frame, start, end, root=None, workers=BACKFILL_WORKERS, recheck=False):
+    '''
+    Функция догружает историю свечей пар за [start, end] (мс) в хранилище root
+    Окна всех пар запрашиваются параллельно через общий планировщик запросов, который держит лимиты биржи
+    Возвращает словарь пара -> (дописано свечей, неполученных окон)
+    '''
+    root = root or bot.KLINE_STORE_DIR or 'klines'
+    jobs = [Backfill(root, pair, time_frame, start, end, recheck) for pair in pairs]
+    total = sum(len(job.windows) for job in jobs)
+    logging.info(f'Backfilling {total} windows of {time_frame} candles for {len(jobs)} pairs')
+    # одно keep-alive соединение на каждый поток
+    session = getattr(bot.spot_client, 'client', None)
+    if session is not None:
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+    pool = ThreadPoolExecutor(workers)
+    try:
+        futures = {pool.submit(job.fetch, window): (job, window) for job in jobs for window in job.windows}
+        for done, future in enumerate(as_completed(futures), 1):
+            job, window = futures[future]
+            job.on_window(window, future.result())
+            if done % 100 == 0 or done == total:
+                logging.info(f'Backfill: {done} of {total} windows')
+    finally:
+        # при прерывании не ждем оставшиеся окна, но сохраняем уже полученные
+        pool.shutdown(wait=True, cancel_futures=True)
+        for job in jobs:
+            job.finish()
+    return {job.pair: (job.written, job.failed) for job in jobs}
+
+
+def parse_date(value):
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--recheck']
+    if len(args) < 4:
+        print('Usage: python kline_backfill.py <start YYYY-MM-DD> <end YYYY-MM-DD> <time_frame> <PAIR> [PAIR ...] '
+              '[--recheck]')
+        sys.exit(1)
+    started = time.time()
+    result = run_backfill(args[3:], args[2], parse_date(args[0]), parse_date(args[1]),
+                          recheck='--recheck' in sys.argv)
+    for pair, (written, failed) in result.items():
+        print(f'{pair}: {written} candles written' + (f', {failed} windows failed, run again' if failed else ''))
+    print(f'Done in {time.time() - started:.1f}s')
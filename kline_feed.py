@@ -0,0 +1,168 @@
+import time
+import logging
+import threading
+from collections import deque
+from clock import now_ms, wait_until, sleep_ms
+
+STREAM_GRACE_MS = 5000  # сколько ждем пуша закрытой свечи, прежде чем идти за ней по REST
+POLL_GRACE_MS = 2000  # запас после закрытия свечи при опросе по REST
+
+
+class KlineFeed:
+    '''
+    Источник закрытых свечей
+    Свечи приходят в очередь по мере закрытия, next_candle отдает их по одной
+    Если передан fallback (функция get_klines), то пропущенные свечи добираются по REST
+    Без пуш-источника это обычный опрос по REST раз в свечу
+    '''
+    def __init__(self, pair, time_frame, time_frame_ms, fallback=None, grace_ms=POLL_GRACE_MS):
+        self.pair = pair
+        self.time_frame = time_frame
+        self.time_frame_ms = time_frame_ms
+        self.fallback = fallback
+        self.grace_ms = grace_ms
+        self.last_open_time = None
+        self.candles = deque()
+        self.cond = threading.Condition() # ожидание свечи идет по часам бота, поэтому очередь своя, а не queue.Queue
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.put(None)
+
+    def put(self, candle):
+        with self.cond:
+            self.candles.append(candle)
+            self.cond.notify()
+
+    def push(self, candle):
+        '''
+        Функция кладет закрытую свечу в очередь, повторы и старые свечи отбрасываются
+        '''
+        with self.lock:
+            if self.last_open_time is not None and candle['open_time'] <= self.last_open_time:
+                return False
+            self.last_open_time = candle['open_time']
+        self.put(candle)
+        return True
+
+    def seed(self, klines):
+        '''
+        Функция добавляет закрытые свечи из ответа get_klines (последняя свеча еще не закрыта)
+        '''
+        for i in range(len(klines['open_time']) - 1):
+            self.push({key: values[i] for key, values in klines.items()})
+
+    def next_candle(self):
+        '''
+        Функция возвращает следующую закрытую свечу
+        Возвращает None, если источник остановлен или свечу не удалось получить
+        '''
+        while True:
+            with self.cond:
+                while not self.candles:
+                    if not self.fallback or self.last_open_time is None:
+                        self.cond.wait()
+                        continue
+                    # следующая свеча закрывается через свечу после открытия последней полученной
+                    deadline = self.last_open_time + 2 * self.time_frame_ms + self.grace_ms
+                    if now_ms() >= deadline:
+                        break
+                    wait_until(self.cond, deadline)
+                if self.candles:
+                    return self.candles.popleft()
+            if not self.poll():
+                return None
+
+    def poll(self):
+        '''
+        Функция добирает по REST закрытые свечи, которые не пришли вовремя
+        '''
+        missed = int((now_ms() - self.last_open_time) // self.time_frame_ms)
+        logging.info(f'No pushed candle in time, polling {missed} candles')
+        klines = self.fallback(self.pair, self.time_frame, limit=min(1000, missed + 1))
+        if not klines:
+            return False
+        before = self.last_open_time
+        self.seed(klines)
+        # биржа еще не закрыла свечу, пробуем чуть позже
+        if self.last_open_time == before:
+            sleep_ms(1000)
+        return True
+
+
+class StreamKlineFeed(KlineFeed):
+    '''
+    Источник свечей из вебсокет-потока kline биржи
+    Свеча попадает в очередь, как только биржа присылает ее с флагом confirm
+    '''
+    def __init__(self, pair, time_frame, time_frame_ms, fallback=None, testnet=True, grace_ms=STREAM_GRACE_MS):
+        super().__init__(pair, time_frame, time_frame_ms, fallback, grace_ms)
+        self.testnet = testnet
+        self.ws = None
+
+    def start(self):
+        from pybit.unified_trading import WebSocket  # pybit грузим только при подписке, это ускоряет запуск
+        self.ws = WebSocket(testnet=self.testnet, channel_type='spot')
+        self.ws.kline_stream(interval=int(self.time_frame), symbol=self.pair, callback=self.on_message)
+        logging.info(f'Subscribed to kline stream {self.time_frame} {self.pair}')
+
+    def stop(self):
+        if self.ws:
+            self.ws.exit()
+        super().stop()
+
+    def on_message(self, message):
+        for item in message['data']:
+            if item['confirm']:
+                self.push(parse_stream_kline(item))
+
+
+class ReplayKlineFeed(KlineFeed):
+    '''
+    Локальный источник свечей для прогона бота по записанной истории
+    Принимает словарь массивов свечей (например из fvg_backtest.load_klines)
+    '''
+    def __init__(self, klines, delay=0):
+        super().__init__(None, None, None)
+        self.klines = klines
+        self.delay = delay
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.replay, daemon=True)
+        self.thread.start()
+
+    def replay(self):
+        for i in range(len(self.klines['open_time'])):
+            self.push({key: int(values[i]) if key == 'open_time' else float(values[i])
+                       for key, values in self.klines.items()})
+            if self.delay:
+                time.sleep(self.delay)
+        # конец записи
+        self.put(None)
+
+
+def candles_to_klines(candles):
+    '''
+    Функция собирает список свечей в словарь списков, как возвращает get_klines
+    '''
+    keys = candles[0].keys()
+    return {key: [candle[key] for candle in candles] for key in keys}
+
+
+def parse_stream_kline(item):
+    '''
+    Функция переводит свечу из сообщения вебсокета в формат get_klines
+    '''
+    return {
+        'open_time': int(item['start']),
+        'open': float(item['open']),
+        'high': float(item['high']),
+        'low': float(item['low']),
+        'close': float(item['close']),
+        'volume': float(item['volume']),
+        'turnover': float(item['turnover']),
+    }
@@ -0,0 +1,102 @@
+import logging
+from kline_store import INTERVALS_MS, interval_ms
+
+SOURCE_TIME_FRAME = "1"  # из минутных свечей собираются все старшие тайм фреймы
+SOURCE_MS = 60000
+WEEK_OFFSET_MS = 4 * 86400000  # недельные свечи биржи начинаются с понедельника, а 1970-01-01 - четверг
+
+
+def bucket_start(open_time, time_frame_ms):
+    '''
+    Функция возвращает open_time свечи тайм фрейма, в которую попадает момент open_time
+    Границы совпадают с биржевыми: от начала эпохи, для недель - с понедельника
+    '''
+    offset = WEEK_OFFSET_MS if time_frame_ms == INTERVALS_MS['W'] else 0
+    return open_time - (open_time - offset) % time_frame_ms
+
+
+class KlineResampler:
+    '''
+    Сборка свечей старших тайм фреймов из одного потока закрытых минутных свечей пары
+    Каждая минутная свеча за O(1) на тайм фрейм дополняет текущую свечу каждого тайм фрейма:
+    open - первой минуты, high/low - экстремумы, close - последней минуты, volume и turnover - суммы
+    Свеча отдается подписчикам сразу после последней минуты своего интервала
+    Свеча, в которой не хватает минут (например, первая после запуска), подписчикам не отдается
+    '''
+    def __init__(self, pair, time_frames=()):
+        self.pair = pair
+        self.frames = {} # тайм фрейм -> [длина в мс, текущая свеча, число минут в ней, подписчики]
+        self.last_open_time = None
+        for time_frame in time_frames:
+            self.add(time_frame)
+
+    def add(self, time_frame):
+        if time_frame in self.frames:
+            return self.frames[time_frame]
+        time_frame_ms = interval_ms(time_frame)
+        if not time_frame_ms or time_frame_ms % SOURCE_MS:
+            raise ValueError(f'Cant resample {time_frame} time frame from minute candles')
+        self.frames[time_frame] = frame = [time_frame_ms, None, 0, []]
+        return frame
+
+    def subscribe(self, time_frame, callback):
+        '''
+        Функция подписывает callback на закрытые свечи тайм фрейма
+        '''
+        self.add(time_frame)[3].append(callback)
+
+    def push(self, candle):
+        '''
+        Функция принимает закрытую минутную свечу и возвращает список закрывшихся (тайм фрейм, свеча)
+        '''
+        open_time = candle['open_time']
+        if self.last_open_time is not None and open_time <= self.last_open_time:
+            return []
+        self.last_open_time = open_time
+        closed = []
+        for time_frame, frame in self.frames.items():
+            time_frame_ms, current, minutes, callbacks = frame
+            start = bucket_start(open_time, time_frame_ms)
+            # пропали минуты в конце интервала, а уже идет следующий
+            if current is not None and current['open_time'] != start:
+                self.drop(time_frame, current, minutes, time_frame_ms)
+                current = None
+            if current is None:
+                current = dict(candle, open_time=start)
+                minutes = 1
+            else:
+                if candle['high'] > current['high']:
+                    current['high'] = candle['high']
+                if candle['low'] < current['low']:
+                    current['low'] = candle['low']
+                current['close'] = candle['close']
+                current['volume'] += candle['volume']
+                current['turnover'] += candle['turnover']
+                minutes += 1
+            if open_time + SOURCE_MS == start + time_frame_ms:
+                if minutes == time_frame_ms // SOURCE_MS:
+                    closed.append((time_frame, current))
+                    for callback in callbacks:
+                        callback(current)
+                else:
+                    self.drop(time_frame, current, minutes, time_frame_ms)
+                current = None
+                minutes = 0
+            frame[1] = current
+            frame[2] = minutes
+        return closed
+
+    def drop(self, time_frame, candle, minutes, time_frame_ms):
+        logging.info(f'{self.pair}: {time_frame} candle {candle["open_time"]} has {minutes} of '
+                     f'{time_frame_ms // SOURCE_MS} minutes, skipping it')
+
+    def run(self, source):
+        '''
+        Функция перекладывает минутные свечи из источника (KlineFeed) в сборку, пока источник работает
+        '''
+        while True:
+            candle = source.next_candle()
+            if not candle:
+                logging.info(f'{self.pair}: Minute candle source stopped')
+                return
+            self.push(candle)
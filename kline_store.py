@@ -0,0 +1,210 @@
+import os
+import json
+import threading
+import numpy as np
+
+KLINE_COLUMNS = {
+    'open_time': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64,
+    'turnover': np.float64,
+}
+INTERVALS_MS = {'D': 86400000, 'W': 604800000}
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def interval_ms(time_frame):
+    '''
+    Функция возвращает длину свечи тайм фрейма в миллисекундах
+    Для месячных свечей длина не постоянна, возвращается None
+    '''
+    if time_frame in INTERVALS_MS:
+        return INTERVALS_MS[time_frame]
+    if str(time_frame).isdigit():
+        return int(time_frame) * 60000
+    return None
+
+
+class KlineStore:
+    '''
+    Хранилище закрытых свечей одной пары и одного тайм фрейма на диске
+    Каждая колонка лежит в своем бинарном файле и читается через memmap без копирования
+    Запись только в конец: сначала колонки, потом атомарно число строк в meta.json,
+    поэтому недописанная при падении свеча отбрасывается при следующем открытии
+    Свечи не в конец (история до первой свечи, разрывы) вставляет merge, переписывая колонки целиком
+    С readonly хранилище только читается: файлы не чинятся и не обрезаются, поэтому его можно открыть
+    для анализа, пока живой бот в другом процессе дописывает свечи
+    '''
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.sources = {} # колонка -> файл, если он не на своем месте (незавершенный merge)
+        meta = self.read_meta()
+        self.rows = meta['rows']
+        if readonly:
+            if meta.get('replace'):
+                # merge закоммичен, но еще не все колонки переименованы: новые лежат рядом
+                for key in KLINE_COLUMNS:
+                    if os.path.exists(self.column_path(key) + '.new'):
+                        self.sources[key] = self.column_path(key) + '.new'
+            self.last = int(self.read_column('open_time', self.rows - 1, self.rows)[0]) if self.rows else None
+            return
+        os.makedirs(path, exist_ok=True)
+        if meta.get('replace'):
+            # упали посреди merge после коммита новых колонок: доводим замену до конца
+            self.replace_columns()
+            self.write_meta(self.rows)
+        for key in KLINE_COLUMNS:
+            # новые колонки merge, которые не успели закоммитить
+            if os.path.exists(self.column_path(key) + '.new'):
+                os.remove(self.column_path(key) + '.new')
+        # обрезаем хвосты колонок, которые не успели закоммитить
+        for key, dtype in KLINE_COLUMNS.items():
+            column = self.column_path(key)
+            size = self.rows * np.dtype(dtype).itemsize
+            if not os.path.exists(column):
+                open(column, 'wb').close()
+            if os.path.getsize(column) != size:
+                with open(column, 'r+b') as f:
+                    f.truncate(size)
+        self.last = int(self.read_column('open_time', self.rows - 1, self.rows)[0]) if self.rows else None
+
+    def __len__(self):
+        return self.rows
+
+    def column_path(self, key):
+        return os.path.join(self.path, f'{key}.bin')
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'rows': 0}
+
+    def write_meta(self, rows, replace=False):
+        meta = os.path.join(self.path, 'meta.json')
+        with open(meta + '.tmp', 'w') as f:
+            json.dump({'rows': rows, 'replace': True} if replace else {'rows': rows}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(meta + '.tmp', meta)
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def last_open_time(self):
+        return self.last
+
+    def append(self, klines):
+        '''
+        Функция дописывает свечи в конец хранилища
+        Принимает словарь колонок, свечи не новее последней сохраненной пропускаются
+        Возвращает количество дописанных свечей
+        '''
+        if self.readonly:
+            raise ValueError(f'Kline store {self.path} is opened read-only')
+        with self.lock:
+            open_time = np.asarray(klines['open_time'], dtype=np.int64)
+            new = open_time > self.last if self.last is not None else np.ones(len(open_time), dtype=bool)
+            if not new.any():
+                return 0
+            for key, dtype in KLINE_COLUMNS.items():
+                values = np.asarray(klines[key], dtype=dtype)[new]
+                with open(self.column_path(key), 'r+b') as f:
+                    f.seek(self.rows * values.itemsize)
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            # свечи считаются записанными только после обновления meta.json
+            self.write_meta(self.rows + int(new.sum()))
+            self.rows += int(new.sum())
+            self.last = int(open_time[new][-1])
+            return int(new.sum())
+
+    def merge(self, klines):
+        '''
+        Функция вставляет свечи в любое место хранилища, свечи с уже сохраненным open_time пропускаются
+        Новые колонки пишутся рядом с текущими, затем meta.json отмечает замену, и только потом файлы
+        подменяются: после падения при открытии остается либо старое, либо новое хранилище
+        Возвращает количество добавленных свечей
+        '''
+        if self.readonly:
+            raise ValueError(f'Kline store {self.path} is opened read-only')
+        with self.lock:
+            old = self.read()
+            open_time = np.concatenate([old['open_time'], np.asarray(klines['open_time'], dtype=np.int64)])
+            order = np.argsort(open_time, kind='stable')
+            # при совпадении open_time первой идет уже сохраненная свеча, ее и оставляем
+            keep = np.r_[True, np.diff(open_time[order]) != 0] if len(order) else np.ones(0, dtype=bool)
+            index = order[keep]
+            added = len(index) - self.rows
+            if not added:
+                return 0
+            for key, dtype in KLINE_COLUMNS.items():
+                values = np.concatenate([old[key], np.asarray(klines[key], dtype=dtype)])[index]
+                with open(self.column_path(key) + '.new', 'wb') as f:
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.write_meta(len(index), replace=True)
+            self.replace_columns()
+            self.write_meta(len(index))
+            self.rows = len(index)
+            self.last = int(open_time[index[-1]])
+            return added
+
+    def replace_columns(self):
+        for key in KLINE_COLUMNS:
+            column = self.column_path(key)
+            if os.path.exists(column + '.new'):
+                os.replace(column + '.new', column)
+
+    def gaps(self, time_frame_ms):
+        '''
+        Функция возвращает пропуски внутри хранилища: список (open_time первой, open_time последней
+        недостающей свечи)
+        '''
+        open_time = self.read_column('open_time')
+        jumps = np.flatnonzero(np.diff(open_time) > time_frame_ms)
+        return [(int(open_time[i]) + time_frame_ms, int(open_time[i + 1]) - time_frame_ms) for i in jumps]
+
+    def read_column(self, key, start=0, stop=None):
+        rows = self.rows
+        stop = rows if stop is None else min(stop, rows)
+        if rows == 0 or start >= stop:
+            return np.empty(0, dtype=KLINE_COLUMNS[key])
+        column = np.memmap(self.sources.get(key) or self.column_path(key), dtype=KLINE_COLUMNS[key], mode='r', shape=(rows,))
+        return column[start:stop]
+
+    def read(self, start=0, stop=None):
+        '''
+        Функция возвращает свечи хранилища в виде словаря колонок memmap
+        Данные не копируются в память
+        '''
+        return {key: self.read_column(key, start, stop) for key in KLINE_COLUMNS}
+
+    def tail(self, limit):
+        '''
+        Функция возвращает последние limit свечей в формате get_klines: open_time - int, остальное - float
+        '''
+        return {key: values.tolist() if key == 'open_time' else values.astype(float).tolist()
+                for key, values in self.read(max(0, self.rows - limit)).items()}
+
+
+def open_store(root, pair, time_frame):
+    '''
+    Функция возвращает хранилище свечей пары и тайм фрейма, открывая его один раз на процесс
+    '''
+    path = os.path.join(root, f'{pair}_{time_frame}')
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = KlineStore(path)
+        return _stores[path]
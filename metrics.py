@@ -0,0 +1,193 @@
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9108  # порт локального эндпоинта /metrics, None - не поднимать
+# границы корзин гистограмм в секундах: от 10 мкс до ~100 с с шагом x1.5
+BUCKETS = [1e-5 * 1.5 ** i for i in range(40)]
+_histograms = {}
+_gauges = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+    '''
+    Гистограмма длительностей с фиксированными корзинами
+    Запись стоит один bisect и одно увеличение счетчика под коротким локом
+    '''
+    __slots__ = ('name', 'labels', 'counts', 'total', 'count', 'max', 'lock')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        '''
+        Функция оценивает квантиль по корзинам, возвращает верхнюю границу корзины
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+def histogram(name, **labels):
+    '''
+    Функция возвращает гистограмму по имени и меткам, создает ее при первом обращении
+    '''
+    key = (name, tuple(sorted(labels.items())))
+    found = _histograms.get(key)
+    if found is None:
+        with _lock:
+            found = _histograms.setdefault(key, Histogram(name, key[1]))
+    return found
+
+
+def gauge(name, func):
+    '''
+    Функция регистрирует показатель, значение которого считается функцией func при чтении
+    '''
+    _gauges[name] = func
+
+
+class timer:
+    '''
+    Замер длительности блока: with timer('name', label=value): ...
+    '''
+    __slots__ = ('hist', 'start')
+
+    def __init__(self, name, **labels):
+        self.hist = histogram(name, **labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+
+
+def timed(name, **labels):
+    '''
+    Декоратор, который пишет длительность каждого вызова функции в гистограмму
+    '''
+    def decorator(func):
+        hist = histogram(name, **labels)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument_client(client, methods):
+    '''
+    Функция оборачивает методы клиента биржи замером длительности вызова
+    '''
+    for method in methods:
+        setattr(client, method, timed('exchange_call_seconds', endpoint=method)(getattr(client, method)))
+    return client
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+def render():
+    '''
+    Функция возвращает все метрики в текстовом формате Prometheus
+    '''
+    lines = []
+    typed = set()
+    for hist in list(_histograms.values()):
+        name = f'fvg_{hist.name}'
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        with hist.lock:
+            counts, total, count = list(hist.counts), hist.total, hist.count
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ['+Inf'], counts):
+            cumulative += n
+            le = bound if bound == '+Inf' else f'{bound:.6g}'
+            lines.append(f'{name}_bucket{_format_labels(hist.labels, [("le", le)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(hist.labels)} {total}')
+        lines.append(f'{name}_count{_format_labels(hist.labels)} {count}')
+    for name, func in list(_gauges.items()):
+        lines.append(f'# TYPE fvg_{name} gauge')
+        lines.append(f'fvg_{name} {func()}')
+    return '\n'.join(lines) + '\n'
+
+
+def stats():
+    '''
+    Функция возвращает таблицу p50/p99 по всем гистограммам для команды stats
+    '''
+    rows = [f'{"metric":<48} {"count":>8} {"p50 ms":>10} {"p99 ms":>10} {"max ms":>10}']
+    for hist in sorted(_histograms.values(), key=lambda h: (h.name, h.labels)):
+        name = hist.name + _format_labels(hist.labels)
+        rows.append(f'{name:<48} {hist.count:>8} {hist.quantile(0.5) * 1000:>10.3f} '
+                    f'{hist.quantile(0.99) * 1000:>10.3f} {hist.max * 1000:>10.3f}')
+    for name, func in _gauges.items():
+        rows.append(f'{name:<48} {func():>8.3f}')
+    return '\n'.join(rows)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    '''
+    Функция поднимает локальный HTTP эндпоинт /metrics в фоновом потоке
+    '''
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    except OSError as e:
+        logging.info(f'Error starting metrics server: {e}')
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Metrics available on http://127.0.0.1:{port}/metrics')
+    return server
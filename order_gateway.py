@@ -0,0 +1,114 @@
+import time
+import uuid
+import random
+import logging
+import threading
+from concurrent.futures import Future
+from requests.exceptions import ConnectionError
+
+BATCH_WINDOW_MS = 10  # сколько ждем другие ордера, прежде чем отправить пачку
+BATCH_MAX_SIZE = 10  # максимум ордеров в одном пакетном запросе для спота
+BATCH_RETRIES = 3  # повторы при обрыве соединения
+BACKOFF_BASE_MS = 200  # базовая задержка между повторами
+
+
+class OrderGateway:
+    '''
+    Шлюз отправки и отмены ордеров
+    Собирает ордера, пришедшие в течение window_ms, и отправляет их пакетными запросами биржи
+    Все запросы идут через одного клиента с keep-alive сессией
+    place и cancel возвращают Future с результатом по каждому ордеру:
+    словарь {'ok': True/False, 'orderId': ..., 'msg': ...}
+    '''
+    def __init__(self, client, window_ms=BATCH_WINDOW_MS, max_batch=BATCH_MAX_SIZE, retries=BATCH_RETRIES):
+        self.client = client
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.retries = retries
+        self.places = []
+        self.cancels = []
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, daemon=True)
+                self.thread.start()
+
+    def place(self, order_params):
+        '''
+        Функция ставит ордер в очередь на отправку
+        orderLinkId нужен, чтобы повтор после обрыва не создал второй ордер
+        '''
+        order_params = dict(order_params)
+        order_params.setdefault('orderLinkId', uuid.uuid4().hex)
+        return self.submit(self.places, order_params)
+
+    def cancel(self, symbol, order_id):
+        '''
+        Функция ставит отмену ордера в очередь
+        '''
+        return self.submit(self.cancels, {'symbol': symbol, 'orderId': order_id})
+
+    def submit(self, queue, params):
+        self.start()
+        future = Future()
+        with self.cond:
+            queue.append((params, future))
+            self.cond.notify()
+        return future
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.places and not self.cancels:
+                    self.cond.wait()
+            # даем время набраться остальным ордерам этой свечи
+            time.sleep(self.window_ms / 1000)
+            with self.cond:
+                cancels, self.cancels = self.cancels, []
+                places, self.places = self.places, []
+            # отмены первыми, чтобы освободить баланс под новые ордера
+            for i in range(0, len(cancels), self.max_batch):
+                self.send(cancels[i:i + self.max_batch], self.client.cancel_order, self.client.cancel_batch_order)
+            for i in range(0, len(places), self.max_batch):
+                self.send(places[i:i + self.max_batch], self.client.place_order, self.client.place_batch_order)
+
+    def send(self, batch, single, multiple):
+        '''
+        Функция отправляет пачку одним запросом и раздает результаты по Future
+        '''
+        requests = [{key: value for key, value in params.items() if key != 'category'} for params, _ in batch]
+        try:
+            if len(batch) == 1:
+                response = self.call(single, category="spot", **requests[0])
+                results = [{'ok': response['retMsg'] == "OK", 'msg': response['retMsg'],
+                            'orderId': response['result'].get('orderId')}]
+            else:
+                response = self.call(multiple, category="spot", request=requests)
+                codes = response['retExtInfo']['list']
+                results = [{'ok': code['code'] == 0, 'msg': code['msg'], 'orderId': item.get('orderId')}
+                           for item, code in zip(response['result']['list'], codes)]
+        # поток шлюза не должен падать, иначе ордера в очереди не дождутся ответа
+        except Exception as e:
+            logging.info(f'Error sending batch of {len(batch)} orders: {e}')
+            results = []
+        # на ордера без ответа биржи возвращаем ошибку, чтобы никто не ждал вечно
+        results += [{'ok': False, 'msg': 'No result', 'orderId': None}] * (len(batch) - len(results))
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def call(self, method, **kwargs):
+        '''
+        Функция повторяет запрос при обрыве соединения с экспоненциальной задержкой со случайным разбросом
+        '''
+        for attempt in range(self.retries + 1):
+            try:
+                return method(**kwargs)
+            except ConnectionError as e:
+                if attempt == self.retries:
+                    raise
+                delay = random.uniform(0, BACKOFF_BASE_MS * 2 ** attempt) / 1000
+                logging.info(f'Connection error: {e}, retrying in {delay:.2f}s')
+                time.sleep(delay)
@@ -0,0 +1,133 @@
+import heapq
+import logging
+import threading
+from clock import now_ms, wait_until
+
+RECONCILE_MS = 300000  # как часто сверяем локальный индекс со списком ордеров биржи
+EXPIRY_BATCH_MS = 1000  # ордера, истекающие в пределах этого окна, обрабатываются вместе
+OPEN_STATUSES = ('New', 'PartiallyFilled', 'Untriggered')
+
+
+class OrderTracker:
+    '''
+    Локальный индекс открытых ордеров
+    Обновляется по сообщениям вебсокета order и периодически сверяется с биржей
+    Сроки жизни ордеров лежат в куче, поэтому следующий истекающий ордер находится за O(log n)
+    Принимает функцию fetch, которая возвращает открытые ордера пары (get_orders),
+    и пару, None - все спотовые пары
+    owns - функция, которая по ордеру биржи говорит, выставил ли его бот: чужие ордера в индекс не попадают
+    и не отменяются, None - следим за всеми ордерами пары
+    '''
+    def __init__(self, fetch, pair, max_order_duration, max_trade_duration,
+                 reconcile_ms=RECONCILE_MS, batch_ms=EXPIRY_BATCH_MS, owns=None):
+        self.fetch = fetch
+        self.owns = owns
+        self.pair = pair
+        self.max_order_duration = max_order_duration
+        self.max_trade_duration = max_trade_duration
+        self.reconcile_ms = reconcile_ms
+        self.batch_ms = batch_ms
+        self.orders = {}
+        self.heap = [] # (срок истечения, orderId)
+        self.next_reconcile = 0
+        self.updated = 0 # когда индекс последний раз обновлялся с биржи
+        self.cond = threading.Condition()
+
+    def deadline(self, order):
+        '''
+        Функция возвращает время, после которого ордер надо закрыть, по правилам order_canceller
+        '''
+        # TP/SL ордер живет не дольше сделки
+        if order['stopOrderType'] == 'BidirectionalTpslOrder':
+            return int(order['createdTime']) + self.max_trade_duration
+        if order['orderType'] == 'Limit' and order['orderStatus'] == 'New':
+            return int(order['createdTime']) + self.max_order_duration
+        if order['orderType'] == 'Limit' and order['orderStatus'] == 'PartiallyFilled':
+            return int(order['updatedTime']) + self.max_trade_duration
+        return None
+
+    def upsert(self, order):
+        '''
+        Функция добавляет, обновляет или удаляет ордер из индекса
+        Вызывается под self.cond
+        '''
+        if order['orderStatus'] not in OPEN_STATUSES or (self.owns is not None and not self.owns(order)):
+            self.orders.pop(order['orderId'], None)
+            return
+        self.orders[order['orderId']] = order
+        deadline = self.deadline(order)
+        if deadline is not None:
+            # старые записи в куче не удаляем, они отбрасываются при извлечении
+            heapq.heappush(self.heap, (deadline, order['orderId']))
+            if self.heap[0][1] == order['orderId']:
+                self.cond.notify()
+
+    def on_order_message(self, message):
+        '''
+        Обработчик сообщений вебсокета order
+        '''
+        with self.cond:
+            self.updated = now_ms()
+            for order in message['data']:
+                if order.get('category', 'spot') == 'spot' and self.pair in (None, order['symbol']):
+                    self.upsert(order)
+
+    def reconcile(self, orders=None):
+        '''
+        Функция полностью пересобирает индекс по списку открытых ордеров биржи
+        Уже полученный список можно передать в orders, иначе он запрашивается через fetch
+        '''
+        self.next_reconcile = now_ms() + self.reconcile_ms
+        if orders is None:
+            try:
+                orders = self.fetch(self.pair)
+            # ошибка pybit не должна останавливать мониторинг ордеров, повторим на следующей сверке
+            except Exception as e:
+                logging.info(f'Error getting open orders: {e}')
+                orders = False
+        if orders is False:
+            logging.info('Cant reconcile orders')
+            return False
+        with self.cond:
+            self.updated = now_ms()
+            self.orders = {}
+            self.heap = []
+            for order in orders:
+                self.upsert(order)
+        logging.info(f'Reconciled {len(self.orders)} open orders')
+        return True
+
+    def pop_expired(self, now):
+        '''
+        Функция достает из кучи все ордера, истекающие до now + batch_ms
+        Вызывается под self.cond
+        '''
+        expired = []
+        while self.heap and self.heap[0][0] <= now + self.batch_ms:
+            deadline, order_id = heapq.heappop(self.heap)
+            order = self.orders.get(order_id)
+            # запись устарела: ордер закрыт или его срок изменился
+            if order is None or self.deadline(order) != deadline:
+                continue
+            del self.orders[order_id]
+            expired.append(order)
+        return expired
+
+    def wait_expired(self):
+        '''
+        Функция ждет, пока не истечет хотя бы один ордер, и возвращает все истекшие ордера
+        Между истечениями делает плановые сверки с биржей
+        '''
+        while True:
+            now = now_ms()
+            if now >= self.next_reconcile:
+                self.reconcile()
+            with self.cond:
+                expired = self.pop_expired(now)
+                if expired:
+                    return expired
+                wake = self.next_reconcile
+                if self.heap:
+                    wake = min(wake, self.heap[0][0])
+                # срок по часам бота: под виртуальными часами ждем их сдвига, а не реального времени
+                wait_until(self.cond, wake)
@@ -0,0 +1,218 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+IP_LIMIT = (600, 5000)  # общий лимит REST запросов с одного IP: 600 за 5 секунд
+# запросов в секунду на эндпоинт, пока биржа не прислала свои заголовки лимитов
+ENDPOINT_LIMITS = {
+    'place_order': 20, 'cancel_order': 20, 'amend_order': 10,
+    'place_batch_order': 10, 'cancel_batch_order': 10, 'amend_batch_order': 10,
+    'get_open_orders': 50, 'get_wallet_balance': 50, 'get_executions': 50,
+}
+ORDER_METHODS = {'place_order', 'cancel_order', 'amend_order', 'cancel_all_orders',
+                 'place_batch_order', 'cancel_batch_order', 'amend_batch_order'}
+ORDER_RESERVE = 50  # столько токенов общего лимита чтения не трогают, они остаются ордерам
+RATE_LIMIT_CODE = 10006
+RATE_LIMIT_PAUSE_MS = 1000  # пауза эндпоинта после ответа о превышении лимита без заголовков
+RATE_LIMIT_RETRIES = 3  # столько раз повторяем запрос после ответа о превышении лимита
+
+
+class TokenBucket:
+    '''
+    Корзина токенов: до capacity запросов подряд, пополняется со скоростью rate в секунду
+    По заголовкам ответа биржи подстраивается под ее счетчик
+    '''
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.blocked_until = 0
+
+    def delay(self, now, reserve=0):
+        '''
+        Функция возвращает, сколько секунд ждать свободный токен, не трогая последние reserve токенов
+        '''
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0, (reserve + 1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def sync(self, limit, remaining, reset_ms, now):
+        '''
+        Функция выставляет корзину по заголовкам X-Bapi-Limit, X-Bapi-Limit-Status и X-Bapi-Limit-Reset-Timestamp
+        Лимиты эндпоинтов биржи считаются в секунду
+        '''
+        self.rate = self.capacity = limit
+        # токены, взятые запросами, которые еще в пути, биржа пока не посчитала
+        self.tokens = min(self.tokens, remaining)
+        self.updated = now
+        if remaining <= 0 and reset_ms:
+            self.blocked_until = reset_ms / 1000
+
+
+class RequestScheduler:
+    '''
+    Общий планировщик всех запросов к бирже, подставляется вместо клиента:
+    любой метод клиента вызывается через него с теми же аргументами
+    На каждый эндпоинт своя корзина токенов, которая следует заголовкам лимитов биржи,
+    поверх них общая корзина лимита IP
+    Одинаковые запросы чтения, пришедшие пока такой же уже идет, получают его ответ,
+    поэтому ответы чтения общие и менять их нельзя
+    Ордера и отмены не ждут чтений: чтения не берут последние reserve токенов общего лимита
+    Вместо клиента можно передать factory: клиент создастся при первом запросе
+    Ответ 10006 (превышен лимит) ставит эндпоинт на паузу до сброса лимита, и запрос повторяется,
+    поэтому клиент pybit создается без своего повтора 10006 (см. make_client в боте)
+    '''
+    def __init__(self, exchange=None, limits=ENDPOINT_LIMITS, ip_limit=IP_LIMIT, reserve=ORDER_RESERVE,
+                 factory=None):
+        self.exchange = exchange
+        self.factory = factory
+        self.limits = dict(limits)
+        self.buckets = {}
+        self.ip_bucket = TokenBucket(ip_limit[0] * 1000 / ip_limit[1], ip_limit[0])
+        self.reserve = reserve
+        self.inflight = {} # запрос чтения -> Future с его ответом
+        self.counts = dict.fromkeys(('calls', 'coalesced', 'delayed', 'rate_limited'), 0)
+        self.cond = threading.Condition()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attr = getattr(self.connect(), name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.request(name, attr, args, kwargs)
+        call.__name__ = name
+        return call
+
+    def connect(self):
+        '''
+        Функция возвращает клиента биржи, при первом вызове создает его
+        '''
+        if self.exchange is None:
+            with self.cond:
+                if self.exchange is None:
+                    self.exchange = self.factory()
+        return self.exchange
+
+    def request(self, name, method, args, kwargs):
+        '''
+        Функция выполняет запрос, одинаковые запросы чтения объединяет с уже идущим
+        '''
+        if not name.startswith('get_'):
+            return self.send(name, method, args, kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return self.send(name, method, args, kwargs)
+        with self.cond:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.counts['coalesced'] += 1
+            else:
+                self.inflight[key] = Future()
+        if future is not None:
+            return future.result()
+        try:
+            response = self.send(name, method, args, kwargs)
+        except BaseException as e:
+            self.inflight.pop(key).set_exception(e)
+            raise
+        self.inflight.pop(key).set_result(response)
+        return response
+
+    def send(self, name, method, args, kwargs):
+        '''
+        Функция выполняет запрос в пределах лимитов, после ответа 10006 ждет паузу эндпоинта и повторяет запрос
+        '''
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.acquire(name)
+            try:
+                response = self.observe(name, method(*args, **kwargs))
+            # pybit бросает ответ с ошибкой исключением, код и заголовки ответа лежат в нем
+            except Exception as e:
+                if getattr(e, 'status_code', None) != RATE_LIMIT_CODE or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                self.rate_limited(name, getattr(e, 'resp_headers', None))
+                continue
+            if not (isinstance(response, dict) and response.get('retCode') == RATE_LIMIT_CODE):
+                return response
+        return response
+
+    def bucket(self, name):
+        bucket = self.buckets.get(name)
+        if bucket is None and name in self.limits:
+            bucket = self.buckets[name] = TokenBucket(self.limits[name])
+        return bucket
+
+    def acquire(self, name):
+        '''
+        Функция ждет токены эндпоинта и общего лимита и забирает их
+        '''
+        reserve = 0 if name in ORDER_METHODS else self.reserve
+        delayed = False
+        with self.cond:
+            bucket = self.bucket(name)
+            while True:
+                now = time.time()
+                delay = self.ip_bucket.delay(now, reserve)
+                if bucket is not None:
+                    delay = max(delay, bucket.delay(now))
+                if delay <= 0:
+                    break
+                if not delayed:
+                    delayed = True
+                    self.counts['delayed'] += 1
+                self.cond.wait(delay)
+            self.ip_bucket.take()
+            if bucket is not None:
+                bucket.take()
+            self.counts['calls'] += 1
+
+    def observe(self, name, result):
+        '''
+        Функция подстраивает корзину эндпоинта по ответу и возвращает сам ответ
+        Клиент pybit отдает (ответ, время, заголовки), если создан с return_response_headers=True
+        '''
+        headers = None
+        if isinstance(result, tuple):
+            response, headers = result[0], result[2] if len(result) > 2 else None
+        else:
+            response = result
+        now = time.time()
+        with self.cond:
+            if headers is not None and 'X-Bapi-Limit' in headers:
+                bucket = self.buckets.get(name)
+                if bucket is None:
+                    bucket = self.buckets[name] = TokenBucket(int(headers['X-Bapi-Limit']))
+                bucket.sync(int(headers['X-Bapi-Limit']), int(headers.get('X-Bapi-Limit-Status', 0)),
+                            int(headers.get('X-Bapi-Limit-Reset-Timestamp', 0)), now)
+        # клиенты, которые не бросают исключений, отдают ответ 10006 как есть
+        if isinstance(response, dict) and response.get('retCode') == RATE_LIMIT_CODE:
+            self.rate_limited(name, headers)
+        return response
+
+    def rate_limited(self, name, headers=None):
+        '''
+        Функция ставит эндпоинт на паузу после ответа 10006:
+        до X-Bapi-Limit-Reset-Timestamp, а без этого заголовка на RATE_LIMIT_PAUSE_MS
+        '''
+        now = time.time()
+        reset = int(headers.get('X-Bapi-Limit-Reset-Timestamp', 0)) / 1000 if headers else 0
+        with self.cond:
+            self.counts['rate_limited'] += 1
+            bucket = self.bucket(name) or self.ip_bucket
+            bucket.tokens = 0
+            bucket.blocked_until = max(bucket.blocked_until, reset if reset > now else now + RATE_LIMIT_PAUSE_MS / 1000)
+        logging.info(f'Rate limit hit on {name}, pausing it')
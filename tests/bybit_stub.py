@@ -0,0 +1,140 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+REJECT_CODE = 170130
+REJECT_MSG = 'Data sent for paramter is invalid'
+NOT_FOUND_CODE = 170213
+NOT_FOUND_MSG = 'Order does not exist.'
+SERVER_ERROR_CODE = 10016
+SERVER_ERROR_MSG = 'Internal server error'
+RATE_LIMIT_CODE = 10006
+RATE_LIMIT_MSG = 'Too many visits!'
+
+
+class BybitStub:
+    '''
+    Локальная замена REST API Bybit v5 для тестов: ордера спота и свечи
+    Каждый запрос записывается в requests, ответы можно портить флагами ниже
+    '''
+    def __init__(self):
+        self.requests = []  # (путь, параметры) каждого запроса
+        self.orders = {}  # orderLinkId -> orderId выставленных ордеров
+        self.reject = set()  # orderLinkId, которые биржа отклоняет
+        self.drop = 0  # столько следующих запросов обрываем без ответа
+        self.truncate = False  # пакетный ответ без последнего ордера
+        self.klines = {}  # (symbol, interval) -> строки свечей по возрастанию open_time
+        self.kline_errors = set()  # start окон свечей, на которые биржа отвечает ошибкой
+        self.rate_limit = 0  # столько следующих запросов получают 10006
+        self.reset_ms = 0  # X-Bapi-Limit-Reset-Timestamp ответа 10006
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self):
+        '''
+        Функция создает клиента pybit, который ходит в заглушку вместо биржи
+        '''
+        from pybit.unified_trading import HTTP
+        client = HTTP(api_key='key', api_secret='secret', return_response_headers=True)
+        client.endpoint = self.url
+        return client
+
+    def sent(self, path):
+        return [params for request_path, params in self.requests if request_path == path]
+
+    def handle(self, path, params):
+        '''
+        Функция возвращает ответ биржи на запрос или None, если соединение надо оборвать
+        '''
+        with self.lock:
+            self.requests.append((path, params))
+            if self.drop:
+                self.drop -= 1
+                return None
+            if self.rate_limit:
+                self.rate_limit -= 1
+                return response({}, RATE_LIMIT_CODE, RATE_LIMIT_MSG)
+            if path == '/v5/order/create':
+                item, code, msg = self.create(params)
+                return response(item, code, msg)
+            if path == '/v5/order/cancel':
+                item, code, msg = self.cancel(params)
+                return response(item, code, msg)
+            if path in ('/v5/order/create-batch', '/v5/order/cancel-batch'):
+                handler = self.create if path.endswith('create-batch') else self.cancel
+                results = [handler(order) for order in params['request']]
+                if self.truncate:
+                    results = results[:-1]
+                return response({'list': [item for item, _, _ in results]}, 0, 'OK',
+                                {'list': [{'code': code, 'msg': msg} for _, code, msg in results]})
+            if path == '/v5/market/kline':
+                return self.kline(params)
+            return response({}, 10001, f'Unknown path {path}')
+
+    def create(self, params):
+        link_id = params['orderLinkId']
+        if link_id in self.reject:
+            return {'orderId': '', 'orderLinkId': link_id}, REJECT_CODE, REJECT_MSG
+        order_id = self.orders.setdefault(link_id, str(1000 + len(self.orders)))
+        return {'orderId': order_id, 'orderLinkId': link_id}, 0, 'OK'
+
+    def cancel(self, params):
+        for link_id, order_id in self.orders.items():
+            if order_id == params['orderId']:
+                del self.orders[link_id]
+                return {'orderId': order_id, 'orderLinkId': link_id}, 0, 'OK'
+        return {'orderId': params['orderId'], 'orderLinkId': ''}, NOT_FOUND_CODE, NOT_FOUND_MSG
+
+    def kline(self, params):
+        start, end = int(params.get('start', 0)), int(params.get('end', 2 ** 62))
+        if start in self.kline_errors:
+            return response({}, SERVER_ERROR_CODE, SERVER_ERROR_MSG)
+        rows = [row for row in self.klines.get((params['symbol'], params['interval']), [])
+                if start <= row[0] <= end]
+        # биржа отдает последние limit свечей диапазона, от новых к старым
+        rows = rows[-int(params.get('limit', 200)):][::-1]
+        return response({'category': 'spot', 'symbol': params['symbol'],
+                         'list': [[str(value) for value in row] for row in rows]}, 0, 'OK')
+
+
+def response(result, code, msg, ext_info=None):
+    return {'retCode': code, 'retMsg': msg, 'result': result, 'retExtInfo': ext_info or {}, 'time': 0}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, как у биржи
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.reply(url.path, dict(parse_qsl(url.query)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply(self.path, json.loads(body or b'{}'))
+
+    def reply(self, path, params):
+        result = self.server.stub.handle(path, params)
+        if result is None:
+            # обрыв до ответа: клиент получает ConnectionError
+            self.close_connection = True
+            return
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if result['retCode'] == RATE_LIMIT_CODE:
+            self.send_header('X-Bapi-Limit-Reset-Timestamp', str(self.server.stub.reset_ms))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
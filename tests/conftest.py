@@ -0,0 +1,8 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+# константы бота читаются из настроек при импорте: без лога, журнала и хранилища на диске
+os.environ['FVG_CONFIG'] = os.path.join(TESTS_DIR, 'fvg_test_config.json')
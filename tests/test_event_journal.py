@@ -0,0 +1,115 @@
+import struct
+import numpy as np
+import pytest
+import bybit_FVG_bot as bot
+import event_journal
+from event_journal import EventJournal, CANDLE, FVG_FOUND, ZONE_ADDED, ORDER_SENT
+from fvg_zones import ZoneStore
+from kline_store import KlineStore
+
+TIME_FRAME_MS = 15 * 60 * 1000
+
+
+def make_klines(n, seed=1):
+    '''
+    Функция строит случайное блуждание цены, на котором регулярно появляются FVG
+    '''
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.003, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n)))
+    return {'open_time': np.arange(1, n + 1, dtype=np.int64) * TIME_FRAME_MS, 'open': open_, 'high': high,
+            'low': low, 'close': close, 'volume': np.ones(n), 'turnover': np.ones(n)}
+
+
+def candles(klines):
+    return [dict(zip(bot.KLINE_KEYS, values)) for values in zip(*(klines[key] for key in bot.KLINE_KEYS))]
+
+
+@pytest.fixture
+def own_orders(monkeypatch):
+    orders = {}
+    monkeypatch.setattr(bot, 'OWN_ORDERS', orders)
+    return orders
+
+
+def test_store_candles_survive_restart(tmp_path, own_orders):
+    store = KlineStore(str(tmp_path / 'store'))
+    store.append(make_klines(1500))
+    # свечи идут в машину так же, как из get_klines: через хранилище
+    stored = candles(store.tail(1500))
+    assert all(type(candle['open_time']) is int for candle in stored)
+    journal = EventJournal(str(tmp_path / 'journal'), commit_ms=1)
+    journal.start()
+    machine = bot.FVGStateMachine(zones=ZoneStore(), journal=journal)
+    for i, candle in enumerate(stored[:1200], 1):
+        machine.on_candle(candle)
+        if i == 1000:
+            journal.snapshot(bot.journal_state(machine))
+    journal.append(ORDER_SENT, (bot.now_ms(), 30000.0, 0.001), ('BTCUSDT', 'Buy', 'fvg-1'))
+    assert journal.flush(10)
+    _, events = EventJournal(journal.path).load(repair=False)
+    kinds = {event for event, _, _ in events}
+    assert {CANDLE, FVG_FOUND, ZONE_ADDED, ORDER_SENT} <= kinds
+    assert sum(event == CANDLE for event, _, _ in events) == 200
+
+    restored = bot.FVGStateMachine(zones=ZoneStore())
+    own_orders.clear()
+    bot.restore_state(restored, EventJournal(journal.path))
+    assert restored.last_open_time == machine.last_open_time
+    assert restored.pending == machine.pending
+    assert len(restored.zones) == len(machine.zones)
+    assert list(own_orders) == ['fvg-1']
+    # после перезапуска обе машины дают одни и те же сигналы
+    machine.journal = None
+    for candle in stored[1200:]:
+        assert restored.on_candle(candle) == machine.on_candle(candle)
+
+
+def test_append_rejects_bad_fields_in_caller(tmp_path):
+    journal = EventJournal(str(tmp_path), commit_ms=1)
+    journal.start()
+    with pytest.raises(struct.error):
+        journal.append(CANDLE, (1.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0))
+    journal.append(CANDLE, (1, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0))
+    assert journal.flush(10)
+    _, events = EventJournal(journal.path).load(repair=False)
+    assert [fields[0] for _, fields, _ in events] == [1]
+
+
+def test_failed_write_keeps_the_rest_of_the_batch(tmp_path):
+    journal = EventJournal(str(tmp_path), commit_ms=50)
+    journal.start()
+    write_data = journal.write_data
+    bad = event_journal.encode(CANDLE, (2, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    def failing(data):
+        # пишем начало, как при нехватке места на диске, и падаем
+        if bad in data:
+            write_data(data[:len(data) // 2])
+            raise OSError('No space left on device')
+        write_data(data)
+    journal.write_data = failing
+    for open_time in (1, 2, 3):
+        journal.append(CANDLE, (open_time, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0))
+    assert journal.flush(10)
+    _, events = EventJournal(journal.path).load(repair=False)
+    assert [fields[0] for _, fields, _ in events] == [1, 3]
+
+
+def test_journal_errors_dont_stop_trading(tmp_path, caplog):
+    klines = make_klines(300)
+    expected = bot.FVGStateMachine(zones=ZoneStore())
+    signals = [expected.on_candle(candle) for candle in candles(klines)]
+    assert any(signals)
+    journal = EventJournal(str(tmp_path), commit_ms=1)
+    journal.start()
+
+    def failing(event, fields, strings=()):
+        raise OSError('No space left on device')
+    journal.append = failing
+    machine = bot.FVGStateMachine(zones=ZoneStore(), journal=journal)
+    # запись в журнал падает на каждом событии, а сигналы остаются теми же
+    assert [machine.on_candle(candle) for candle in candles(klines)] == signals
+    assert 'Error writing to journal: No space left on device' in caplog.text
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import bybit_FVG_bot as bot
+from fvg_backtest import run_backtest, COVERED
+from fvg_zones import ZoneStore
+
+
+def make_klines(n=5000, seed=1):
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.003, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, n)))
+    return {'open_time': np.arange(n, dtype=np.int64) * bot.TIME_FRAME_MS, 'open': open_, 'high': high,
+            'low': low, 'close': close, 'volume': np.ones(n), 'turnover': np.ones(n)}
+
+
+def machine_signals(klines, settings):
+    '''
+    Функция прогоняет свечи через FVGStateMachine живого бота и возвращает его сигналы:
+    (open_time свечи сигнала, направление, low, high)
+    '''
+    machine = bot.FVGStateMachine(settings, zones=ZoneStore())
+    signals = []
+    for i in range(len(klines['open_time'])):
+        candle = {key: klines[key][i].item() for key in bot.KLINE_KEYS}
+        for _, bull_fvg_flag, fvg_dict in machine.on_candle(candle):
+            signals.append((candle['open_time'], 1 if bull_fvg_flag else -1, fvg_dict['low'][-1],
+                            fvg_dict['high'][-1]))
+    return sorted(signals)
+
+
+def backtest_signals(klines, settings):
+    ledger, _ = run_backtest(klines, settings)
+    placed = ledger['status'] != COVERED
+    cover = np.where(ledger['direction'] == 1, settings['cover_neighbors_bull'], settings['cover_neighbors_bear'])
+    expand = np.where(ledger['direction'] == 1, settings['expand_neighbors_bull'], settings['expand_neighbors_bear'])
+    signal_time = ledger['open_time'] + np.maximum(cover, expand) * bot.TIME_FRAME_MS
+    return sorted(zip(signal_time[placed].tolist(), ledger['direction'][placed].tolist(),
+                      ledger['fvg_low'][placed].tolist(), ledger['fvg_high'][placed].tolist()))
+
+
+@pytest.mark.parametrize('cover_bull, expand_bull, cover_bear, expand_bear', [
+    (3, 3, 3, 3),
+    (3, 2, 3, 2),
+    (5, 0, 5, 0),
+    (1, 5, 1, 5),
+    (0, 4, 2, 0),
+    (1, 5, 4, 1),
+])
+def test_backtest_matches_live_state_machine(cover_bull, expand_bull, cover_bear, expand_bear):
+    settings = {'cover_neighbors_bull': cover_bull, 'expand_neighbors_bull': expand_bull,
+                'cover_neighbors_bear': cover_bear, 'expand_neighbors_bear': expand_bear}
+    klines = make_klines()
+    expected = machine_signals(klines, settings)
+    assert expected
+    assert backtest_signals(klines, settings) == expected
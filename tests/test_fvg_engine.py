@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+import bybit_FVG_bot as bot
+import clock
+from fvg_engine import SymbolStrategy, FVGEngine
+from kline_feed import STREAM_GRACE_MS
+
+DAY_MS = 86400000
+
+
+def test_strategy_accepts_day_and_week_time_frames():
+    assert SymbolStrategy('BTCUSDT', 'D').time_frame_ms == DAY_MS
+    assert SymbolStrategy('BTCUSDT', 'W').time_frame_ms == 7 * DAY_MS
+    with pytest.raises(ValueError):
+        SymbolStrategy('BTCUSDT', 'M')
+
+
+def test_week_polling_waits_for_monday_close(monkeypatch):
+    # четверг 2024-01-04 12:00, недельная свеча закроется в понедельник 2024-01-08 00:00
+    monkeypatch.setattr(clock, 'CLOCK', clock.VirtualClock(1704369600000))
+    engine = FVGEngine([SymbolStrategy('BTCUSDT', 'W')])
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        raise asyncio.CancelledError
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(engine.watch_time_frame('W'))
+    assert sleeps[0] * 1000 == 1704672000000 - 1704369600000 + STREAM_GRACE_MS
+
+
+def test_order_tasks_are_kept_until_done(monkeypatch):
+    strategy = SymbolStrategy('BTCUSDT', '15')
+    strategy.order_filters = {'minOrderQty': '0.0001'}
+    monkeypatch.setattr(SymbolStrategy, 'on_candle', lambda self, candle: [(False, True, {'low': [1.0], 'high': [2.0]})])
+    placed = []
+    monkeypatch.setattr(bot, 'place_fvg_order', lambda *args: placed.append(args) or True)
+    engine = FVGEngine([strategy])
+
+    async def run():
+        engine.loop = asyncio.get_running_loop()
+        engine.on_candle(strategy, {'open_time': clock.now_ms()})
+        assert len(engine.tasks) == 1
+        await asyncio.gather(*engine.tasks)
+        await asyncio.sleep(0)
+    asyncio.run(run())
+    assert engine.tasks == set()
+    assert placed == [(False, True, {'low': [1.0], 'high': [2.0]}, 'BTCUSDT', strategy.settings)]
+    engine.executor.shutdown()
@@ -0,0 +1,40 @@
+import numpy as np
+import bybit_FVG_bot as bot
+import fvg_sweep
+from fvg_backtest import run_backtest
+from fvg_sweep import share_klines, attach_klines, evaluate, param_sample, run_sweep, SWEEP_SPACE
+from kline_store import interval_ms
+from test_fvg_backtest import make_klines
+
+
+def test_duration_grid_follows_time_frame():
+    frame_ms = interval_ms(bot.TIME_FRAME)
+    for key in ('max_order_duration', 'max_trade_duration'):
+        assert all(value % frame_ms == 0 for value in SWEEP_SPACE[key])
+
+
+def test_shared_klines_are_not_copied(monkeypatch):
+    klines = make_klines(2000)
+    shm, descriptor = share_klines(klines)
+    try:
+        attach_klines(descriptor)
+        combos = list(param_sample(20, seed=1))
+        expected = [run_backtest(klines, params)[1] for params in combos]
+        # окна строятся по хвосту NaN в разделяемой памяти, колонки не копируются
+        concatenate = np.concatenate
+        calls = []
+        monkeypatch.setattr(np, 'concatenate', lambda *args, **kwargs: calls.append(1) or concatenate(*args, **kwargs))
+        assert [evaluate(params)[1] for params in combos] == expected
+        assert calls == []
+    finally:
+        fvg_sweep._shm.close()
+        shm.close()
+        shm.unlink()
+
+
+def test_sweep_matches_backtest():
+    klines = make_klines(2000)
+    combos = list(param_sample(8, seed=2))
+    rows = run_sweep(klines, combos, processes=2, top=len(combos))
+    expected = {run_backtest(klines, params)[1]['total_r'] for params in combos}
+    assert {row['total_r'] for row in rows} == expected
@@ -0,0 +1,27 @@
+import pytest
+from fvg_zones import ZoneStore, LIVE, INVALIDATED
+
+
+def candle(open_time, low, high, close):
+    return {'open_time': open_time, 'open': close, 'high': high, 'low': low, 'close': close}
+
+
+@pytest.mark.parametrize('buffered', [True, False])
+def test_gap_candle_closes_zones_it_jumps_over(buffered):
+    zones = ZoneStore(max_age_ms=None)
+    bull = zones.add(1, 1, 90.0, 95.0, 94.0)
+    bear = zones.add(1, -1, 120.0, 125.0, 121.0)
+    untouched = zones.add(1, 1, 50.0, 55.0, 54.0)
+    if not buffered:
+        zones.rebuild()
+    assert zones.update(candle(2, 100.0, 110.0, 105.0))['touched'] == []
+    # гэп вниз: свеча целиком ниже бычьей зоны, ни low, ни high свечи в зону не попадают
+    result = zones.update(candle(3, 80.0, 85.0, 82.0))
+    assert result['invalidated'] == [bull]
+    assert zones.get(bull)['state'] == INVALIDATED
+    # гэп вверх через медвежью зону
+    result = zones.update(candle(4, 130.0, 140.0, 135.0))
+    assert result['invalidated'] == [bear]
+    assert zones.get(untouched)['state'] == LIVE
+    assert len(zones) == 1
+
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import bybit_FVG_bot as bot
+import clock
+from kline_store import open_store
+from request_scheduler import RequestScheduler
+from bybit_stub import BybitStub
+
+MINUTE_MS = 60000
+FIRST = 1704067200000
+CANDLES = 100
+NOW = FIRST + (CANDLES - 1) * MINUTE_MS + 30000  # последняя свеча еще формируется
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    stub = BybitStub()
+    stub.klines[('BTCUSDT', '1')] = [[FIRST + i * MINUTE_MS, i, i + 2, i - 1, i + 1, 10, 100] for i in range(CANDLES)]
+    monkeypatch.setattr(bot, 'spot_client', RequestScheduler(stub.client()))
+    monkeypatch.setattr(bot, 'KLINE_STORE_DIR', str(tmp_path))
+    monkeypatch.setattr(clock, 'CLOCK', clock.VirtualClock(NOW))
+    yield stub
+    stub.close()
+
+
+def stored(tmp_path, first, last):
+    store = open_store(str(tmp_path), 'BTCUSDT', '1')
+    rows = [[FIRST + i * MINUTE_MS, i, i + 2, i - 1, i + 1, 10, 100] for i in range(first, last)]
+    store.append({key: np.array([row[i] for row in rows], dtype=float) for i, key in enumerate(bot.KLINE_KEYS)})
+
+
+@pytest.mark.parametrize('first', [None, 96, 90])
+def test_short_store_returns_limit_candles(stub, tmp_path, first):
+    if first is not None:
+        # в хранилище всего несколько последних закрытых свечей
+        stored(tmp_path, first, CANDLES - 1)
+    klines = bot.get_klines('BTCUSDT', '1', 50)
+    assert klines['open_time'] == [FIRST + i * MINUTE_MS for i in range(CANDLES - 50, CANDLES)]
+    assert klines['close'] == [float(i + 1) for i in range(CANDLES - 50, CANDLES)]
+    # закрытые свечи остаются в хранилище, повторный запрос берет у биржи только новые
+    assert len(open_store(str(tmp_path), 'BTCUSDT', '1')) >= 49
+    stub.requests.clear()
+    assert bot.get_klines('BTCUSDT', '1', 50) == klines
+    assert [params['limit'] for params in stub.sent('/v5/market/kline')] == ['1']
+
+
+def test_full_store_fetches_only_new_candles(stub, tmp_path):
+    stored(tmp_path, 0, CANDLES - 3)
+    klines = bot.get_klines('BTCUSDT', '1', 50)
+    assert klines['open_time'] == [FIRST + i * MINUTE_MS for i in range(CANDLES - 50, CANDLES)]
+    assert [params['limit'] for params in stub.sent('/v5/market/kline')] == ['3']
@@ -0,0 +1,91 @@
+import json
+import os
+import numpy as np
+import pytest
+import bybit_FVG_bot as bot
+import kline_backfill
+from kline_backfill import run_backfill, CHECKPOINT_FILE
+from kline_store import KlineStore, open_store
+from request_scheduler import RequestScheduler
+from bybit_stub import BybitStub
+
+MINUTE_MS = 60000
+LISTED = 1704067200000  # первая свеча пары у биржи, 2024-01-01
+CANDLES = 5000
+START = LISTED - 2000 * MINUTE_MS  # запрашиваем и 2000 минут до листинга
+END = LISTED + (CANDLES - 1) * MINUTE_MS
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(kline_backfill, 'BACKFILL_RETRIES', 0)
+    monkeypatch.setattr(kline_backfill, 'BACKOFF_BASE_MS', 0)
+    stub = BybitStub()
+    stub.klines[('BTCUSDT', '1')] = [[LISTED + i * MINUTE_MS, i, i + 2, i - 1, i + 1, 10, 100]
+                                     for i in range(CANDLES)]
+    monkeypatch.setattr(bot, 'spot_client', RequestScheduler(stub.client()))
+    yield stub
+    stub.close()
+
+
+def kline_starts(stub):
+    return sorted(int(params['start']) for params in stub.sent('/v5/market/kline'))
+
+
+def assert_complete(root):
+    klines = open_store(str(root), 'BTCUSDT', '1').read()
+    assert klines['open_time'].tolist() == [LISTED + i * MINUTE_MS for i in range(CANDLES)]
+    assert klines['close'].tolist() == [float(i + 1) for i in range(CANDLES)]
+
+
+def test_empty_ranges_are_checkpointed(stub, tmp_path):
+    assert run_backfill(['BTCUSDT'], '1', START, END, root=str(tmp_path), workers=4) == {'BTCUSDT': (CANDLES, 0)}
+    assert_complete(tmp_path)
+    store = open_store(str(tmp_path), 'BTCUSDT', '1')
+    with open(os.path.join(store.path, CHECKPOINT_FILE)) as f:
+        # по дыре на каждое окно до листинга
+        assert json.load(f) == {'empty': [[START, START + 999 * MINUTE_MS], [START + 1000 * MINUTE_MS,
+                                                                            LISTED - MINUTE_MS]]}
+    # повторный запуск ничего не спрашивает: до листинга свечей нет, остальное уже в хранилище
+    stub.requests.clear()
+    assert run_backfill(['BTCUSDT'], '1', START, END, root=str(tmp_path)) == {'BTCUSDT': (0, 0)}
+    assert kline_starts(stub) == []
+    # с recheck пустые диапазоны запрашиваются снова
+    assert run_backfill(['BTCUSDT'], '1', START, END, root=str(tmp_path), recheck=True) == {'BTCUSDT': (0, 0)}
+    assert kline_starts(stub) == [START, START + 1000 * MINUTE_MS]
+
+
+def test_resume_fetches_only_failed_windows(stub, tmp_path):
+    failed = LISTED + 1000 * MINUTE_MS
+    stub.kline_errors.add(failed)
+    result = run_backfill(['BTCUSDT'], '1', LISTED, END, root=str(tmp_path), workers=4)
+    assert result == {'BTCUSDT': (CANDLES - 1000, 1)}
+    store = open_store(str(tmp_path), 'BTCUSDT', '1')
+    assert store.gaps(MINUTE_MS) == [(failed, failed + 999 * MINUTE_MS)]
+    # окно с ошибкой не пустое: в backfill.json его нет
+    assert not os.path.exists(os.path.join(store.path, CHECKPOINT_FILE))
+    stub.kline_errors.clear()
+    stub.requests.clear()
+    assert run_backfill(['BTCUSDT'], '1', LISTED, END, root=str(tmp_path)) == {'BTCUSDT': (1000, 0)}
+    assert kline_starts(stub) == [failed]
+    assert_complete(tmp_path)
+
+
+def test_gaps_and_history_are_merged_once(stub, tmp_path, monkeypatch):
+    rows = stub.klines[('BTCUSDT', '1')]
+    # живой бот уже сохранил свечи [2000, 3000) и [4000, 5000), разрыв между ними и история до них пусты
+    store = open_store(str(tmp_path), 'BTCUSDT', '1')
+    for first, last in ((2000, 3000), (4000, 5000)):
+        store.append({key: np.array([row[i] for row in rows[first:last]], dtype=float)
+                      for i, key in enumerate(bot.KLINE_KEYS)})
+    # порог дозаписи хвоста ниже размера окна, merge все равно один на задание
+    monkeypatch.setattr(kline_backfill, 'BACKFILL_FLUSH_ROWS', 500)
+    merges = []
+    merge = KlineStore.merge
+    monkeypatch.setattr(KlineStore, 'merge', lambda self, klines: merges.append(len(klines['open_time'])) or
+                        merge(self, klines))
+    result = run_backfill(['BTCUSDT'], '1', LISTED, END, root=str(tmp_path), workers=4)
+    assert result == {'BTCUSDT': (3000, 0)}
+    assert kline_starts(stub) == [LISTED, LISTED + 1000 * MINUTE_MS, LISTED + 3000 * MINUTE_MS]
+    assert merges == [3000]
+    assert_complete(tmp_path)
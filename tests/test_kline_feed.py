@@ -0,0 +1,70 @@
+import numpy as np
+from kline_feed import ReplayKlineFeed
+from kline_store import KlineStore
+
+KEYS = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'turnover']
+
+
+def test_replay_and_store_give_int_open_time(tmp_path):
+    klines = {key: np.arange(1, 6, dtype=np.int64 if key == 'open_time' else float) * 60000 for key in KEYS}
+    feed = ReplayKlineFeed(klines)
+    feed.start()
+    candles = []
+    while (candle := feed.next_candle()) is not None:
+        candles.append(candle)
+    assert [candle['open_time'] for candle in candles] == [60000, 120000, 180000, 240000, 300000]
+    assert all(type(candle['open_time']) is int and type(candle['close']) is float for candle in candles)
+    store = KlineStore(str(tmp_path))
+    store.append(klines)
+    tail = store.tail(2)
+    assert tail['open_time'] == [240000, 300000] and all(type(value) is int for value in tail['open_time'])
+
+
+def test_delays_follow_the_injected_clock(monkeypatch):
+    import bybit_FVG_bot as bot
+    import clock
+    from metrics import histogram
+    time_frame_ms = 15 * 60000
+    # полночь 2020 года: по системным часам задержка была бы в годы
+    monkeypatch.setattr(clock, 'CLOCK', clock.VirtualClock(1577836800000 + time_frame_ms + 1500))
+    bot.observe_delay('test_candle_delay_seconds', 1577836800000, time_frame_ms)
+    assert histogram('test_candle_delay_seconds').max == 1.5
+    feed = ReplayKlineFeed({key: np.zeros(0) for key in KEYS})
+    feed.time_frame_ms = time_frame_ms
+    feed.last_open_time = 1577836800000 - 2 * time_frame_ms
+    feed.fallback = lambda pair, time_frame, limit: {'limit': limit}
+    feed.seed = lambda klines: setattr(feed, 'polled', klines['limit'])
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    assert feed.poll()
+    assert feed.polled == 4
+
+
+def test_next_candle_waits_on_the_injected_clock(monkeypatch):
+    import threading
+    import clock
+    from kline_feed import KlineFeed
+    time_frame_ms = 15 * 60000
+    start = 1577836800000
+    virtual = clock.VirtualClock(start + time_frame_ms + 100)
+    monkeypatch.setattr(clock, 'CLOCK', virtual)
+    polls = []
+
+    def fallback(pair, time_frame, limit):
+        polls.append(clock.now_ms())
+        return {key: [start + i * time_frame_ms for i in range(3)] if key == 'open_time' else [1.0] * 3
+                for key in KEYS}
+    feed = KlineFeed('BTCUSDT', '15', time_frame_ms, fallback=fallback)
+    feed.push({key: start if key == 'open_time' else 1.0 for key in KEYS})
+    assert feed.next_candle()['open_time'] == start
+    candles = []
+    thread = threading.Thread(target=lambda: candles.append(feed.next_candle()), daemon=True)
+    thread.start()
+    # по виртуальным часам срок не наступил: поток ждет, не опрашивая биржу
+    thread.join(0.3)
+    assert thread.is_alive() and polls == []
+    # часы дошли до закрытия следующей свечи с запасом: добираем ее по REST сразу
+    virtual.set(start + 2 * time_frame_ms + feed.grace_ms)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert polls == [start + 2 * time_frame_ms + feed.grace_ms]
+    assert candles[0]['open_time'] == start + time_frame_ms
@@ -0,0 +1,87 @@
+import pytest
+import order_gateway
+from order_gateway import OrderGateway
+from request_scheduler import RequestScheduler
+from bybit_stub import BybitStub, REJECT_MSG, NOT_FOUND_MSG
+
+NO_RESULT = {'ok': False, 'msg': 'No result', 'orderId': None}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(order_gateway, 'BACKOFF_BASE_MS', 0)
+    stub = BybitStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def gateway(stub):
+    # как в боте: pybit за планировщиком запросов, который разбирает (ответ, время, заголовки)
+    return OrderGateway(RequestScheduler(stub.client()), window_ms=50, max_batch=3)
+
+
+def order(i, **params):
+    params = dict({'symbol': 'BTCUSDT', 'side': 'Buy', 'orderType': 'Limit', 'qty': '0.001',
+                   'price': str(30000 + i), 'orderLinkId': f'fvg-{i}'}, **params)
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def wait(futures):
+    return [future.result(timeout=10) for future in futures]
+
+
+def test_orders_are_split_into_batches(stub, gateway):
+    results = wait([gateway.place(order(i)) for i in range(7)])
+    batches = stub.sent('/v5/order/create-batch')
+    assert [len(batch['request']) for batch in batches] == [3, 3]
+    assert [params['orderLinkId'] for params in stub.sent('/v5/order/create')] == ['fvg-6']
+    assert all(batch['category'] == 'spot' for batch in batches)
+    assert [result['orderId'] for result in results] == [stub.orders[f'fvg-{i}'] for i in range(7)]
+    assert all(result['ok'] for result in results)
+
+
+def test_batch_results_come_from_ret_ext_info(stub, gateway):
+    stub.reject.add('fvg-1')
+    results = wait([gateway.place(order(i)) for i in range(3)])
+    assert len(stub.sent('/v5/order/create-batch')) == 1
+    assert results[0] == {'ok': True, 'msg': 'OK', 'orderId': stub.orders['fvg-0']}
+    assert not results[1]['ok'] and results[1]['msg'] == REJECT_MSG
+    assert results[2] == {'ok': True, 'msg': 'OK', 'orderId': stub.orders['fvg-2']}
+    assert 'fvg-1' not in stub.orders
+
+
+def test_cancel_batch_results_come_from_ret_ext_info(stub, gateway):
+    placed = wait([gateway.place(order(i)) for i in range(2)])
+    results = wait([gateway.cancel('BTCUSDT', placed[0]['orderId']), gateway.cancel('BTCUSDT', '404')])
+    assert [len(batch['request']) for batch in stub.sent('/v5/order/cancel-batch')] == [2]
+    assert results[0]['ok'] and results[0]['orderId'] == placed[0]['orderId']
+    assert not results[1]['ok'] and results[1]['msg'] == NOT_FOUND_MSG
+    assert list(stub.orders) == ['fvg-1']
+
+
+@pytest.mark.parametrize('count, path', [(1, '/v5/order/create'), (3, '/v5/order/create-batch')])
+def test_retry_after_dropped_connection_keeps_order_link_id(stub, gateway, count, path):
+    stub.drop = 1
+    # orderLinkId не задан, шлюз ставит свой
+    results = wait([gateway.place(order(i, orderLinkId=None)) for i in range(count)])
+    attempts = stub.sent(path)
+    assert len(attempts) == 2
+    assert attempts[0] == attempts[1]
+    assert all(result['ok'] for result in results)
+    assert len(stub.orders) == count
+
+
+def test_missing_batch_results_fall_back_to_no_result(stub, gateway):
+    stub.truncate = True
+    results = wait([gateway.place(order(i)) for i in range(3)])
+    assert [result['ok'] for result in results[:2]] == [True, True]
+    assert results[2] == NO_RESULT
+
+
+def test_exhausted_retries_fall_back_to_no_result(stub, gateway):
+    stub.drop = 100
+    results = wait([gateway.place(order(i)) for i in range(2)])
+    assert results == [NO_RESULT, NO_RESULT]
+    assert len(stub.sent('/v5/order/create-batch')) == order_gateway.BATCH_RETRIES + 1
+    assert not stub.orders
@@ -0,0 +1,49 @@
+import threading
+import clock
+from order_tracker import OrderTracker
+
+HOUR_MS = 3600 * 1000
+START = 1704067200000
+
+
+def limit_order(order_id, created):
+    return {'orderId': order_id, 'orderLinkId': '', 'symbol': 'BTCUSDT', 'side': 'Buy', 'orderType': 'Limit',
+            'orderStatus': 'New', 'stopOrderType': '', 'createdTime': str(created), 'updatedTime': str(created),
+            'category': 'spot'}
+
+
+def test_wait_follows_virtual_clock(monkeypatch):
+    virtual = clock.VirtualClock(START)
+    monkeypatch.setattr(clock, 'CLOCK', virtual)
+    fetches = []
+    tracker = OrderTracker(lambda pair: fetches.append(pair) or [limit_order('1', START)], 'BTCUSDT',
+                           HOUR_MS, HOUR_MS, reconcile_ms=10 * HOUR_MS, batch_ms=0)
+    expired = []
+    thread = threading.Thread(target=lambda: expired.extend(tracker.wait_expired()), daemon=True)
+    thread.start()
+    # по реальным часам прошло время, по виртуальным - нет: ордер не истек, лишних сверок нет
+    thread.join(0.3)
+    assert thread.is_alive() and fetches == ['BTCUSDT']
+    virtual.set(START + HOUR_MS // 2)
+    thread.join(0.3)
+    assert thread.is_alive() and fetches == ['BTCUSDT']
+    # сдвиг часов до срока будит трекер сразу, а не через час реального времени
+    virtual.set(START + HOUR_MS)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [order['orderId'] for order in expired] == ['1']
+
+
+def test_new_order_wakes_waiting_tracker(monkeypatch):
+    virtual = clock.VirtualClock(START)
+    monkeypatch.setattr(clock, 'CLOCK', virtual)
+    tracker = OrderTracker(lambda pair: [], 'BTCUSDT', HOUR_MS, HOUR_MS, reconcile_ms=10 * HOUR_MS, batch_ms=0)
+    expired = []
+    thread = threading.Thread(target=lambda: expired.extend(tracker.wait_expired()), daemon=True)
+    thread.start()
+    thread.join(0.1)
+    # ордер, созданный час назад, уже истек: сообщение вебсокета будит трекер без сдвига часов
+    tracker.on_order_message({'data': [limit_order('2', START - HOUR_MS)]})
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [order['orderId'] for order in expired] == ['2']
@@ -0,0 +1,93 @@
+import pytest
+import bybit_FVG_bot as bot
+from order_tracker import OrderTracker
+
+HOUR_MS = 3600 * 1000
+
+
+def exchange_order(order_id, link_id='', side='Buy', status='New', tpsl=False, created=1000, qty=0.001):
+    return {'orderId': order_id, 'orderLinkId': link_id, 'symbol': 'BTCUSDT', 'side': side, 'orderType': 'Limit',
+            'qty': str(qty),
+            'orderStatus': status, 'stopOrderType': 'BidirectionalTpslOrder' if tpsl else '',
+            'createdTime': str(created), 'updatedTime': str(created), 'category': 'spot'}
+
+
+@pytest.fixture
+def own_orders(monkeypatch):
+    orders = {}
+    monkeypatch.setattr(bot, 'OWN_ORDERS', orders)
+    return orders
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = OrderTracker(lambda pair: [], 'BTCUSDT', HOUR_MS, HOUR_MS, owns=bot.is_own_order)
+    monkeypatch.setattr(bot, 'ORDER_TRACKER', tracker)
+    return tracker
+
+
+def test_tracker_skips_foreign_orders(own_orders, tracker):
+    own_orders['mine'] = bot.own_order('BTCUSDT', 'Buy', 30000.0, 0.002, 500)
+    own_orders['filled'] = dict(bot.own_order('BTCUSDT', 'Buy', 30000.0, 0.003, 500), filled=0.0015)
+    tracker.on_order_message({'data': [
+        exchange_order('1', 'mine', qty=0.002),
+        exchange_order('2', 'manual'),
+        # TP/SL на исполненную часть нашего ордера: биржа заводит его без orderLinkId
+        exchange_order('3', side='Sell', tpsl=True, created=2000, qty=0.0015),
+        # ручная позиция с TP/SL на другое количество
+        exchange_order('4', side='Sell', tpsl=True, created=2000, qty=0.01),
+        # TP/SL в ту же сторону, что и наш ордер
+        exchange_order('5', side='Buy', tpsl=True, created=2000, qty=0.0015),
+        # TP/SL заведен раньше нашего ордера
+        exchange_order('6', side='Sell', tpsl=True, created=100, qty=0.0015),
+    ]})
+    assert sorted(tracker.orders) == ['1', '3']
+    expired = tracker.pop_expired(10 * HOUR_MS)
+    assert sorted(order['orderId'] for order in expired) == ['1', '3']
+
+
+def test_tpsl_is_matched_to_recorded_fills(own_orders, tracker):
+    own_orders['mine'] = bot.own_order('BTCUSDT', 'Buy', 30000.0, 0.002, 500)
+    # TP/SL пришел раньше исполнения: пока не наш
+    tracker.on_order_message({'data': [exchange_order('3', side='Sell', tpsl=True, created=2000, qty=0.001)]})
+    assert not tracker.orders
+    bot.on_execution_message({'data': [{'orderLinkId': 'mine', 'symbol': 'BTCUSDT', 'execQty': '0.001',
+                                        'execPrice': '30000', 'execTime': '1500'}]})
+    # биржа удержала комиссию из купленной монеты
+    tracker.on_order_message({'data': [exchange_order('3', side='Sell', tpsl=True, created=2000, qty=0.000999)]})
+    assert sorted(tracker.orders) == ['3']
+    # частичное исполнение увеличивает TP/SL вслед за записанным количеством
+    bot.on_execution_message({'data': [{'orderLinkId': 'mine', 'symbol': 'BTCUSDT', 'execQty': '0.001',
+                                        'execPrice': '30000', 'execTime': '1600'}]})
+    tracker.on_order_message({'data': [exchange_order('3', side='Sell', tpsl=True, created=2000, qty=0.002)]})
+    assert sorted(tracker.orders) == ['3']
+
+
+def test_restored_orders_are_reconciled_with_exchange(own_orders, tracker, monkeypatch):
+    own_orders.update({
+        'open': bot.own_order('BTCUSDT', 'Buy', 30000.0, 0.001, 500),
+        'cancelled': bot.own_order('BTCUSDT', 'Buy', 30000.0, 0.001, 500),
+        'filled': dict(bot.own_order('BTCUSDT', 'Sell', 31000.0, 0.001, 500), filled=0.001),
+        'tpsl_parent': dict(bot.own_order('ETHUSDT', 'Buy', 2000.0, 0.01, 500), filled=0.01),
+        'unfilled_eth': bot.own_order('ETHUSDT', 'Buy', 2000.0, 0.01, 500),
+    })
+    orders = [exchange_order('1', 'open'), exchange_order('2', 'manual'),
+              dict(exchange_order('3', side='Sell', tpsl=True, created=2000, qty=0.01), symbol='ETHUSDT'),
+              dict(exchange_order('4', side='Sell', tpsl=True, created=2000, qty=0.5), symbol='ETHUSDT')]
+    monkeypatch.setattr(bot, 'get_orders', lambda pair=bot.PAIR: orders)
+    assert bot.reconcile_own_orders()
+    assert sorted(own_orders) == ['filled', 'open', 'tpsl_parent']
+    assert sorted(tracker.orders) == ['1', '3']
+
+
+def test_failed_order_is_forgotten(own_orders, monkeypatch):
+    order_params = {'symbol': 'BTCUSDT', 'side': 'Buy', 'price': '30000', 'qty': '0.001'}
+    monkeypatch.setattr(bot, 'calc_order_params', lambda *args: dict(order_params))
+    monkeypatch.setattr(bot, 'check_order_params', lambda *args: True)
+    monkeypatch.setattr(bot.FILTER_CACHE, 'get', lambda pair: {})
+    seen = []
+    # ордер должен быть в OWN_ORDERS уже во время отправки
+    monkeypatch.setattr(bot, 'send_order', lambda params: seen.append(params['orderLinkId'] in own_orders))
+    assert not bot.place_fvg_order(False, True, {'low': [1.0], 'high': [2.0]})
+    assert seen == [True]
+    assert not own_orders
@@ -0,0 +1,44 @@
+import time
+import pytest
+import bybit_FVG_bot as bot
+from request_scheduler import RequestScheduler, RATE_LIMIT_RETRIES
+from bybit_stub import BybitStub
+
+
+@pytest.fixture
+def stub():
+    stub = BybitStub()
+    stub.klines[('BTCUSDT', '1')] = [[60000, 1, 1, 1, 1, 1, 1]]
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def scheduler(stub):
+    def factory():
+        # клиент бота, только ходит в заглушку
+        client = bot.make_client()
+        client.endpoint = stub.url
+        return client
+    return RequestScheduler(factory=factory)
+
+
+def test_rate_limit_pauses_endpoint_until_reset(stub, scheduler):
+    stub.rate_limit = 1
+    stub.reset_ms = int(time.time() * 1000) + 300
+    response = scheduler.get_kline(category='spot', symbol='BTCUSDT', interval='1')
+    # 10006 дошел до планировщика, а не был повторен внутри pybit
+    assert scheduler.counts['rate_limited'] == 1
+    assert response['result']['list'] == [['60000', '1', '1', '1', '1', '1', '1']]
+    assert len(stub.sent('/v5/market/kline')) == 2
+    assert time.time() * 1000 >= stub.reset_ms
+
+
+def test_rate_limit_gives_up_after_retries(stub, scheduler):
+    stub.rate_limit = 100
+    # паузы эндпоинта между повторами здесь не ждем
+    scheduler.acquire = lambda name: None
+    with pytest.raises(Exception) as error:
+        scheduler.get_kline(category='spot', symbol='BTCUSDT', interval='1')
+    assert error.value.status_code == 10006
+    assert len(stub.sent('/v5/market/kline')) == RATE_LIMIT_RETRIES + 1
@@ -0,0 +1,21 @@
+import bybit_FVG_bot as bot
+
+
+def test_start_fails_without_candle_feeds(monkeypatch):
+    monkeypatch.setattr(bot, 'TIME_FRAMES', ['5', '15'])
+    monkeypatch.setattr(bot, 'make_resampled_feeds', lambda: False)
+    monkeypatch.setattr(bot, 'BOT_THREADS', [])
+    assert not bot.start_bot()
+    assert bot.BOT_THREADS == []
+    assert bot.run_command('start') == 'Error starting the bot, see the log'
+    assert bot.run_command('status') == 'stopped'
+
+
+def test_start_survives_exchange_error_in_feeds(monkeypatch):
+    def fail():
+        raise RuntimeError('Internal server error')
+    monkeypatch.setattr(bot, 'TIME_FRAMES', ['5'])
+    monkeypatch.setattr(bot, 'make_resampled_feeds', fail)
+    monkeypatch.setattr(bot, 'BOT_THREADS', [])
+    assert not bot.start_bot()
+    assert bot.BOT_THREADS == []
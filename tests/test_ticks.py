@@ -0,0 +1,30 @@
+import pytest
+import bybit_FVG_bot as bot
+from ticks import TickScale
+
+
+@pytest.mark.parametrize('step, value, floor, ceil, text', [
+    ('0.01', 0.29, 29, 29, '0.29'),  # 0.29 / 0.01 = 28.999999999999996
+    ('0.01', 0.3 * 3, 90, 90, '0.90'),
+    ('0.5', 30000.74, 60001, 60002, '30000.5'),
+    ('0.000001', 0.0012345678, 1234, 1235, '0.001234'),
+    ('10', 12345.0, 1234, 1235, '12340'),
+    ('1e-08', 0.00000003, 3, 3, '0.00000003'),
+])
+def test_tick_grid(step, value, floor, ceil, text):
+    scale = TickScale(step)
+    assert scale.floor(value) == floor
+    assert scale.ceil(value) == ceil
+    assert scale.format(floor) == text
+
+
+def test_order_params_on_non_cent_ticks():
+    order_filters = {'base_prec': 0.0001, 'quote_prec': 1e-08, 'min_quan': 0.0001, 'max_quan': 100.0,
+                     'min_amount': 5.0, 'max_amount': 2000000.0, 'price_prec': 0.5}
+    params = {'qty': 0.00029999, 'price': 30000.74, 'takeProfit': 31000.3, 'stopLoss': 29500.99}
+    assert bot.check_order_params(dict(params), order_filters, True, False) == {
+        'qty': '0.0002', 'price': '30000.5', 'takeProfit': '31000.0', 'stopLoss': '29500.5'}
+    # стоимость ровно на нижней границе проходит, на шаг меньше - нет
+    at_min = dict(params, qty=0.001, price=5000.0)
+    assert bot.check_order_params(dict(at_min), dict(order_filters, min_amount=5.0), True, False)
+    assert not bot.check_order_params(dict(at_min), dict(order_filters, min_amount=5.0000001), True, False)
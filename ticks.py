@@ -0,0 +1,77 @@
+import math
+from decimal import Decimal
+from functools import lru_cache
+
+GRID_ULPS = 2  # число шагов не дальше стольких ulp от целого считается лежащим на линии сетки: это ошибка float
+
+
+def to_decimal(value):
+    '''
+    Функция переводит число в Decimal без ошибки двоичного представления
+    Для float берется его кратчайшая десятичная запись, то есть то число, которое прислала биржа
+    '''
+    if isinstance(value, Decimal):
+        return value
+    # float() убирает обертку numpy, у которой repr не число
+    return Decimal(repr(float(value)) if isinstance(value, float) else str(value))
+
+
+class TickScale:
+    '''
+    Целочисленная сетка с шагом step: тик цены или шаг количества инструмента
+    Шаг один раз разбирается точно через Decimal, дальше значения переводятся в целое число шагов
+    и обратно в строку для биржи только в float и int, без Decimal на каждый ордер
+    '''
+    __slots__ = ('step', 'places', 'units', 'size')
+
+    def __init__(self, step):
+        self.step = to_decimal(step)
+        # сколько знаков после запятой у шага, столько их и в строке для биржи
+        self.places = max(0, -self.step.normalize().as_tuple().exponent)
+        self.units = int(self.step.scaleb(self.places)) # шаг в единицах 10**-places
+        self.size = float(self.step)
+
+    def floor(self, value):
+        '''
+        Функция возвращает число целых шагов, не превышающее value
+        '''
+        steps = value / self.size
+        nearest = round(steps)
+        # 0.29 / 0.01 = 28.999999999999996: значение на линии сетки не теряет шаг из-за ошибки float
+        if abs(steps - nearest) <= GRID_ULPS * math.ulp(nearest):
+            return nearest
+        return math.floor(steps)
+
+    def ceil(self, value):
+        '''
+        Функция возвращает наименьшее число целых шагов, не меньшее value
+        '''
+        steps = value / self.size
+        nearest = round(steps)
+        if abs(steps - nearest) <= GRID_ULPS * math.ulp(nearest):
+            return nearest
+        return math.ceil(steps)
+
+    def scaled(self, units):
+        '''
+        Функция возвращает units шагов целым числом единиц 10**-places
+        '''
+        return units * self.units
+
+    def format(self, units):
+        '''
+        Функция возвращает строку с числом units шагов для запроса к бирже
+        '''
+        scaled = units * self.units
+        if not self.places:
+            return str(scaled)
+        whole, frac = divmod(abs(scaled), 10 ** self.places)
+        return f'{"-" if scaled < 0 else ""}{whole}.{frac:0{self.places}d}'
+
+
+@lru_cache(maxsize=None)
+def tick_scale(step):
+    '''
+    Функция возвращает сетку для шага step, сетки одного шага переиспользуются
+    '''
+    return TickScale(step)